@@ -0,0 +1,138 @@
+import os
+import secrets
+import time
+from datetime import datetime, timedelta
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from sqlalchemy import and_, delete, or_, select
+from sqlalchemy.exc import IntegrityError
+
+from database import User, Prediction, PeriodLog, CycleSummary
+
+
+# last_seen_at is only rewritten once this old, so guest requests rarely update the users row
+TOUCH_INTERVAL = timedelta(days=1)
+
+
+class InvalidSession(ValueError):
+    pass
+
+
+def load_secret_key(path):
+    """Reads the signing key from `path`, creating it on first use.
+
+    O_EXCL makes the first of several starting workers write the key and the
+    others read it, so all of them accept each other's tokens.
+    """
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50):
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.01)
+        raise RuntimeError("Empty secret key file: " + path)
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(key)
+    return key
+
+
+class AnonymousSessions:
+    """Guest sessions as signed tokens instead of users rows.
+
+    /anonymous-login only signs a random key; the users row is created the
+    first time a guest writes something. A token stays valid for as long as
+    its guest keeps using it: it expires `ttl` after the guest was last seen
+    (or after it was issued, if it never reached a users row), which is also
+    when purge_expired() removes the guest.
+    """
+
+    def __init__(self, secret_key, ttl=timedelta(days=30)):
+        self.ttl = ttl
+        self._serializer = URLSafeTimedSerializer(secret_key, salt="anonymous-session")
+
+    def issue(self):
+        return self._serializer.dumps(secrets.token_urlsafe(16))
+
+    def key(self, token):
+        """(key, issue time) of a token with a valid signature."""
+        try:
+            key, issued = self._serializer.loads(token, return_timestamp=True)
+        except BadSignature:
+            raise self.expired()
+        return key, issued.replace(tzinfo=None)
+
+    @staticmethod
+    def expired():
+        return InvalidSession("Invalid or expired guest session, please continue as guest again")
+
+    def resolve(self, token, session, now=None):
+        """The users row for a guest token, created (and committed) on first use.
+
+        Every call counts as activity: last_seen_at is moved forward (at most
+        once per TOUCH_INTERVAL) and committed here, so it holds even when
+        the rest of the request fails.
+        """
+        now = now or datetime.utcnow()
+        key, issued = self.key(token)
+        query = select(User).where(User.anonymous_key == key)
+        user = session.scalar(query)
+        if user is not None:
+            if now - (user.last_seen_at or user.created_at) > self.ttl:
+                # inactive for too long; purge_expired() just has not run yet
+                raise self.expired()
+            if self.touch(user, now):
+                session.commit()
+        elif now - issued > self.ttl:
+            raise self.expired()
+        else:
+            user = User(name="Anonymous", is_anonymous=True, anonymous_key=key, last_seen_at=now)
+            session.add(user)
+            try:
+                session.commit()
+            except IntegrityError:
+                # the same guest's first two writes raced; the other one created it
+                session.rollback()
+                user = session.scalar(query)
+        return user
+
+    @staticmethod
+    def touch(user, now=None):
+        """Moves a guest's last_seen_at forward if it is stale; True if it changed."""
+        now = now or datetime.utcnow()
+        if user.is_anonymous and (user.last_seen_at is None or now - user.last_seen_at >= TOUCH_INTERVAL):
+            user.last_seen_at = now
+            return True
+        return False
+
+
+def purge_expired(engine, ttl, batch_size=200, pause=0.05, now=None):
+    """Deletes guests inactive for `ttl` together with their data.
+
+    Works through `batch_size` users per transaction, pausing `pause` seconds
+    in between, so the write lock (SQLite) or row locks (PostgreSQL, where
+    rows locked by a concurrent write are skipped) are only held briefly.
+    Guests created before last_seen_at existed count from created_at.
+    Returns the number of deleted rows per table.
+    """
+    cutoff = (now or datetime.utcnow()) - ttl
+    users = User.__table__
+    expired = select(users.c.id).where(
+        users.c.is_anonymous,
+        or_(users.c.last_seen_at < cutoff, and_(users.c.last_seen_at.is_(None), users.c.created_at < cutoff))
+    ).limit(batch_size).with_for_update(skip_locked=True)
+    children = [Prediction.__table__, PeriodLog.__table__, CycleSummary.__table__]
+    counts = dict.fromkeys([users.name] + [table.name for table in children], 0)
+    while True:
+        with engine.begin() as conn:
+            ids = conn.scalars(expired).all()
+            if not ids:
+                return counts
+            for table in children:
+                counts[table.name] += conn.execute(delete(table).where(table.c.user_id.in_(ids))).rowcount
+            counts[users.name] += conn.execute(delete(users).where(users.c.id.in_(ids))).rowcount
+        if pause:
+            time.sleep(pause)
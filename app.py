@@ -1,23 +1,92 @@
 from flask import render_template, Flask, request, jsonify
 from database import db, User, Prediction, PeriodLog
-import pickle
+from inference import RiskPolicy
+from utils.feature_engineering import SCHEMA
+from model_registry import ModelRegistry
+from batch import BatchError, read_records, build_matrix
+from passwords import PasswordHasher, KDFBusy, server_timing
+from migrations import upgrade, check_query_plans
+from storage import CommitTimeout, GroupCommitter, configure_sqlite, engine_options
+from settings import Settings
+from anonymous import AnonymousSessions, InvalidSession, load_secret_key, purge_expired
+import cycle_summary
+import forecasting
+import metrics
+import rollups
+import archive
+import response_cache
+from pagination import PaginationError, keyset_response
+from nutrition import KnowledgeBaseLoader
+from sqlalchemy import select, insert, and_, func
+from sqlalchemy.engine import make_url
+import click
 import os
 from datetime import datetime, timedelta
 import json
+import gzip
 
 app = Flask(__name__)
 
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///shecare.db"
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config.from_object(Settings)
+if not app.config["SECRET_KEY"]:
+    os.makedirs(app.instance_path, exist_ok=True)
+    app.config["SECRET_KEY"] = load_secret_key(os.path.join(app.instance_path, "secret_key"))
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app.config["SQLALCHEMY_DATABASE_URI"], app.config)
 
 db.init_app(app)
 
 with app.app_context():
-    db.create_all()
-
-pcos_model = pickle.load(open("model/pcos_model.pkl", "rb"))
-anemia_model = pickle.load(open("model/anemia_model.pkl", "rb"))
-bc_model = pickle.load(open("model/breast_cancer_model.pkl", "rb"))
+    configure_sqlite(db.engine, app.config["SQLITE_BUSY_TIMEOUT_MS"])
+    committer = GroupCommitter(
+        db.engine, app.config["GROUP_COMMIT_MS"] / 1000, timeout=app.config["GROUP_COMMIT_TIMEOUT"]
+    ) if app.config["GROUP_COMMIT_MS"] else None
+    if app.config["METRICS_ENABLED"]:
+        profiler = None
+        if app.config["PROFILE_SLOW_MS"]:
+            profiler = metrics.SlowRequestProfiler(
+                app.config["PROFILE_SLOW_MS"] / 1000, app.config["PROFILE_DIR"], app.config["PROFILE_INTERVAL_MS"] / 1000
+            )
+        metrics.init_app(app, db.engine, profiler)
+
+os.makedirs(os.path.dirname(app.config["RESPONSE_CACHE_VERSIONS"]), exist_ok=True)
+versions = response_cache.VersionTable(app.config["RESPONSE_CACHE_VERSIONS"])
+single_host = app.config["RESPONSE_CACHE_SINGLE_HOST"]
+if single_host is None:
+    single_host = make_url(app.config["SQLALCHEMY_DATABASE_URI"]).get_backend_name() == "sqlite"
+responses = response_cache.ResponseCache(
+    versions, app.config["RESPONSE_CACHE_MB"] * 2 ** 20, app.config["RESPONSE_CACHE_MAX_BODY_KB"] * 1024
+) if app.config["RESPONSE_CACHE_MB"] and single_host else None
+
+
+def cached(view):
+    # views of one user's data; every write to that data must bump `versions` after committing
+    return responses.view(view) if responses is not None else view
+
+
+guests = AnonymousSessions(app.config["SECRET_KEY"], timedelta(days=app.config["ANONYMOUS_TTL_DAYS"]))
+
+models = ModelRegistry()
+risk_policy = RiskPolicy.from_file(app.config["RISK_CONFIG"])
+
+# Prediction column holding each model's probability
+PROBABILITY_COLUMNS = {
+    "pcos_risk": "pcos_probability",
+    "anemia_risk": "anemia_probability",
+    "breast_cancer_risk": "breast_cancer_probability"
+}
+
+nutrition_kb = KnowledgeBaseLoader()
+
+hasher = PasswordHasher(
+    cost=app.config["KDF_COST"], workers=app.config["KDF_WORKERS"], max_queue=app.config["KDF_MAX_QUEUE"]
+)
+metrics.REGISTRY.append(metrics.Snapshot(hasher.stats, {
+    "operations": ("shecare_kdf_operations_total", "Password hashes and verifications run on the KDF pool."),
+    "rejected": ("shecare_kdf_rejected_total", "Password operations refused (503) because the KDF queue was full."),
+    "upgraded": ("shecare_kdf_rehashed_total", "Stored passwords re-hashed at the current cost on login."),
+    "queue_seconds": ("shecare_kdf_queue_seconds_total", "Time password operations waited for a KDF thread."),
+    "kdf_seconds": ("shecare_kdf_seconds_total", "Time spent running scrypt.")
+}))
 
 
 @app.route("/")
@@ -45,90 +114,302 @@ def lifestyle():
     return render_template("lifestyle.html")
 
 
+@app.errorhandler(KDFBusy)
+@app.errorhandler(CommitTimeout)
+def server_busy(e):
+    return jsonify({"status": "error", "message": "Server busy, please retry"}), 503
+
+
+@app.errorhandler(InvalidSession)
+def invalid_session(e):
+    return jsonify({"status": "error", "message": str(e)}), 401
+
+
+def credentials_problem(data, fields):
+    """The 400 message for a /register or /login body whose fields are not all strings, else None."""
+    if not isinstance(data, dict):
+        return "Expected a JSON object"
+    for name in fields:
+        if data.get(name) is None:
+            return "Missing field '%s'" % name
+        if not isinstance(data[name], str):
+            return "Field '%s' must be a string" % name
+    return None
+
+
 @app.route("/register", methods=["POST"])
 def register():
     data = request.json
+    problem = credentials_problem(data, ("name", "email", "password"))
+    if problem:
+        return jsonify({"status": "error", "message": problem}), 400
     existing_user = User.query.filter_by(email=data["email"]).first()
     if existing_user:
         return jsonify({"status": "error", "message": "User already exists"}), 400
-    user = User(name=data["name"], email=data["email"], password=data["password"], is_anonymous=False)
+    password_hash, timing = hasher.hash(data["password"])
+    user = User(name=data["name"], email=data["email"], password=password_hash, is_anonymous=False)
     db.session.add(user)
     db.session.commit()
-    return jsonify({"status": "registered", "user_id": user.id})
+    response = jsonify({"status": "registered", "user_id": user.id})
+    response.headers["Server-Timing"] = server_timing(timing)
+    return response
 
 
 @app.route("/login", methods=["POST"])
 def login():
     data = request.json
+    problem = credentials_problem(data, ("email", "password"))
+    if problem:
+        return jsonify({"status": "error", "message": problem}), 400
     user = User.query.filter_by(email=data["email"]).first()
-    if user and user.password == data["password"]:
-        return jsonify({"status": "success", "user_id": user.id, "name": user.name})
-    return jsonify({"status": "failed", "message": "Invalid credentials"}), 401
+    # an unknown email is checked against no hash, which costs as much as a wrong password
+    ok, timing = hasher.verify(user.password if user else None, data["password"])
+    if not ok:
+        return jsonify({"status": "failed", "message": "Invalid credentials"}), 401
+    timings = [timing]
+    if hasher.needs_rehash(user.password):
+        # plaintext rows and rows hashed with an older cost are upgraded on the next good login
+        user.password, upgrade_timing = hasher.hash(data["password"])
+        db.session.commit()
+        hasher.record_upgrade()
+        timings.append(upgrade_timing)
+    response = jsonify({"status": "success", "user_id": user.id, "name": user.name})
+    response.headers["Server-Timing"] = server_timing(*timings)
+    return response
 
 
 @app.route("/anonymous-login", methods=["POST"])
 def anonymous():
-    user = User(name="Anonymous", email=None, password=None, is_anonymous=True)
-    db.session.add(user)
-    db.session.commit()
-    return jsonify({"user_id": user.id, "anonymous": True})
+    # no users row yet: send the token as "anonymous_token" with the first
+    # write, whose response carries the new user_id
+    return jsonify({"user_id": None, "anonymous": True, "token": guests.issue()})
+
+
+def load_user(data, session=None):
+    """The user a write is for: data["user_id"], or the guest behind data["anonymous_token"]."""
+    session = session or db.session
+    if data.get("anonymous_token"):
+        return guests.resolve(data["anonymous_token"], session)
+    user = session.get(User, data["user_id"])
+    if user is not None:
+        guests.touch(user)  # a guest writing by user_id; committed with the write
+    return user
+
+
+def new_user_fields(data, user_id):
+    # tells a guest which user_id its token now maps to
+    return {"user_id": user_id} if data.get("anonymous_token") else {}
+
+
+def score_row(features):
+    # the three risk models run as one fused pass, so they are timed together
+    with metrics.stage("inference"):
+        labels, probabilities = models.engine().score_one(features, risk_policy)
+    result = dict(labels)
+    for name, column in PROBABILITY_COLUMNS.items():
+        result[column] = probabilities[name]
+    return result
+
+
+AGE = SCHEMA.features.index("age")
+MAX_AGE = 150
+
+
+def stored_age(value):
+    # the input age is stored for the analytics age bands; an implausible one
+    # (which could also overflow the INTEGER column) is kept as unknown
+    return int(value) if 0 <= value <= MAX_AGE else None
+
+
+def prediction_row(result, user_id, features):
+    return dict(result, user_id=user_id, age=stored_age(features[AGE]))
 
 
 @app.route("/predict", methods=["POST"])
 def predict():
     data = request.json
-    user = User.query.get(data["user_id"])
+    user = load_user(data)
     if not user:
         return jsonify({"status": "error", "message": "Invalid user"}), 400
-    features = [[
-        float(data["age"]), float(data["BMI"]), float(data["cycle_variation"]),
-        float(data["acne_severity"]), float(data["hair_growth"]), float(data["fatigue"]),
-        float(data["hemoglobin"]), float(data["breast_lump"]), float(data["breast_pain"])
-    ]]
-    pcos = int(pcos_model.predict(features)[0])
-    anemia = int(anemia_model.predict(features)[0])
-    bc = int(bc_model.predict(features)[0])
-    prediction = Prediction(user_id=data["user_id"], pcos_risk=pcos, anemia_risk=anemia, breast_cancer_risk=bc)
-    db.session.add(prediction)
-    db.session.commit()
-    return jsonify({"pcos_risk": pcos, "anemia_risk": anemia, "breast_cancer_risk": bc})
+    if data.get("cycle_variation") in (None, ""):
+        # derived from the stored period logs when the client leaves it out
+        data["cycle_variation"] = cycle_summary.cycle_variation(cycle_summary.get_summary(user.id))
+    with metrics.stage("features"):
+        X, problems = SCHEMA.prepare(SCHEMA.columns([data]))
+    if problems:
+        return jsonify({"status": "error", "message": problems[0]}), 400
+    result = score_row(X[0])
+    # read before commit expires `user`: reloading it would hold a pooled
+    # connection while this thread waits on the group committer
+    user_id = user.id
+    if committer is not None:
+        db.session.commit()  # the memoized cycle_variation and guest last_seen_at, if changed
+        committer.insert(Prediction.__table__, prediction_row(result, user_id, X[0]))
+    else:
+        db.session.add(Prediction(**prediction_row(result, user_id, X[0])))
+        db.session.commit()
+    versions.bump([user_id])
+    return jsonify(dict(result, **new_user_fields(data, user_id)))
+
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    try:
+        records = read_records(request)
+        with metrics.stage("batch_features"):
+            X, user_ids, rows, errors = build_matrix(
+                records, request.values.get("user_id"), cycle_summary.cycle_variations
+            )
+    except (BatchError, UnicodeDecodeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    known = set(db.session.scalars(select(User.id).where(User.id.in_(set(user_ids.tolist())))))
+    valid = []
+    for i, uid in enumerate(user_ids.tolist()):
+        if uid in known:
+            valid.append(i)
+        else:
+            errors.append({"row": rows[i], "message": "Invalid user"})
+    errors.sort(key=lambda e: e["row"])
+    with metrics.stage("batch_inference"):
+        labels, probabilities = models.engine().score(X[valid], risk_policy)
+    now = datetime.utcnow()
+    columns = list(PROBABILITY_COLUMNS) + list(PROBABILITY_COLUMNS.values())
+    values = [
+        dict(zip(columns, label_row + proba_row), user_id=uid, age=stored_age(age), created_at=now)
+        for uid, age, label_row, proba_row
+        in zip(user_ids[valid].tolist(), X[valid, AGE].tolist(), labels.tolist(), probabilities.tolist())
+    ]
+    ids = []
+    if values:
+        table = Prediction.__table__
+        stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        ids = db.session.connection().execute(stmt, values).scalars().all()
+        db.session.commit()
+        versions.bump(user_ids[valid].tolist())
+    results = [
+        dict({name: v[name] for name in columns}, row=rows[i], prediction_id=pid)
+        for i, pid, v in zip(valid, ids, values)
+    ]
+    return jsonify({"status": "success", "count": len(results), "results": results, "errors": errors})
+
+
+def _format_datetime(value):
+    return value.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format_date(value):
+    return value.strftime("%Y-%m-%d")
+
+
+def _parse_symptoms(value):
+    return json.loads(value) if value else []
+
+
+HISTORY_FIELDS = {
+    "id": (Prediction.id, None),
+    "pcos": (Prediction.pcos_risk, None),
+    "anemia": (Prediction.anemia_risk, None),
+    "breast_cancer": (Prediction.breast_cancer_risk, None),
+    "pcos_probability": (Prediction.pcos_probability, None),
+    "anemia_probability": (Prediction.anemia_probability, None),
+    "breast_cancer_probability": (Prediction.breast_cancer_probability, None),
+    "created_at": (Prediction.created_at, _format_datetime)
+}
+
+HISTORY_SORTS = {
+    "created_at": Prediction.created_at,
+    "pcos_probability": Prediction.pcos_probability,
+    "anemia_probability": Prediction.anemia_probability,
+    "breast_cancer_probability": Prediction.breast_cancer_probability
+}
+
+PERIOD_HISTORY_FIELDS = {
+    "id": (PeriodLog.id, None),
+    "start_date": (PeriodLog.start_date, _format_date),
+    "end_date": (PeriodLog.end_date, _format_date),
+    "flow_intensity": (PeriodLog.flow_intensity, None),
+    # NULL comes back as "" so it still renders as [] like an empty list
+    "symptoms": (func.coalesce(PeriodLog.symptoms, ""), _parse_symptoms),
+    "notes": (PeriodLog.notes, None),
+    "cycle_length": (PeriodLog.cycle_length, None),
+    "created_at": (PeriodLog.created_at, _format_datetime)
+}
+
+
+@app.errorhandler(PaginationError)
+def pagination_error(e):
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@app.route("/models")
+def model_versions():
+    return jsonify(models.describe())
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    return app.response_class(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+@app.route("/risk-config")
+def risk_config():
+    return jsonify(risk_policy.describe(models.engine()))
+
+
+def history_filter(user_id, args):
+    """Returns (where, sort column) for /history from its query arguments."""
+    sort = args.get("sort", "created_at")
+    if sort not in HISTORY_SORTS:
+        raise PaginationError("Unknown sort: " + sort)
+    conditions = [Prediction.user_id == user_id]
+    if sort != "created_at":
+        # predictions made before probabilities were stored cannot be ranked
+        conditions.append(HISTORY_SORTS[sort].isnot(None))
+    for column in PROBABILITY_COLUMNS.values():
+        minimum = args.get("min_" + column)
+        if minimum is not None:
+            try:
+                conditions.append(getattr(Prediction, column) >= float(minimum))
+            except ValueError:
+                raise PaginationError("min_%s must be a number" % column)
+    return and_(*conditions), HISTORY_SORTS[sort]
 
 
 @app.route("/history/<int:user_id>")
+@cached
 def history(user_id):
-    predictions = Prediction.query.filter_by(user_id=user_id).order_by(Prediction.created_at.desc()).all()
-    result = []
-    for p in predictions:
-        result.append({
-            "id": p.id,
-            "pcos": p.pcos_risk,
-            "anemia": p.anemia_risk,
-            "breast_cancer": p.breast_cancer_risk,
-            "created_at": p.created_at.strftime("%Y-%m-%d %H:%M:%S") if hasattr(p, 'created_at') else None
-        })
-    return jsonify(result)
+    where, sort_col = history_filter(user_id, request.args)
+    return keyset_response(HISTORY_FIELDS, where, sort_col, Prediction.id, request.args)
 
 
-@app.route("/period/log", methods=["POST"])
-def log_period():
-    data = request.json
-    user = User.query.get(data["user_id"])
-    if not user:
-        return jsonify({"status": "error", "message": "Invalid user"}), 400
+def new_period_log(data, user_id, last_start):
     start_date = datetime.strptime(data["start_date"], "%Y-%m-%d").date()
     end_date = datetime.strptime(data["end_date"], "%Y-%m-%d").date() if data.get("end_date") else None
-    previous_period = PeriodLog.query.filter_by(user_id=data["user_id"]).order_by(PeriodLog.start_date.desc()).first()
     cycle_length = None
-    if previous_period and previous_period.start_date:
-        cycle_length = (start_date - previous_period.start_date).days
-    period_log = PeriodLog(
-        user_id=data["user_id"], start_date=start_date, end_date=end_date,
+    if last_start:
+        cycle_length = (start_date - last_start).days
+    return PeriodLog(
+        user_id=user_id, start_date=start_date, end_date=end_date,
         flow_intensity=data.get("flow_intensity"), symptoms=json.dumps(data.get("symptoms", [])),
         notes=data.get("notes"), cycle_length=cycle_length
     )
+
+
+@app.route("/period/log", methods=["POST"])
+def log_period():
+    data = request.json
+    user = load_user(data)
+    if not user:
+        return jsonify({"status": "error", "message": "Invalid user"}), 400
+    period_log = new_period_log(data, user.id, cycle_summary.get_summary(user.id).last_start)
     db.session.add(period_log)
+    cycle_summary.on_period_logged(period_log)
     db.session.commit()
-    return jsonify({"status": "success", "period_id": period_log.id, "cycle_length": cycle_length})
+    versions.bump([user.id])
+    return jsonify({
+        "status": "success", "period_id": period_log.id, "cycle_length": period_log.cycle_length,
+        **new_user_fields(data, user.id)
+    })
 
 
 @app.route("/period/update/<int:period_id>", methods=["PUT"])
@@ -137,6 +418,7 @@ def update_period(period_id):
     period_log = PeriodLog.query.get(period_id)
     if not period_log:
         return jsonify({"status": "error", "message": "Period log not found"}), 404
+    old_end_date = period_log.end_date
     if data.get("end_date"):
         period_log.end_date = datetime.strptime(data["end_date"], "%Y-%m-%d").date()
     if data.get("flow_intensity"):
@@ -145,7 +427,9 @@ def update_period(period_id):
         period_log.symptoms = json.dumps(data["symptoms"])
     if data.get("notes"):
         period_log.notes = data["notes"]
+    cycle_summary.on_period_updated(period_log, old_end_date)
     db.session.commit()
+    versions.bump([period_log.user_id])
     return jsonify({"status": "success"})
 
 
@@ -155,83 +439,61 @@ def delete_period(period_id):
     if not period_log:
         return jsonify({"status": "error", "message": "Period log not found"}), 404
     db.session.delete(period_log)
+    cycle_summary.on_period_deleted(period_log)
+    rollups.on_period_deleted(period_log, db.session)
     db.session.commit()
+    versions.bump([period_log.user_id])
     return jsonify({"status": "success"})
 
 
 @app.route("/period/history/<int:user_id>")
+@cached
 def period_history(user_id):
-    periods = PeriodLog.query.filter_by(user_id=user_id).order_by(PeriodLog.start_date.desc()).all()
-    result = []
-    for p in periods:
-        result.append({
-            "id": p.id,
-            "start_date": p.start_date.strftime("%Y-%m-%d"),
-            "end_date": p.end_date.strftime("%Y-%m-%d") if p.end_date else None,
-            "flow_intensity": p.flow_intensity,
-            "symptoms": json.loads(p.symptoms) if p.symptoms else [],
-            "notes": p.notes,
-            "cycle_length": p.cycle_length,
-            "created_at": p.created_at.strftime("%Y-%m-%d %H:%M:%S")
-        })
-    return jsonify(result)
+    return keyset_response(
+        PERIOD_HISTORY_FIELDS, PeriodLog.user_id == user_id, PeriodLog.start_date, PeriodLog.id, request.args
+    )
 
 
-@app.route("/period/predictions/<int:user_id>")
-def period_predictions(user_id):
-    periods = PeriodLog.query.filter_by(user_id=user_id).order_by(PeriodLog.start_date.desc()).limit(3).all()
-    if len(periods) < 2:
-        return jsonify({"message": "Need at least 2 periods to predict", "predictions": []})
-    cycle_lengths = [p.cycle_length for p in periods if p.cycle_length]
-    if not cycle_lengths:
-        return jsonify({"message": "Insufficient data", "predictions": []})
-    avg_cycle = sum(cycle_lengths) / len(cycle_lengths)
-    last_period = periods[0]
-    predictions = []
-    for i in range(1, 4):
-        next_start = last_period.start_date + timedelta(days=int(avg_cycle * i))
-        fertile_start = next_start - timedelta(days=14)
-        fertile_end = next_start - timedelta(days=10)
-        ovulation_day = next_start - timedelta(days=14)
-        predictions.append({
-            "period_number": i,
-            "predicted_start": next_start.strftime("%Y-%m-%d"),
-            "fertile_window_start": fertile_start.strftime("%Y-%m-%d"),
-            "fertile_window_end": fertile_end.strftime("%Y-%m-%d"),
-            "ovulation_day": ovulation_day.strftime("%Y-%m-%d"),
-            "avg_cycle_length": round(avg_cycle, 1)
-        })
-    return jsonify({"avg_cycle_length": round(avg_cycle, 1), "predictions": predictions})
+def period_predictions_payload(summary, count=forecasting.DEFAULT_FORECASTS):
+    if summary.period_count < 2:
+        return {"message": "Need at least 2 periods to predict", "predictions": []}
+    if not summary.forecast_weight:
+        return {"message": "Insufficient data", "predictions": []}
+    mean, sd, weight = forecasting.model(summary)
+    return {
+        "avg_cycle_length": round(mean, 1),
+        "cycle_length_sd": round(sd, 1),
+        "confidence": forecasting.CONFIDENCE,
+        "predictions": forecasting.forecast(summary.last_start, mean, sd, weight, count)
+    }
 
 
-@app.route("/period/stats/<int:user_id>")
-def period_stats(user_id):
-    periods = PeriodLog.query.filter_by(user_id=user_id).order_by(PeriodLog.start_date.desc()).all()
-    if not periods:
-        return jsonify({"message": "No data available"})
-    cycle_lengths = [p.cycle_length for p in periods if p.cycle_length]
-    period_durations = [(p.end_date - p.start_date).days + 1 for p in periods if p.end_date]
+def period_stats_payload(summary):
+    if not summary.period_count:
+        return {"message": "No data available"}
+    avg_cycle = cycle_summary.avg_cycle(summary)
+    avg_duration = cycle_summary.avg_duration(summary)
     stats = {
-        "total_periods_logged": len(periods),
-        "avg_cycle_length": round(sum(cycle_lengths) / len(cycle_lengths), 1) if cycle_lengths else None,
-        "shortest_cycle": min(cycle_lengths) if cycle_lengths else None,
-        "longest_cycle": max(cycle_lengths) if cycle_lengths else None,
-        "avg_period_duration": round(sum(period_durations) / len(period_durations), 1) if period_durations else None,
-        "last_period": periods[0].start_date.strftime("%Y-%m-%d") if periods else None
+        "total_periods_logged": summary.period_count,
+        "avg_cycle_length": round(avg_cycle, 1) if avg_cycle is not None else None,
+        "shortest_cycle": summary.shortest_cycle,
+        "longest_cycle": summary.longest_cycle,
+        "avg_period_duration": round(avg_duration, 1) if avg_duration is not None else None,
+        "last_period": summary.last_start.strftime("%Y-%m-%d")
     }
-    return jsonify(stats)
-
-
-@app.route("/period/current-phase/<int:user_id>")
-def current_cycle_phase(user_id):
-    last_period = PeriodLog.query.filter_by(user_id=user_id).order_by(PeriodLog.start_date.desc()).first()
-    if not last_period:
-        return jsonify({"message": "No period data available", "phase": None})
-    periods = PeriodLog.query.filter_by(user_id=user_id).order_by(PeriodLog.start_date.desc()).limit(3).all()
-    cycle_lengths = [p.cycle_length for p in periods if p.cycle_length]
-    avg_cycle = sum(cycle_lengths) / len(cycle_lengths) if cycle_lengths else 28
-    today = datetime.now().date()
-    days_since_period = (today - last_period.start_date).days
+    return stats
+
+
+def current_phase_payload(summary, today):
+    if not summary.period_count:
+        return {"message": "No period data available", "phase": None}
+    avg_cycle, sd, weight = forecasting.model(summary)
+    expected, earliest, latest = (int(v[0]) for v in forecasting.offsets(avg_cycle, sd, weight, 1))
+    duration = cycle_summary.avg_duration(summary)
+    period_days = min(max(round(duration), 1), 10) if duration else forecasting.PERIOD_DAYS
+    ovulation = expected - forecasting.LUTEAL_DAYS
+    last_start = summary.last_start
+    days_since_period = (today - last_start).days
     phase = None
     phase_description = ""
     days_in_phase = 0
@@ -240,43 +502,108 @@ def current_cycle_phase(user_id):
         phase = "Unknown"
         phase_description = "Period date is in the future"
         phase_color = "#6c757d"
-    elif days_since_period <= 5:
+    elif days_since_period < period_days:
         phase = "Menstruation"
         phase_description = "Your period is happening now. Take it easy and stay hydrated."
         days_in_phase = days_since_period + 1
         phase_color = "#dc3545"
-    elif days_since_period <= 13:
+    elif days_since_period < ovulation - 1:
         phase = "Follicular Phase"
         phase_description = "Your body is preparing for ovulation. Energy levels may be rising."
-        days_in_phase = days_since_period - 5
+        days_in_phase = days_since_period - period_days + 1
         phase_color = "#17a2b8"
-    elif days_since_period <= 16:
+    elif days_since_period <= ovulation + 1:
         phase = "Ovulation"
         phase_description = "Most fertile time. You may feel energetic and confident."
-        days_in_phase = days_since_period - 13
+        days_in_phase = days_since_period - ovulation + 2
         phase_color = "#28a745"
-    elif days_since_period <= avg_cycle:
+    elif days_since_period <= expected:
         phase = "Luteal Phase"
         phase_description = "Your body is preparing for your next period. PMS symptoms may occur."
-        days_in_phase = days_since_period - 16
+        days_in_phase = days_since_period - ovulation - 1
         phase_color = "#ffc107"
     else:
         phase = "Late Period"
-        days_late = days_since_period - int(avg_cycle)
+        days_late = days_since_period - expected
         phase_description = "Your period is " + str(days_late) + " days late based on your average cycle."
         phase_color = "#6c757d"
-    next_period_date = last_period.start_date + timedelta(days=int(avg_cycle))
+    next_period_date = last_start + timedelta(days=expected)
     days_until_period = (next_period_date - today).days
-    return jsonify({
+    return {
         "current_phase": phase,
         "description": phase_description,
         "days_in_phase": days_in_phase,
         "days_since_last_period": days_since_period,
         "days_until_next_period": days_until_period,
         "next_period_date": next_period_date.strftime("%Y-%m-%d"),
+        "next_period_earliest": (last_start + timedelta(days=earliest)).strftime("%Y-%m-%d"),
+        "next_period_latest": (last_start + timedelta(days=latest)).strftime("%Y-%m-%d"),
         "phase_color": phase_color,
         "avg_cycle_length": round(avg_cycle, 1)
-    })
+    }
+
+
+@app.route("/period/cache-stats")
+def period_cache_stats():
+    return jsonify(cycle_summary.cache_stats())
+
+
+def fitted_summary(user_id):
+    """get_summary() with the forecast refitted (and stored) if a period write reset it."""
+    summary = cycle_summary.get_summary(user_id)
+    if forecasting.stale(summary):
+        forecasting.refit(summary)
+        db.session.commit()
+    return summary
+
+
+@app.errorhandler(forecasting.ForecastError)
+def forecast_error(e):
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+
+@app.route("/period/predictions/<int:user_id>")
+@cached
+def period_predictions(user_id):
+    count = forecasting.parse_count(request.args.get("cycles"))
+    return jsonify(period_predictions_payload(fitted_summary(user_id), count))
+
+
+@app.route("/period/stats/<int:user_id>")
+@cached
+def period_stats(user_id):
+    return jsonify(period_stats_payload(cycle_summary.get_summary(user_id)))
+
+
+@app.route("/period/current-phase/<int:user_id>")
+def current_cycle_phase(user_id):
+    return jsonify(current_phase_payload(fitted_summary(user_id), datetime.now().date()))
+
+
+@app.errorhandler(rollups.AnalyticsError)
+def analytics_error(e):
+    return jsonify({"status": "error", "message": str(e)}), 400
+
+
+def compact_if_behind(payload):
+    # the read stays exact either way; folding keeps the next one cheap
+    if payload["unfolded_rows"] > app.config["ROLLUP_TAIL_LIMIT"]:
+        db.session.commit()
+        rollups.compact(db.engine)
+
+
+@app.route("/analytics/predictions")
+def analytics_predictions():
+    payload = rollups.prediction_rates(db.session, request.args)
+    compact_if_behind(payload)
+    return jsonify(payload)
+
+
+@app.route("/analytics/cycle-lengths")
+def analytics_cycle_lengths():
+    payload = rollups.cycle_length_distribution(db.session)
+    compact_if_behind(payload)
+    return jsonify(payload)
 
 
 @app.route("/nutrition/generate", methods=["POST"])
@@ -285,177 +612,94 @@ def generate_nutrition():
     symptoms = data.get("symptoms", [])
     if not symptoms:
         return jsonify({"error": "No symptoms provided"}), 400
-    
-    nutrition_db = {
-        "pcos": {
-            "breakfast": [
-                {"name": "Greek Yogurt with Berries", "ingredients": ["1 cup Greek yogurt", "1/2 cup berries", "2 tbsp almonds"], "benefits": "High protein helps manage insulin levels"},
-                {"name": "Spinach Omelette", "ingredients": ["2 eggs", "1 cup spinach", "1 tbsp olive oil"], "benefits": "Protein stabilizes blood sugar"},
-                {"name": "Quinoa Porridge", "ingredients": ["1/2 cup quinoa", "1 cup almond milk", "1 tsp cinnamon"], "benefits": "Low GI helps insulin sensitivity"}
-            ],
-            "lunch": [
-                {"name": "Grilled Salmon with Vegetables", "ingredients": ["150g salmon", "1 cup broccoli", "bell peppers"], "benefits": "Omega-3s reduce inflammation"},
-                {"name": "Chickpea Curry", "ingredients": ["1 cup chickpeas", "2 cups spinach", "turmeric"], "benefits": "Plant protein stabilizes blood sugar"}
-            ],
-            "dinner": [
-                {"name": "Grilled Chicken with Sweet Potato", "ingredients": ["120g chicken", "1 sweet potato", "green beans"], "benefits": "Lean protein maintains energy"},
-                {"name": "Lentil Stew", "ingredients": ["1 cup lentils", "mixed vegetables", "herbs"], "benefits": "High fiber manages insulin resistance"}
-            ],
-            "snacks": [
-                {"name": "Apple with Almond Butter", "ingredients": ["1 apple", "2 tbsp almond butter"], "benefits": "Fiber and healthy fats"},
-                {"name": "Mixed Nuts", "ingredients": ["10 almonds", "5 walnuts", "5 cashews"], "benefits": "Regulates hormones"}
-            ],
-            "tips": ["Choose low glycemic foods", "Include protein with meals", "Eat anti-inflammatory foods", "Limit processed foods", "Stay hydrated"]
-        },
-        "anemia": {
-            "breakfast": [
-                {"name": "Oatmeal with Apricots", "ingredients": ["1 cup oats", "dried apricots", "1 orange"], "benefits": "Iron with vitamin C"},
-                {"name": "Spinach Tofu Scramble", "ingredients": ["100g tofu", "2 cups spinach", "tomatoes"], "benefits": "Iron-rich with vitamin C"}
-            ],
-            "lunch": [
-                {"name": "Beef Lentil Soup", "ingredients": ["80g beef", "1/2 cup lentils", "vegetables"], "benefits": "Heme iron easily absorbed"},
-                {"name": "Tuna Salad", "ingredients": ["100g tuna", "2 cups kale", "lemon"], "benefits": "Iron and B12"}
-            ],
-            "dinner": [
-                {"name": "Liver with Onions", "ingredients": ["100g liver", "onions", "spinach", "rice"], "benefits": "Highest source of iron"},
-                {"name": "Black Bean Bowl", "ingredients": ["1 cup black beans", "quinoa", "avocado"], "benefits": "Iron-rich plant protein"}
-            ],
-            "snacks": [
-                {"name": "Pumpkin Seeds", "ingredients": ["1/4 cup pumpkin seeds", "dark chocolate"], "benefits": "Excellent iron sources"},
-                {"name": "Strawberries with Seeds", "ingredients": ["1 cup strawberries", "sunflower seeds"], "benefits": "Vitamin C enhances absorption"}
-            ],
-            "tips": ["Combine iron with vitamin C", "Avoid tea with meals", "Include heme and non-heme iron", "Use cast iron cookware", "Take supplements as prescribed"]
-        },
-        "fatigue": {
-            "breakfast": [
-                {"name": "Banana Smoothie", "ingredients": ["1 banana", "1/2 cup oats", "peanut butter"], "benefits": "Complex carbs provide energy"},
-                {"name": "Avocado Toast", "ingredients": ["whole grain bread", "avocado", "egg"], "benefits": "B vitamins support energy"}
-            ],
-            "lunch": [
-                {"name": "Brown Rice with Chicken", "ingredients": ["brown rice", "120g chicken", "vegetables"], "benefits": "Sustained energy release"}
-            ],
-            "dinner": [
-                {"name": "Salmon with Quinoa", "ingredients": ["150g salmon", "quinoa", "vegetables"], "benefits": "Omega-3s and B vitamins"}
-            ],
-            "snacks": [
-                {"name": "Energy Balls", "ingredients": ["dates", "oats", "almond butter"], "benefits": "Natural sustained energy"}
-            ],
-            "tips": ["Eat frequent small meals", "Stay hydrated", "Include complex carbs", "Don't skip breakfast", "Limit caffeine"]
-        },
-        "cramps": {
-            "breakfast": [
-                {"name": "Ginger Tea with Toast", "ingredients": ["ginger tea", "whole grain toast", "almond butter"], "benefits": "Anti-inflammatory properties"}
-            ],
-            "lunch": [
-                {"name": "Turmeric Chicken Stir-fry", "ingredients": ["chicken", "vegetables", "turmeric", "rice"], "benefits": "Reduces inflammation"}
-            ],
-            "dinner": [
-                {"name": "Baked Salmon", "ingredients": ["150g salmon", "sweet potato", "spinach"], "benefits": "Omega-3s reduce cramping"}
-            ],
-            "snacks": [
-                {"name": "Dark Chocolate", "ingredients": ["dark chocolate", "almonds"], "benefits": "Magnesium relaxes muscles"}
-            ],
-            "tips": ["Increase magnesium intake", "Stay hydrated", "Avoid excess salt", "Include ginger and turmeric", "Limit caffeine"]
-        },
-        "bloating": {
-            "breakfast": [
-                {"name": "Papaya with Yogurt", "ingredients": ["papaya", "Greek yogurt", "ginger", "mint"], "benefits": "Digestive enzymes"}
-            ],
-            "lunch": [
-                {"name": "Grilled Chicken Salad", "ingredients": ["chicken", "cucumber", "tomato", "lemon"], "benefits": "Easily digestible"}
-            ],
-            "dinner": [
-                {"name": "Vegetable Soup", "ingredients": ["carrots", "zucchini", "ginger", "broth"], "benefits": "Aids digestion"}
-            ],
-            "snacks": [
-                {"name": "Fennel Tea", "ingredients": ["fennel tea", "rice crackers"], "benefits": "Relieves bloating"}
-            ],
-            "tips": ["Eat slowly", "Avoid carbonated drinks", "Limit sodium", "Include probiotics", "Drink herbal tea"]
-        },
-        "mood_swings": {
-            "breakfast": [
-                {"name": "Omega-3 Smoothie", "ingredients": ["spinach", "banana", "chia seeds", "walnuts"], "benefits": "Supports brain health"}
-            ],
-            "lunch": [
-                {"name": "Salmon Bowl", "ingredients": ["salmon", "quinoa", "avocado", "greens"], "benefits": "Omega-3s and B vitamins"}
-            ],
-            "dinner": [
-                {"name": "Turkey with Vegetables", "ingredients": ["turkey", "sweet potato", "Brussels sprouts"], "benefits": "Tryptophan produces serotonin"}
-            ],
-            "snacks": [
-                {"name": "Banana with Nut Butter", "ingredients": ["banana", "almond butter"], "benefits": "Aids mood regulation"}
-            ],
-            "tips": ["Maintain stable blood sugar", "Include omega-3 foods", "Get B vitamins", "Limit caffeine and alcohol", "Stay hydrated"]
-        },
-        "acne": {
-            "breakfast": [
-                {"name": "Green Tea with Toast", "ingredients": ["green tea", "whole grain bread", "avocado"], "benefits": "Anti-inflammatory"}
-            ],
-            "lunch": [
-                {"name": "Grilled Fish", "ingredients": ["fish", "broccoli", "carrots", "olive oil"], "benefits": "Omega-3s reduce inflammation"}
-            ],
-            "dinner": [
-                {"name": "Chicken with Sweet Potato", "ingredients": ["chicken", "sweet potato", "spinach"], "benefits": "Zinc aids skin repair"}
-            ],
-            "snacks": [
-                {"name": "Brazil Nuts", "ingredients": ["Brazil nuts", "berries"], "benefits": "Selenium fights inflammation"}
-            ],
-            "tips": ["Limit dairy", "Avoid high glycemic foods", "Include zinc-rich foods", "Eat omega-3s", "Stay hydrated"]
-        },
-        "hair_loss": {
-            "breakfast": [
-                {"name": "Eggs with Spinach", "ingredients": ["2 eggs", "spinach", "whole grain toast"], "benefits": "Biotin promotes hair growth"}
-            ],
-            "lunch": [
-                {"name": "Salmon with Sweet Potato", "ingredients": ["salmon", "sweet potato", "vegetables"], "benefits": "Omega-3s nourish hair"}
-            ],
-            "dinner": [
-                {"name": "Lentil Curry", "ingredients": ["lentils", "brown rice", "curry spices"], "benefits": "Protein supports hair structure"}
-            ],
-            "snacks": [
-                {"name": "Sunflower Seeds", "ingredients": ["sunflower seeds", "berries"], "benefits": "Vitamin E promotes circulation"}
-            ],
-            "tips": ["Ensure adequate protein", "Include iron-rich foods", "Get biotin from eggs", "Consume omega-3s", "Include zinc and selenium"]
-        }
-    }
-    
-    combined_breakfast = []
-    combined_lunch = []
-    combined_dinner = []
-    combined_snacks = []
-    combined_tips = []
-    added_meals = set()
-    
-    for symptom in symptoms:
-        if symptom in nutrition_db:
-            symptom_data = nutrition_db[symptom]
-            for meal in symptom_data["breakfast"]:
-                if meal["name"] not in added_meals:
-                    combined_breakfast.append(meal)
-                    added_meals.add(meal["name"])
-            for meal in symptom_data["lunch"]:
-                if meal["name"] not in added_meals:
-                    combined_lunch.append(meal)
-                    added_meals.add(meal["name"])
-            for meal in symptom_data["dinner"]:
-                if meal["name"] not in added_meals:
-                    combined_dinner.append(meal)
-                    added_meals.add(meal["name"])
-            for meal in symptom_data["snacks"]:
-                if meal["name"] not in added_meals:
-                    combined_snacks.append(meal)
-                    added_meals.add(meal["name"])
-            combined_tips.extend(symptom_data["tips"])
-    
-    result = {
-        "breakfast": combined_breakfast[:3],
-        "lunch": combined_lunch[:3],
-        "dinner": combined_dinner[:3],
-        "snacks": combined_snacks[:3],
-        "tips": list(set(combined_tips))[:8]
-    }
-    return jsonify(result)
+    kb = nutrition_kb.get()
+    return app.response_class(kb.plan_json(kb.key(symptoms)), mimetype="application/json")
+
+
+@app.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Create missing tables, columns and indexes (run before starting the app)."""
+    upgrade()
+    print("Database schema is up to date")
+
+
+@app.cli.command("purge-anonymous")
+@click.option("--batch-size", default=200, show_default=True, help="guests deleted per transaction")
+@click.option("--pause", default=0.05, show_default=True, help="seconds to yield to other writers between batches")
+def purge_anonymous_command(batch_size, pause):
+    """Delete guests inactive for ANONYMOUS_TTL_DAYS and their data (run it from cron)."""
+    counts = purge_expired(db.engine, guests.ttl, batch_size, pause)
+    versions.bump_all()
+    print("Deleted " + ", ".join("%d %s" % (n, table) for table, n in counts.items()))
+
+
+@app.cli.command("compact-rollups")
+@click.option("--batch-size", default=50000, show_default=True, help="source rows folded per transaction")
+def compact_rollups_command(batch_size):
+    """Fold new predictions and period logs into the analytics rollups (run it from cron)."""
+    counts = rollups.compact(db.engine, batch_size)
+    print("Folded " + ", ".join("%d %s" % (n, name) for name, n in counts.items()))
+
+
+@app.cli.command("export-data")
+@click.option("--output", "-o", default="-", show_default=True, help="file to write; .gz compresses it, - is stdout")
+@click.option("--user-id", type=int, help="export one user instead of everyone")
+@click.option("--no-secrets", is_flag=True, help="leave out password hashes and guest keys (e.g. for a GDPR request)")
+def export_data_command(output, user_id, no_secrets):
+    """Write users, predictions and period logs as an NDJSON archive."""
+    chunks = archive.export_lines(db.engine, user_id, secrets=not no_secrets)
+    if output == "-":
+        for chunk in chunks:
+            click.echo(chunk, nl=False)
+        return
+    with (gzip.open(output, "wt", compresslevel=6, encoding="utf-8") if output.endswith(".gz") else open(output, "w")) as f:
+        f.writelines(chunks)
+
+
+@app.cli.command("import-data")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--batch-size", default=archive.BATCH, show_default=True, help="rows inserted per statement")
+def import_data_command(path, batch_size):
+    """Restore an export-data archive into a fresh database (run db-upgrade first).
+
+    The import is a single transaction. If it fails, nothing is written and the
+    database stays empty: fix the reported problem and run the same command again.
+    """
+    with archive.open_archive(path) as f:
+        try:
+            counts = archive.import_lines(db.engine, f, batch_size)
+        except archive.ArchiveError as e:
+            raise click.ClickException(str(e))
+    versions.bump_all()
+    rollups.compact(db.engine)
+    print("Imported " + ", ".join("%d %s" % (n, table) for table, n in counts.items()))
+
+
+@app.cli.command("forecast-all")
+@click.option("--output", "-o", default="-", show_default=True, help="NDJSON file to write, - is stdout")
+@click.option("--cycles", default=forecasting.DEFAULT_FORECASTS, show_default=True, help="starts forecast per user")
+def forecast_all_command(output, cycles):
+    """Forecast every user's next periods in one pass (e.g. for a nightly reminder job)."""
+    with click.open_file(output, "w") as f:
+        for user_id, payload in forecasting.forecast_all(db.engine, cycles):
+            f.write(app.json.dumps(dict(payload, user_id=user_id)) + "\n")
+
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if a per-user read endpoint falls back to a table scan."""
+    problems = check_query_plans(app.test_client())
+    for statement, scans in problems:
+        print("FULL SCAN: " + statement)
+        for line in scans:
+            print("    " + line)
+    if problems:
+        raise SystemExit(1)
+    print("All per-user queries use an index")
 
 
 if __name__ == "__main__":
+    # the development server migrates on start; deployments run `flask db-upgrade` once
+    with app.app_context():
+        upgrade()
     app.run(host='0.0.0.0', port=os.environ.get('PORT', 5000))
\ No newline at end of file
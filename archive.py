@@ -0,0 +1,170 @@
+import gzip
+import json
+from datetime import date, datetime
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+
+from database import User, Prediction, PeriodLog
+
+
+# Full data export/import as NDJSON.
+#
+# An archive is a header line followed by one {"table": ..., "row": {...}}
+# line per row, users first, then predictions and period logs, each table in
+# id order, so it can be restored with foreign keys enforced. Rows are read in
+# yield_per batches (a server-side cursor on PostgreSQL) and written as they
+# arrive, so memory does not grow with the number of users. Cycle summaries
+# and rollups are not archived; they are derived from these tables.
+
+FORMAT = "shecare-archive"
+VERSION = 1
+TABLES = [User.__table__, Prediction.__table__, PeriodLog.__table__]
+# password hashes and guest keys are only needed to restore a backup
+SECRET_COLUMNS = {"users": ("password", "anonymous_key")}
+BATCH = 5000
+
+# one encoder for every row; json.dumps() with arguments builds a new one per call
+_encode = json.JSONEncoder(separators=(",", ":"), check_circular=False).encode
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+def _python_type(column):
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _renderer(table, columns):
+    names = [c.name for c in columns]
+    dated = [i for i, c in enumerate(columns) if _python_type(c) in (date, datetime)]
+    prefix = '{"table":%s,"row":' % json.dumps(table.name)
+
+    def render(row):
+        values = list(row)
+        for i in dated:
+            if values[i] is not None:
+                values[i] = values[i].isoformat()
+        return prefix + _encode(dict(zip(names, values))) + "}\n"
+
+    return render
+
+
+def export_lines(engine, user_id=None, secrets=True):
+    """Yields the archive of one user, or of everyone, in chunks of up to BATCH lines.
+
+    All tables are read from one snapshot, so no row refers to a user that
+    was written after the users table was read.
+    """
+    columns = {
+        table.name: [c for c in table.columns if secrets or c.name not in SECRET_COLUMNS.get(table.name, ())]
+        for table in TABLES
+    }
+    yield json.dumps({
+        "format": FORMAT, "version": VERSION, "exported_at": datetime.utcnow().isoformat(), "user_id": user_id,
+        "columns": {name: [c.name for c in cols] for name, cols in columns.items()}
+    }) + "\n"
+    with engine.connect() as conn:
+        if conn.dialect.name == "sqlite":
+            conn.exec_driver_sql("BEGIN")  # pysqlite opens no transaction for SELECTs
+        else:
+            conn = conn.execution_options(isolation_level="REPEATABLE READ")
+        for table in TABLES:
+            stmt = select(*columns[table.name]).order_by(table.c.id)
+            if user_id is not None:
+                stmt = stmt.where((table.c.id if table is User.__table__ else table.c.user_id) == user_id)
+            render = _renderer(table, columns[table.name])
+            for batch in conn.execute(stmt.execution_options(yield_per=BATCH)).partitions():
+                yield "".join(map(render, batch))
+
+
+def open_archive(path):
+    """Opens an archive for reading, gzip-compressed or not."""
+    with open(path, "rb") as f:
+        compressed = f.read(2) == b"\x1f\x8b"
+    return gzip.open(path, "rt", encoding="utf-8") if compressed else open(path, encoding="utf-8")
+
+
+def _converters(table, names):
+    parsers = {datetime: datetime.fromisoformat, date: date.fromisoformat}
+    return [(name, parsers.get(_python_type(table.c[name]))) for name in names]
+
+
+def _header(line):
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != FORMAT:
+        raise ArchiveError("Not a %s file" % FORMAT)
+    if header.get("version") != VERSION:
+        raise ArchiveError("Unsupported archive version: %s" % header.get("version"))
+    return header
+
+
+def import_lines(engine, lines, batch_size=BATCH):
+    """Restores an archive into a database whose user tables are empty.
+
+    Rows keep their ids and are inserted with one executemany per
+    `batch_size` rows. The whole import is one transaction: if any line or
+    insert fails nothing is kept, and the database is still empty for the
+    next attempt. Returns the rows inserted per table.
+    """
+    tables = {table.name: table for table in TABLES}
+    lines = iter(lines)
+    header = _header(next(lines, ""))
+    converters = {}
+    for name, names in header["columns"].items():
+        if name not in tables:
+            raise ArchiveError("Unknown table in archive: " + name)
+        unknown = [column for column in names if column not in tables[name].c]
+        if unknown:
+            raise ArchiveError("Columns missing from %s (run db-upgrade): %s" % (name, ", ".join(unknown)))
+        converters[name] = _converters(tables[name], names)
+
+    with engine.begin() as conn:
+        for table in TABLES:
+            if conn.scalar(select(table.c.id).limit(1)) is not None:
+                raise ArchiveError("Table %s is not empty; import into a fresh database" % table.name)
+
+        counts = dict.fromkeys(tables, 0)
+        batch, current = [], None
+
+        def flush():
+            try:
+                conn.execute(insert(tables[current]), batch)
+            except IntegrityError as e:
+                raise ArchiveError("Rows rejected by the database in %s (%s)" % (current, e.orig))
+            counts[current] += len(batch)
+
+        for number, line in enumerate(lines, 2):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                name, row = record["table"], record["row"]
+                values = {column: parse(row[column]) if parse and row[column] is not None else row[column]
+                          for column, parse in converters[name]}
+            except (ValueError, KeyError, TypeError) as e:
+                raise ArchiveError("Line %d: invalid record (%s)" % (number, e))
+            if name != current or len(batch) >= batch_size:
+                # a table's rows are all inserted before the next table's
+                if batch:
+                    flush()
+                batch, current = [], name
+            batch.append(values)
+        if batch:
+            flush()
+
+        if conn.dialect.name == "postgresql":
+            # ids were inserted explicitly; move the sequences past them
+            for table in TABLES:
+                conn.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('{0}', 'id'), COALESCE(MAX(id), 0) + 1, false) FROM {0}"
+                    .format(table.name)
+                ))
+    return counts
@@ -0,0 +1,95 @@
+import csv
+import io
+
+import numpy as np
+
+from utils.feature_engineering import SCHEMA
+
+
+MAX_BATCH_ROWS = 50000
+INT64_MAX = np.iinfo(np.int64).max
+
+
+class BatchError(ValueError):
+    pass
+
+
+def read_records(req):
+    """Returns the list of row dicts posted to /predict/batch.
+
+    Accepts a JSON array (or {"records": [...]}), a multipart upload named
+    "file", or a raw text/csv body laid out like shecare_dataset_large.csv.
+    """
+    if req.is_json:
+        data = req.get_json()
+        records = data.get("records") if isinstance(data, dict) else data
+        if not isinstance(records, list):
+            raise BatchError("Expected a JSON array of records")
+        return records
+    if "file" in req.files:
+        text = io.TextIOWrapper(req.files["file"].stream, encoding="utf-8-sig")
+    else:
+        text = io.StringIO(req.get_data(as_text=True))
+    return list(csv.DictReader(text))
+
+
+def _user_id(value):
+    """The integer user id in `value`, or None. Rejects bools, fractions and ids past int64."""
+    if isinstance(value, str):
+        try:
+            value = int(value.strip())
+        except ValueError:
+            return None
+    elif isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, bool) or not isinstance(value, int):
+        return None
+    return value if -INT64_MAX <= value <= INT64_MAX else None
+
+
+def build_matrix(records, default_user_id=None, cycle_variations=None):
+    """Converts records into a feature matrix.
+
+    Returns (X, user_ids, rows, errors) where X only holds the rows that parsed,
+    rows maps each X row back to its input index and errors lists the rejects.
+    Parsing is column-at-a-time through SCHEMA.prepare, so BMI can be given as
+    height/weight and acne_severity as a label. Rows without cycle_variation
+    take it from cycle_variations(user_ids) -> {user_id: value}, like /predict.
+    """
+    if len(records) > MAX_BATCH_ROWS:
+        raise BatchError("Batch is limited to %d rows" % MAX_BATCH_ROWS)
+    problems = {}
+    objects = []
+    index = []
+    for i, record in enumerate(records):
+        if isinstance(record, dict):
+            objects.append(record)
+            index.append(i)
+        else:
+            problems[i] = "Record must be an object"
+    index = np.array(index, dtype=np.int64)
+    columns = SCHEMA.columns(objects, extra=("user_id",))
+    raw_ids = [value if value not in (None, "") else default_user_id for value in columns.pop("user_id")]
+    user_ids = np.zeros(len(objects), dtype=np.int64)
+    bad_ids = {}
+    for j, raw in enumerate(raw_ids):
+        user_id = None if raw is None else _user_id(raw)
+        if user_id is not None:
+            user_ids[j] = user_id
+        else:
+            bad_ids[j] = "Missing field 'user_id'" if raw is None else "Invalid integer in 'user_id'"
+    if cycle_variations is not None:
+        column = columns["cycle_variation"]
+        gaps = [j for j, value in enumerate(column) if value in (None, "") and j not in bad_ids]
+        if gaps:
+            derived = cycle_variations(user_ids[gaps].tolist())
+            for j in gaps:
+                column[j] = derived.get(int(user_ids[j]))
+    X, invalid = SCHEMA.prepare(columns)
+    invalid.update(bad_ids)
+    ok = np.ones(len(objects), dtype=bool)
+    for j, message in invalid.items():
+        ok[j] = False
+        problems[int(index[j])] = message
+    errors = [{"row": row, "message": problems[row]} for row in sorted(problems)]
+    return X[ok], user_ids[ok], index[ok].tolist(), errors
@@ -0,0 +1,90 @@
+"""Throughput and memory of `flask export-data` and `flask import-data`.
+
+For each population size, seeds a throwaway database, exports it with the
+CLI to a gzip archive, restores the archive into a second, empty database
+and checks that exporting the restored copy gives the same rows. Each CLI
+run is a child process, so its peak RSS is measured on its own; the export's
+should not grow with the population.
+
+    python benchmarks/bench_archive.py --users 2000,20000
+"""
+import argparse
+import gzip
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT
+from testing import BACKENDS, temporary_database
+
+
+def flask(url, *args):
+    """Runs a flask CLI command against `url`; returns (seconds, peak RSS in MiB)."""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-W", "ignore", "-m", "flask", "--app", "app"] + list(args), cwd=ROOT,
+        env=dict(os.environ, SHECARE_DATABASE_URI=url), stdout=subprocess.DEVNULL
+    )
+    _, status, usage = os.wait4(process.pid, 0)
+    if status:
+        raise SystemExit("flask %s failed" % args[0])
+    return time.perf_counter() - started, usage.ru_maxrss / 1024
+
+
+def populate(users):
+    """Child process: seeds SHECARE_DATABASE_URI."""
+    from population import generate
+
+    generate(users)
+
+
+def digest(path):
+    """(row count, hash of the rows) of an archive."""
+    count, sha = 0, hashlib.sha256()
+    with gzip.open(path, "rb") as f:
+        next(f)  # the header carries the export time
+        for line in f:
+            count += 1
+            sha.update(line)
+    return count, sha.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", default="2000,20000", help="comma-separated population sizes")
+    parser.add_argument("--batch-size", type=int, default=5000, help="import rows per insert statement")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    parser.add_argument("--populate", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.populate:
+        populate(args.populate)
+        return
+
+    for users in [int(n) for n in args.users.split(",")]:
+        with temporary_database(args.backend) as source, temporary_database(args.backend) as target, \
+                tempfile.TemporaryDirectory() as tmp:
+            subprocess.run([sys.executable, os.path.abspath(__file__), "--populate", str(users)], check=True,
+                           env=dict(os.environ, SHECARE_DATABASE_URI=source), stdout=subprocess.DEVNULL)
+            archive, again = os.path.join(tmp, "export.ndjson.gz"), os.path.join(tmp, "again.ndjson.gz")
+            export_seconds, export_rss = flask(source, "export-data", "-o", archive)
+            flask(target, "db-upgrade")
+            import_seconds, import_rss = flask(target, "import-data", archive, "--batch-size", str(args.batch_size))
+            flask(target, "export-data", "-o", again)
+            count, exported = digest(archive)
+            if digest(again)[1] != exported:
+                raise SystemExit("restored database differs from the source")
+            print("%6d users, %8d rows, %6.1f MiB archive | export %6.1f s %8.0f rows/s %6.1f MiB RSS"
+                  " | import %6.1f s %8.0f rows/s %6.1f MiB RSS" % (
+                      users, count, os.path.getsize(archive) / 2 ** 20,
+                      export_seconds, count / export_seconds, export_rss,
+                      import_seconds, count / import_seconds, import_rss
+                  ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Latency of the polled per-user reads with and without the response cache.
+
+Seeds a throwaway database, then requests each cached route for a sample of
+users through the Flask test client three ways: a miss (the user's version
+is bumped first, as a write would, so the view renders and the cache stores
+the body), a hit (200 from the cache) and a revalidation with If-None-Match
+(304). Also reports how much the cached gzip copies save.
+
+    python benchmarks/bench_cache.py --users 2000 --requests 2000
+"""
+import argparse
+import gzip
+import os
+import random
+import time
+
+from common import ROOT, percentile
+from testing import BACKENDS, temporary_database
+
+ROUTES = ["/history/%d", "/history/%d?limit=20", "/period/history/%d", "/period/stats/%d", "/period/predictions/%d"]
+
+
+def timed(client, path, headers):
+    started = time.perf_counter()
+    response = client.get(path, headers=headers)
+    response.get_data()  # streamed bodies are rendered (and stored) as they are read
+    return time.perf_counter() - started, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=2000, help="per route and mode")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    args = parser.parse_args()
+
+    with temporary_database(args.backend) as url:
+        os.environ["SHECARE_DATABASE_URI"] = url
+        os.environ.setdefault("SHECARE_RESPONSE_CACHE_SINGLE_HOST", "1")  # one process, also on PostgreSQL
+        os.chdir(ROOT)
+        from population import generate
+
+        population = generate(args.users)
+        from app import app, responses, versions
+
+        if responses is None:
+            raise SystemExit("the response cache is disabled (SHECARE_RESPONSE_CACHE_MB or _SINGLE_HOST)")
+        client = app.test_client()
+        rng = random.Random(0)
+        print("%-24s %10s %10s %10s %8s" % ("route", "miss p50", "hit p50", "304 p50", "gzip"))
+        for route in ROUTES:
+            times = {"miss": [], "hit": [], "304": []}
+            plain = compressed = 0
+            for _ in range(args.requests):
+                user_id = rng.choice(population["tracked"])
+                path = route % user_id
+                versions.bump([user_id])
+                seconds, _ = timed(client, path, {})
+                times["miss"].append(seconds)
+                seconds, response = timed(client, path, {"Accept-Encoding": "gzip"})
+                times["hit"].append(seconds)
+                body = response.get_data()
+                plain += len(gzip.decompress(body)) if response.headers.get("Content-Encoding") else len(body)
+                compressed += len(body)
+                seconds, response = timed(client, path, {"If-None-Match": response.headers["ETag"]})
+                if response.status_code != 304:
+                    raise SystemExit("%s: expected 304, got %d" % (path, response.status_code))
+                times["304"].append(seconds)
+            print("%-24s %8.3f ms %8.3f ms %8.3f ms %7.0f%%" % (
+                route.replace("%d", "<id>"), *(percentile(times[mode], 50) * 1e3 for mode in ("miss", "hit", "304")),
+                100 * compressed / plain
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Time of the batch forecast (`flask forecast-all`) against fitting users one by one.
+
+Seeds a throwaway database, then times the stages of forecasting.forecast_all()
+over every user: loading the start dates, the NumPy fit and building the
+payloads. It also times forecasting.refit() (what a stale /period/predictions
+read does) on a sample of users and checks that it agrees with the batch fit.
+
+    python benchmarks/bench_forecast.py --users 100000
+"""
+import argparse
+import os
+import random
+import time
+
+from common import ROOT
+from testing import BACKENDS, temporary_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--sample", type=int, default=500, help="users fitted one by one")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    args = parser.parse_args()
+
+    with temporary_database(args.backend) as url:
+        os.environ["SHECARE_DATABASE_URI"] = url
+        os.chdir(ROOT)
+        from population import generate
+
+        population = generate(args.users)
+        import forecasting
+        from app import app, db
+        from database import CycleSummary
+
+        with app.app_context():
+            started = time.perf_counter()
+            with db.engine.connect() as conn:
+                starts = forecasting.load_starts(conn)
+            loaded = time.perf_counter()
+            user_ids, _, mean, sd, weight = forecasting.fit_all(*starts)
+            fitted = time.perf_counter()
+            payloads = sum(1 for _ in forecasting.forecast_all(db.engine))
+            finished = time.perf_counter()
+            print("%d period logs, %d users, %d forecast" % (len(starts[0]), len(user_ids), payloads))
+            print("batch: load %.3f s, fit %.3f s, forecast_all() %.3f s" % (
+                loaded - started, fitted - loaded, finished - fitted
+            ))
+
+            batch = {u: (m, s, w) for u, m, s, w in zip(user_ids.tolist(), mean, sd, weight)}
+            sample = random.Random(0).sample(population["tracked"], min(args.sample, len(population["tracked"])))
+            started = time.perf_counter()
+            for user_id in sample:
+                summary = CycleSummary(user_id=user_id)
+                forecasting.refit(summary)
+                m, s, w = batch[user_id]
+                if w and (abs(summary.forecast_mean - m) > 1e-9 or abs(summary.forecast_sd - s) > 1e-9):
+                    raise SystemExit("user %d: refit() disagrees with fit_all()" % user_id)
+            per_user = (time.perf_counter() - started) / len(sample)
+            print("one by one: %.2f ms/user, %.1f s for every user" % (per_user * 1e3, per_user * len(user_ids)))
+
+
+if __name__ == "__main__":
+    main()
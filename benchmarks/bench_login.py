@@ -0,0 +1,70 @@
+"""Login latency under a burst of concurrent attempts.
+
+Runs against a throwaway SQLite database:
+
+    python benchmarks/bench_login.py --concurrency 200 --cost 14 --workers 4
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from common import ROOT, percentile
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--cost", type=int, default=14, help="scrypt n = 2**cost")
+    parser.add_argument("--workers", type=int, default=4, help="KDF pool size")
+    parser.add_argument("--max-queue", type=int, default=256)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    os.environ["SHECARE_DATABASE_URI"] = "sqlite:///" + os.path.join(tmp, "bench.db")
+    os.environ["SHECARE_KDF_COST"] = str(args.cost)
+    os.environ["SHECARE_KDF_WORKERS"] = str(args.workers)
+    os.environ["SHECARE_KDF_MAX_QUEUE"] = str(args.max_queue)
+    os.chdir(ROOT)
+    from app import app, hasher
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+    client = app.test_client()
+    client.post("/register", json={"name": "bench", "email": "bench@example.com", "password": "secret"})
+
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.concurrency)
+
+    def attempt():
+        barrier.wait()
+        start = time.perf_counter()
+        response = app.test_client().post("/login", json={"email": "bench@example.com", "password": "secret"})
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed * 1000)
+            statuses.append(response.status_code)
+
+    threads = [threading.Thread(target=attempt) for _ in range(args.concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - start
+
+    print("attempts     %d (ok %d, busy %d)" % (len(statuses), statuses.count(200), statuses.count(503)))
+    print("wall         %.2fs (%.1f logins/s)" % (wall, len(statuses) / wall))
+    print("p50          %.1f ms" % statistics.median(latencies))
+    print("p95          %.1f ms" % percentile(latencies, 95))
+    print("p99          %.1f ms" % percentile(latencies, 99))
+    print("kdf stats    %s" % hasher.stats())
+
+
+if __name__ == "__main__":
+    main()
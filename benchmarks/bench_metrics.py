@@ -0,0 +1,165 @@
+"""Per-request overhead of the /metrics instrumentation.
+
+Seeds a throwaway database and starts two worker processes, one with
+SHECARE_METRICS_ENABLED off and one with it on, each driving the app
+in-process (no HTTP server, so the instrumentation is not hidden by
+network noise) over a mix of read and /predict requests. The workers run
+alternating windows of requests, so every "on" window is paired with an
+"off" window run right next to it, and the overhead is the median ratio
+over those pairs, reported with a 95% confidence interval for that median
+(order statistics, so it assumes nothing about how the pairs scatter). All workers get the same PYTHONHASHSEED; with random
+seeds two identical workers already differ by a few percent. Even then two
+identical processes are not quite equally fast, so a third worker, a second
+one with metrics off, is timed the same way: its difference from the first
+is the noise floor the overhead has to be read against.
+
+On a noisy machine the pairs still scatter by several percent, so it takes
+a few hundred rounds to pin the median down to a fraction of a percent.
+The cost of the instrumentation itself (the middleware around a no-op WSGI
+app, a wrapped statement, a stage) is also timed directly.
+
+    python benchmarks/bench_metrics.py --rounds 400 --window 100
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+
+from common import READS, ROOT, seed
+from testing import BACKENDS, temporary_database
+
+FEATURES = {"age": 28, "BMI": 23.5, "cycle_variation": 3, "acne_severity": 1, "hair_growth": 0,
+            "fatigue": 1, "hemoglobin": 12.5, "breast_lump": 0, "breast_pain": 0}
+
+
+def worker(users):
+    """Child process: runs a window of requests per line on stdin and prints its duration."""
+    import random
+    from app import app
+
+    client = app.test_client()
+    rng = random.Random(0)
+    for line in sys.stdin:
+        start = time.perf_counter()
+        for i in range(int(line)):
+            user = rng.choice(users)
+            if i % 5 == 0:
+                response = client.post("/predict", json=dict(FEATURES, user_id=user))
+            else:
+                response = client.get(rng.choice(READS).format(user=user))
+            if response.status_code != 200:
+                raise RuntimeError("%s returned %d" % (response.request.path, response.status_code))
+        print(time.perf_counter() - start, flush=True)
+
+
+def timed_window(process, size):
+    process.stdin.write("%d\n" % size)
+    process.stdin.flush()
+    return float(process.stdout.readline())
+
+
+def component_costs(number=100000):
+    """Microseconds spent in the middleware, a statement wrapper and a stage."""
+    import metrics
+
+    def app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "application/json"), ("Content-Length", "2")])
+        return [b"{}"]
+
+    def start_response(status, headers, exc_info=None):
+        pass
+
+    def execute(cursor, statement, parameters, context=None):
+        pass
+
+    environ = {"REQUEST_METHOD": "GET"}
+    middleware = metrics.MetricsMiddleware(app)
+    timed = metrics._timed(execute)
+    metrics.enabled = True
+
+    def statements():
+        token = metrics.begin_request()
+        for _ in range(100):
+            timed(None, "SELECT 1", ())
+        metrics.end_request(token)
+
+    def stage():
+        with metrics.stage("bench"):
+            pass
+
+    return (
+        (timeit.timeit(lambda: middleware(environ, start_response).close(), number=number)
+         - timeit.timeit(lambda: app(environ, start_response), number=number)) / number * 1e6,
+        (timeit.timeit(statements, number=number // 100)
+         - timeit.timeit(lambda: [execute(None, "SELECT 1", ()) for _ in range(100)], number=number // 100)) / number * 1e6,
+        timeit.timeit(stage, number=number) / number * 1e6,
+    )
+
+
+def median_interval(values):
+    """The sample median and a 95% confidence interval for the true median."""
+    ordered = sorted(values)
+    n = len(ordered)
+    spread = 0.98 * n ** 0.5  # 1.96 standard deviations of Binomial(n, 0.5), halved
+    low, high = max(0, int(n / 2 - spread)), min(n - 1, int(n / 2 + spread + 1))
+    return statistics.median(ordered), ordered[low], ordered[high]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=400, help="off/on window pairs")
+    parser.add_argument("--window", type=int, default=100, help="requests per window")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(json.loads(args.worker))
+        return
+
+    with temporary_database(args.backend) as url:
+        os.environ["SHECARE_DATABASE_URI"] = url
+        os.chdir(ROOT)
+        users = seed(args.users, 6, 10)
+        workers = {
+            name: subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), "--worker", json.dumps(users)],
+                env=dict(os.environ, SHECARE_METRICS_ENABLED=flag, PYTHONHASHSEED="0"), stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                text=True
+            )
+            for name, flag in (("off", "0"), ("on", "1"), ("control", "0"))
+        }
+        try:
+            for process in workers.values():
+                timed_window(process, args.window)  # warm-up
+            results = {name: [] for name in workers}
+            order = list(workers)
+            for i in range(args.rounds):
+                for name in order[i % 3:] + order[:i % 3]:
+                    results[name].append(timed_window(workers[name], args.window))
+        finally:
+            for process in workers.values():
+                process.stdin.close()
+                process.wait()
+    print("metrics off %.1f us/request, on %.1f us/request (medians of %d windows)" % (
+        statistics.median(results["off"]) / args.window * 1e6, statistics.median(results["on"]) / args.window * 1e6,
+        args.rounds
+    ))
+    for label, name in (("overhead", "on"), ("off vs off", "control")):
+        ratios = [other / off - 1 for off, other in zip(results["off"], results[name])]
+        quartiles = statistics.quantiles(ratios, n=4)
+        median, low, high = median_interval(ratios)
+        print("%s %.2f%% (95%% confidence interval %.2f%% .. %.2f%%; pairs interquartile range %.2f%% .. %.2f%%)" % (
+            label, median * 100, low * 100, high * 100, quartiles[0] * 100, quartiles[2] * 100
+        ))
+    print("instrumentation: %.1f us/request, %.1f us/statement, %.1f us/stage" % component_costs())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""Write latency of other requests while expired guests are purged.
+
+Seeds expired guests with predictions and period logs, then runs
+purge_expired() (what `flask purge-anonymous` does) at each batch size while
+writer threads keep inserting predictions for an active user:
+
+    python benchmarks/bench_purge.py --guests 20000 --batch-sizes 1000000,1000,200
+"""
+import argparse
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from common import ROOT, percentile
+from testing import BACKENDS, temporary_database
+
+PREDICTION = {"pcos_risk": 0, "anemia_risk": 1, "breast_cancer_risk": 0,
+              "pcos_probability": 0.1, "anemia_probability": 0.6, "breast_cancer_probability": 0.05}
+
+
+def seed(engine, guests, predictions, periods, chunk=5000):
+    from sqlalchemy import insert
+    from database import User, Prediction, PeriodLog
+
+    users = User.__table__
+    old = datetime.utcnow() - timedelta(days=400)
+    with engine.begin() as conn:
+        for start in range(0, guests, chunk):
+            rows = [{"name": "Anonymous", "is_anonymous": True, "created_at": old, "last_seen_at": old}
+                    for _ in range(min(chunk, guests - start))]
+            ids = conn.execute(insert(users).returning(users.c.id, sort_by_parameter_order=True), rows).scalars().all()
+            conn.execute(insert(Prediction.__table__),
+                         [dict(PREDICTION, user_id=i, created_at=old) for i in ids for _ in range(predictions)])
+            conn.execute(insert(PeriodLog.__table__),
+                         [{"user_id": i, "start_date": date(2025, 1, 1), "created_at": old}
+                          for i in ids for _ in range(periods)])
+
+
+def write_while(engine, user_id, done, threads):
+    from sqlalchemy import insert
+    from database import Prediction
+
+    latencies = []
+    lock = threading.Lock()
+
+    def writer():
+        local = []
+        while not done.is_set():
+            start = time.perf_counter()
+            with engine.begin() as conn:
+                conn.execute(insert(Prediction.__table__), dict(PREDICTION, user_id=user_id))
+            local.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.005)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=writer) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    return workers, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guests", type=int, default=20000, help="expired guests seeded per run")
+    parser.add_argument("--predictions", type=int, default=5, help="predictions per guest")
+    parser.add_argument("--periods", type=int, default=3, help="period logs per guest")
+    parser.add_argument("--batch-sizes", default="1000000,1000,200", help="comma-separated purge batch sizes")
+    parser.add_argument("--pause", type=float, default=0.05)
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    parser.add_argument("--db-dir", help="directory for the database (default: a temp dir)")
+    args = parser.parse_args()
+
+    with temporary_database(args.backend, args.db_dir) as url:
+        os.environ["SHECARE_DATABASE_URI"] = url
+        os.chdir(ROOT)
+        from app import app, guests
+        from anonymous import purge_expired
+        from database import db, User
+        from migrations import upgrade
+
+        with app.app_context():
+            upgrade()
+            engine = db.engine
+            active = User(name="Active", is_anonymous=False)
+            db.session.add(active)
+            db.session.commit()
+            active_id = active.id
+
+        for batch_size in map(int, args.batch_sizes.split(",")):
+            seed(engine, args.guests, args.predictions, args.periods)
+            done = threading.Event()
+            workers, latencies = write_while(engine, active_id, done, args.writers)
+            time.sleep(0.5)
+            start = time.perf_counter()
+            counts = purge_expired(engine, guests.ttl, batch_size, args.pause)
+            elapsed = time.perf_counter() - start
+            done.set()
+            for t in workers:
+                t.join()
+            print("batch %-8d purge %6.2f s (%d users)  writes p50 %.1f / p99 %.1f / max %.1f ms" % (
+                batch_size, elapsed, counts["users"], percentile(latencies, 50),
+                percentile(latencies, 99), max(latencies)
+            ))
+
+
+if __name__ == "__main__":
+    main()
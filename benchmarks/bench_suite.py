@@ -0,0 +1,335 @@
+"""Per-endpoint benchmark of every route in app.py, with a regression check.
+
+Generates a synthetic population (benchmarks/population.py) into a throwaway
+SQLite database, then measures each route twice:
+
+- alone, one request at a time through the Flask test client: throughput,
+  p50/p95/p99 latency and the peak memory allocated while serving a request
+  (tracemalloc, in a separate pass so tracing does not skew the timings);
+- under load, from several processes each driving its own test client with a
+  weighted mix of all routes: per-route throughput and latency, plus each
+  process's peak RSS.
+
+The report is JSON. Compare it against a saved one to fail CI on regressions:
+
+    python benchmarks/bench_suite.py --save-baseline bench-baseline.json
+    python benchmarks/bench_suite.py --baseline bench-baseline.json --out report.json
+
+A route without a request in ENDPOINTS fails the run, so new routes get
+benchmarked. Baselines only compare on the same machine and arguments.
+"""
+import argparse
+import fnmatch
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from common import ROOT, percentile
+from population import PASSWORD, generate, load_features, load_symptoms
+from testing import BACKENDS, temporary_database
+
+BATCH_ROWS = 50
+
+
+class Traffic:
+    """Builds the requests for each route from the synthetic population."""
+
+    def __init__(self, population, client, seed):
+        self.population = population
+        self.client = client
+        self.rng = random.Random(seed)
+        self.features = load_features()
+        self.symptoms = load_symptoms()
+        self.counter = 0
+
+    def user(self):
+        return self.rng.choice(self.population["users"])
+
+    def sample(self, **extra):
+        return dict(self.rng.choice(self.features), **extra)
+
+    def unique(self):
+        self.counter += 1
+        return "%d-%d" % (os.getpid(), self.counter)
+
+    def day(self):
+        return (date(2027, 1, 1) + timedelta(days=self.rng.randint(0, 3000))).isoformat()
+
+    def new_period(self):
+        """Logs a period to delete; not part of the timed request."""
+        response = self.client.post("/period/log", json={"user_id": self.user(), "start_date": self.day()})
+        return response.json["period_id"]
+
+
+ENDPOINTS = {
+    "GET /": lambda t: ("GET", "/", None),
+    "GET /dashboard": lambda t: ("GET", "/dashboard", None),
+    "GET /history-page/<int:user_id>": lambda t: ("GET", "/history-page/%d" % t.user(), None),
+    "GET /period-tracker": lambda t: ("GET", "/period-tracker", None),
+    "GET /nutrition-planner": lambda t: ("GET", "/nutrition-planner", None),
+    "GET /lifestyle": lambda t: ("GET", "/lifestyle", None),
+    "POST /register": lambda t: ("POST", "/register", {
+        "name": "Bench", "email": "bench-%s@example.com" % t.unique(), "password": PASSWORD
+    }),
+    "POST /login": lambda t: ("POST", "/login", {
+        "email": t.rng.choice(t.population["registered"]), "password": PASSWORD
+    }),
+    "POST /anonymous-login": lambda t: ("POST", "/anonymous-login", None),
+    "POST /predict": lambda t: ("POST", "/predict", t.sample(user_id=t.user())),
+    "POST /predict/batch": lambda t: ("POST", "/predict/batch", [
+        t.sample(user_id=t.user()) for _ in range(BATCH_ROWS)
+    ]),
+    "GET /models": lambda t: ("GET", "/models", None),
+    "GET /metrics": lambda t: ("GET", "/metrics", None),
+    "GET /risk-config": lambda t: ("GET", "/risk-config", None),
+    "GET /history/<int:user_id>": lambda t: ("GET", "/history/%d?limit=20" % t.user(), None),
+    "POST /period/log": lambda t: ("POST", "/period/log", {
+        "user_id": t.user(), "start_date": t.day(), "flow_intensity": t.rng.choice(["light", "medium"]),
+        "symptoms": t.rng.sample(t.symptoms, 2)
+    }),
+    "PUT /period/update/<int:period_id>": lambda t: (
+        "PUT", "/period/update/%d" % t.rng.choice(t.population["period_ids"]),
+        {"flow_intensity": t.rng.choice(["light", "medium", "heavy"]), "notes": "bench"}
+    ),
+    "DELETE /period/delete/<int:period_id>": lambda t: ("DELETE", "/period/delete/%d" % t.new_period(), None),
+    "GET /period/history/<int:user_id>": lambda t: ("GET", "/period/history/%d?limit=12" % t.user(), None),
+    "GET /period/cache-stats": lambda t: ("GET", "/period/cache-stats", None),
+    "GET /period/predictions/<int:user_id>": lambda t: ("GET", "/period/predictions/%d" % t.user(), None),
+    "GET /period/stats/<int:user_id>": lambda t: ("GET", "/period/stats/%d" % t.user(), None),
+    "GET /period/current-phase/<int:user_id>": lambda t: ("GET", "/period/current-phase/%d" % t.user(), None),
+    "GET /analytics/predictions": lambda t: (
+        "GET", "/analytics/predictions?from=%s" % (date.today() - timedelta(days=90)), None
+    ),
+    "GET /analytics/cycle-lengths": lambda t: ("GET", "/analytics/cycle-lengths", None),
+    "POST /nutrition/generate": lambda t: ("POST", "/nutrition/generate", {
+        "symptoms": t.rng.sample(t.symptoms, t.rng.randint(1, 3))
+    }),
+}
+
+# share of the load mix: mostly dashboard reads, some writes, few KDF-bound logins
+WEIGHTS = {
+    "POST /register": 0.2, "POST /login": 0.5, "POST /predict/batch": 0.5, "DELETE /period/delete/<int:period_id>": 0.5,
+    "GET /history/<int:user_id>": 10, "GET /period/history/<int:user_id>": 10, "GET /period/stats/<int:user_id>": 10,
+    "GET /period/predictions/<int:user_id>": 10, "GET /period/current-phase/<int:user_id>": 10, "POST /predict": 5,
+    "POST /period/log": 3,
+}
+
+
+def app_routes(app):
+    return {
+        "%s %s" % (method, rule.rule)
+        for rule in app.url_map.iter_rules() if rule.endpoint != "static"
+        for method in rule.methods - {"HEAD", "OPTIONS"}
+    }
+
+
+def send(client, method, url, body):
+    start = time.perf_counter()
+    response = client.open(url, method=method, json=body)
+    elapsed = time.perf_counter() - start
+    response.close()
+    return elapsed, response.status_code < 400
+
+
+def summarize(latencies, errors, seconds):
+    ms = [s * 1000 for s in latencies]
+    return {
+        "requests": len(ms), "errors": errors, "req_per_s": round(len(ms) / seconds, 1) if seconds else None,
+        "p50_ms": round(percentile(ms, 50), 3), "p95_ms": round(percentile(ms, 95), 3),
+        "p99_ms": round(percentile(ms, 99), 3)
+    }
+
+
+def run_single(traffic, names, requests, max_seconds, memory_samples):
+    """Each route alone: timed requests, then a tracemalloc pass."""
+    results = {}
+    for name in names:
+        factory = ENDPOINTS[name]
+        for _ in range(3):
+            send(traffic.client, *factory(traffic))
+        latencies = []
+        errors = 0
+        deadline = time.perf_counter() + max_seconds
+        while len(latencies) < requests and (len(latencies) < 10 or time.perf_counter() < deadline):
+            elapsed, ok = send(traffic.client, *factory(traffic))
+            latencies.append(elapsed)
+            errors += not ok
+        result = summarize(latencies, errors, sum(latencies))
+
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(memory_samples):
+                request = factory(traffic)
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                send(traffic.client, *request)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+        result["peak_alloc_kb"] = round(percentile(peaks, 50) / 1024, 1)
+        results[name] = result
+        print("%-42s %8.1f req/s  p50 %7.2f  p95 %7.2f  p99 %7.2f ms  %8.1f KiB%s" % (
+            name, result["req_per_s"], result["p50_ms"], result["p95_ms"], result["p99_ms"],
+            result["peak_alloc_kb"], "  %d ERRORS" % errors if errors else ""
+        ))
+    return results
+
+
+def load_worker(population, names, seed, duration, ready, start, results):
+    from app import app
+
+    traffic = Traffic(population, app.test_client(), seed)
+    weights = [WEIGHTS.get(name, 1) for name in names]
+    for name in names:
+        send(traffic.client, *ENDPOINTS[name](traffic))
+    ready.put(os.getpid())
+    start.wait()
+    latencies = {name: [] for name in names}
+    errors = dict.fromkeys(names, 0)
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        name = traffic.rng.choices(names, weights)[0]
+        elapsed, ok = send(traffic.client, *ENDPOINTS[name](traffic))
+        latencies[name].append(elapsed)
+        errors[name] += not ok
+    results.put({
+        "latencies": latencies, "errors": errors,
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    })
+
+
+def run_load(population, names, processes, duration, seed):
+    """All routes at once from `processes` processes, each with its own app and test client."""
+    context = multiprocessing.get_context("spawn")
+    ready, results, start = context.Queue(), context.Queue(), context.Event()
+    workers = [
+        context.Process(target=load_worker, args=(population, names, seed + i, duration, ready, start, results))
+        for i in range(1, processes + 1)
+    ]
+    for w in workers:
+        w.start()
+    for _ in workers:
+        ready.get(timeout=300)
+    start.set()
+    reports = [results.get(timeout=duration + 300) for _ in workers]
+    for w in workers:
+        w.join()
+
+    endpoints = {}
+    for name in names:
+        latencies = [s for r in reports for s in r["latencies"][name]]
+        if latencies:
+            endpoints[name] = summarize(latencies, sum(r["errors"][name] for r in reports), duration)
+    total = sum(e["requests"] for e in endpoints.values())
+    result = {
+        "processes": processes, "duration_s": duration, "req_per_s": round(total / duration, 1),
+        "errors": sum(e["errors"] for e in endpoints.values()),
+        "max_rss_mb": max(r["max_rss_mb"] for r in reports), "endpoints": endpoints
+    }
+    print("load: %d processes, %.1f req/s, %d errors, max RSS %.1f MiB" % (
+        processes, result["req_per_s"], result["errors"], result["max_rss_mb"]
+    ))
+    return result
+
+
+def _slower(new, old, tolerance, floor):
+    return new > old * (1 + tolerance) and new - old > floor
+
+
+def compare(report, baseline, tolerance, min_ms=0.5, min_kb=64):
+    """Regressions of `report` against `baseline`, as messages."""
+    problems = []
+    for name, old in baseline["endpoints"].items():
+        new = report["endpoints"].get(name)
+        if new is None:
+            continue
+        if _slower(new["p95_ms"], old["p95_ms"], tolerance, min_ms):
+            problems.append("%s: p95 %.2f ms -> %.2f ms" % (name, old["p95_ms"], new["p95_ms"]))
+        if _slower(new["peak_alloc_kb"], old["peak_alloc_kb"], tolerance, min_kb):
+            problems.append("%s: peak alloc %.1f KiB -> %.1f KiB" % (name, old["peak_alloc_kb"], new["peak_alloc_kb"]))
+    old_load, new_load = baseline.get("load"), report.get("load")
+    if old_load and new_load:
+        # the total only compares for the same route mix
+        same_mix = baseline["meta"].get("endpoints") == report["meta"].get("endpoints")
+        if same_mix and new_load["req_per_s"] * (1 + tolerance) < old_load["req_per_s"]:
+            problems.append("load: %.1f req/s -> %.1f req/s" % (old_load["req_per_s"], new_load["req_per_s"]))
+        for name, old in old_load["endpoints"].items():
+            new = new_load["endpoints"].get(name)
+            if new is not None and _slower(new["p95_ms"], old["p95_ms"], tolerance, min_ms):
+                problems.append("load %s: p95 %.2f ms -> %.2f ms" % (name, old["p95_ms"], new["p95_ms"]))
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0, help="population and request seed")
+    parser.add_argument("--requests", type=int, default=300, help="timed requests per route")
+    parser.add_argument("--max-seconds", type=float, default=5.0, help="time cap per route (at least 10 requests)")
+    parser.add_argument("--memory-samples", type=int, default=10, help="requests per route traced for memory")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="load generator processes (0 = skip)")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of load")
+    parser.add_argument("--endpoints", default="*", help="only routes matching this glob, e.g. 'GET /period/*'")
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    parser.add_argument("--db-dir", help="directory for the database (default: a temp dir)")
+    parser.add_argument("--out", help="write the report as JSON")
+    parser.add_argument("--save-baseline", help="write the report as the new baseline")
+    parser.add_argument("--baseline", help="exit 1 if this run regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    with temporary_database(args.backend, args.db_dir) as url:
+        os.environ["SHECARE_DATABASE_URI"] = url
+        os.chdir(ROOT)
+        from app import app
+
+        missing = app_routes(app) - set(ENDPOINTS)
+        if missing:
+            raise SystemExit("No benchmark request for: " + ", ".join(sorted(missing)))
+        names = [name for name in ENDPOINTS if fnmatch.fnmatch(name, args.endpoints)]
+
+        started = time.perf_counter()
+        population = generate(args.users, args.seed)
+        print("population: %d users, %d period logs, %d predictions in %.1f s" % (
+            len(population["users"]), len(population["period_ids"]), population["predictions"],
+            time.perf_counter() - started
+        ))
+        report = {
+            "meta": {
+                "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                "backend": url.split(":", 1)[0], "users": args.users, "seed": args.seed, "endpoints": args.endpoints,
+                "period_logs": len(population["period_ids"]), "predictions": population["predictions"]
+            },
+            "endpoints": run_single(Traffic(population, app.test_client(), args.seed), names, args.requests,
+                                    args.max_seconds, args.memory_samples),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+        if args.processes:
+            report["load"] = run_load(population, names, args.processes, args.duration, args.seed)
+
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                json.dump(report, f, indent=2)
+    errors = sum(e["errors"] for e in report["endpoints"].values()) + report.get("load", {}).get("errors", 0)
+    problems = ["%d requests failed" % errors] if errors else []
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems += compare(report, json.load(f), args.tolerance)
+    for problem in problems:
+        print("REGRESSION " + problem, file=sys.stderr)
+    if problems:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
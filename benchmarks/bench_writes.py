@@ -0,0 +1,112 @@
+"""Write throughput of /anonymous-login and /predict across gunicorn workers.
+
+Runs each configuration against a fresh database (SQLite on disk by default):
+
+    python benchmarks/bench_writes.py --workers 4 --threads 8 --concurrency 32 --group-commit-ms 0,2
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from common import ROOT, percentile, wait_ready
+from testing import BACKENDS, temporary_database
+
+FEATURES = {"age": 28, "BMI": 23.5, "cycle_variation": 3, "acne_severity": 1, "hair_growth": 0,
+            "fatigue": 1, "hemoglobin": 12.5, "breast_lump": 0, "breast_pain": 0}
+
+
+def drive(port, concurrency, duration):
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    stop = time.monotonic() + duration
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        local = []
+        token = user_id = None
+        while time.monotonic() < stop:
+            if token is None:
+                args = ("POST", "/anonymous-login")
+            else:
+                # a guest's first prediction creates its users row
+                guest = {"user_id": user_id} if user_id else {"anonymous_token": token}
+                args = ("POST", "/predict", json.dumps(dict(FEATURES, **guest)),
+                        {"Content-Type": "application/json"})
+            start = time.perf_counter()
+            try:
+                conn.request(*args)
+                response = conn.getresponse()
+                body = response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                status = type(e).__name__
+            local.append((time.perf_counter() - start) * 1000)
+            if status != 200:
+                with lock:
+                    errors.append(status)
+            elif token is None:
+                token = json.loads(body)["token"]
+            else:
+                user_id = user_id or json.loads(body)["user_id"]
+                if len(local) % 4 == 0:
+                    # every fourth request starts a new guest session
+                    token = user_id = None
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    return {
+        "requests": len(latencies), "errors": len(errors), "req_per_s": round(len(latencies) / wall, 1),
+        "p50_ms": round(percentile(latencies, 50), 2), "p99_ms": round(percentile(latencies, 99), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--threads", type=int, default=8,
+                        help="threads per worker; group commit needs concurrent requests in one process")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--group-commit-ms", default="0,2", help="comma-separated windows to compare (0 = off)")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--backend", choices=BACKENDS, default="sqlite",
+                        help="database (auto = temporary PostgreSQL if installed)")
+    parser.add_argument("--db-dir", help="directory for the databases (default: a temp dir)")
+    args = parser.parse_args()
+
+    for window in args.group_commit_ms.split(","):
+        with temporary_database(args.backend, args.db_dir) as url:
+            env = dict(os.environ, SHECARE_GROUP_COMMIT_MS=window, SHECARE_DATABASE_URI=url)
+            subprocess.run([sys.executable, "-m", "flask", "--app", "app", "db-upgrade"], cwd=ROOT, env=env, check=True)
+            server = subprocess.Popen(
+                [sys.executable, "-m", "gunicorn", "-w", str(args.workers), "--threads", str(args.threads),
+                 "-b", "127.0.0.1:%d" % args.port, "--no-control-socket", "--log-level", "warning", "app:app"],
+                cwd=ROOT, env=env
+            )
+            try:
+                wait_ready(args.port)
+                r = drive(args.port, args.concurrency, args.duration)
+            finally:
+                server.terminate()
+                server.wait()
+        print("group commit %-4s ms  %7.1f req/s  p50 %.1f ms  p99 %.1f ms  errors %d" % (
+            window, r["req_per_s"], r["p50_ms"], r["p99_ms"], r["errors"]
+        ))
+
+
+if __name__ == "__main__":
+    main()
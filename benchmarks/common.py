@@ -0,0 +1,68 @@
+"""Helpers shared by the benchmarks.
+
+Importing this module puts the repository root on sys.path, so the
+benchmarks can import app, testing and the other top-level modules.
+"""
+import http.client
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the dashboard reads a client polls for one user
+READS = [
+    "/history/{user}?limit=20",
+    "/period/history/{user}?limit=12",
+    "/period/predictions/{user}",
+    "/period/stats/{user}",
+    "/period/current-phase/{user}"
+]
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def seed(users, periods, predictions):
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+    client = app.test_client()
+    features = {"age": 28, "BMI": 23.5, "cycle_variation": 3, "acne_severity": 1, "hair_growth": 0,
+                "fatigue": 1, "hemoglobin": 12.5, "breast_lump": 0, "breast_pain": 0}
+    ids = []
+    for _ in range(users):
+        # the guest's first period log creates its account
+        token = client.post("/anonymous-login").json["token"]
+        user = None
+        start = date(2025, 1, 1)
+        for _ in range(periods):
+            guest = {"user_id": user} if user else {"anonymous_token": token}
+            response = client.post("/period/log", json=dict(guest, start_date=start.isoformat(),
+                                                            end_date=(start + timedelta(days=4)).isoformat()))
+            user = user or response.json["user_id"]
+            start += timedelta(days=random.randint(25, 32))
+        if predictions:
+            client.post("/predict/batch", json=[dict(features, user_id=user)] * predictions)
+        ids.append(user)
+    return ids
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/models")
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("server on port %d did not start" % port)
@@ -0,0 +1,152 @@
+"""Synthetic user population for the benchmarks.
+
+generate() fills an empty database (point SHECARE_DATABASE_URI at it before
+calling) with registered users and guests, period histories and stored
+predictions. Rows are bulk inserted, so 10000 users take seconds rather than
+the minutes seeding through the API does. Everything is drawn from one
+random.Random(seed), so the same arguments give the same population.
+
+- Feature rows are bootstrapped from shecare_dataset_large.csv and scored by
+  the deployed models, so predictions have the dataset's feature mix and the
+  labels/probabilities the app would have stored for them.
+- Each user gets a mean cycle length (~N(28.5, 2.5) days) and a
+  cycle-to-cycle spread; about 15% have not logged a period yet.
+"""
+import csv
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+from common import ROOT
+
+DATASET = os.path.join(ROOT, "shecare_dataset_large.csv")
+PASSWORD = "bench-password"
+FLOWS = ["light", "medium", "heavy"]
+
+
+def load_features(path=DATASET):
+    """The model feature columns of every dataset row, as request-ready dicts."""
+    from inference import FEATURES
+
+    rows = []
+    with open(path, newline="") as f:
+        for record in csv.DictReader(f):
+            row = {}
+            for name in FEATURES:
+                value = float(record[name])
+                row[name] = int(value) if value.is_integer() else value
+            rows.append(row)
+    return rows
+
+
+def load_symptoms():
+    with open(os.path.join(ROOT, "data", "nutrition.json")) as f:
+        return list(json.load(f)["symptoms"])
+
+
+def period_history(rng, count, today):
+    """`count` consecutive periods ending within one cycle of `today`, oldest first."""
+    mean_cycle = min(38.0, max(22.0, rng.gauss(28.5, 2.5)))
+    spread = rng.uniform(0.5, 4.0)
+    duration = rng.randint(3, 7)
+    start = today - timedelta(days=rng.randint(0, int(mean_cycle)))
+    starts = [start]
+    for _ in range(count - 1):
+        start -= timedelta(days=int(round(min(45.0, max(18.0, rng.gauss(mean_cycle, spread))))))
+        starts.append(start)
+    starts.reverse()
+    return starts, duration
+
+
+def generate(users, seed=0, guest_share=0.5, max_periods=24, max_predictions=40, chunk=2000):
+    """Inserts the population and returns the ids the benchmark requests need."""
+    from sqlalchemy import insert
+
+    import cycle_summary
+    import rollups
+    from app import app, db, hasher, models, risk_policy, PROBABILITY_COLUMNS
+    from database import User, Prediction, PeriodLog
+    from migrations import upgrade
+
+    rng = random.Random(seed)
+    features = load_features()
+    symptoms = load_symptoms()
+    # one scrypt hash shared by every registered user keeps generation fast
+    password_hash = hasher.hash(PASSWORD)[0]
+    now = datetime.utcnow()
+    today = now.date()
+    columns = list(PROBABILITY_COLUMNS) + list(PROBABILITY_COLUMNS.values())
+    population = {"users": [], "registered": [], "tracked": [], "period_ids": [], "predictions": 0}
+
+    with app.app_context():
+        upgrade()
+        for offset in range(0, users, chunk):
+            rows = []
+            for i in range(offset, min(users, offset + chunk)):
+                created = now - timedelta(days=rng.randint(30, 900))
+                if rng.random() < guest_share:
+                    rows.append({"name": "Anonymous", "email": None, "password": None, "is_anonymous": True,
+                                 "anonymous_key": "%032x" % rng.getrandbits(128),
+                                 "last_seen_at": now - timedelta(days=rng.randint(0, 20)), "created_at": created})
+                else:
+                    rows.append({"name": "User %d" % i, "email": "user%d@example.com" % i, "password": password_hash,
+                                 "is_anonymous": False, "anonymous_key": None, "last_seen_at": None,
+                                 "created_at": created})
+            table = User.__table__
+            with db.engine.begin() as conn:
+                ids = conn.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows).scalars().all()
+
+            logs = []
+            predictions = []
+            for user_id, row in zip(ids, rows):
+                population["users"].append(user_id)
+                if not row["is_anonymous"]:
+                    population["registered"].append(row["email"])
+                if rng.random() >= 0.15:
+                    starts, duration = period_history(rng, rng.randint(1, max_periods), today)
+                    population["tracked"].append(user_id)
+                    for j, start in enumerate(starts):
+                        logs.append({
+                            "user_id": user_id, "start_date": start,
+                            "end_date": start + timedelta(days=duration - 1) if rng.random() < 0.95 else None,
+                            "flow_intensity": rng.choice(FLOWS),
+                            "symptoms": json.dumps(rng.sample(symptoms, rng.randint(0, 3))), "notes": None,
+                            "cycle_length": (start - starts[j - 1]).days if j else None,
+                            "created_at": datetime.combine(start, datetime.min.time())
+                        })
+                for _ in range(rng.randint(0, max_predictions)):
+                    predictions.append((user_id, rng.choice(features), row["created_at"] + timedelta(
+                        seconds=rng.randint(0, int((now - row["created_at"]).total_seconds()))
+                    )))
+
+            values = []
+            if predictions:
+                from inference import FEATURES
+
+                X = [[sample[name] for name in FEATURES] for _, sample, _ in predictions]
+                labels, probabilities = models.engine().score(X, risk_policy)
+                values = [
+                    dict(zip(columns, label_row + proba_row), user_id=user_id, age=sample["age"], created_at=created)
+                    for (user_id, sample, created), label_row, proba_row
+                    in zip(predictions, labels.tolist(), probabilities.tolist())
+                ]
+            with db.engine.begin() as conn:
+                if logs:
+                    table = PeriodLog.__table__
+                    population["period_ids"].extend(conn.execute(
+                        insert(table).returning(table.c.id, sort_by_parameter_order=True), logs
+                    ).scalars())
+                if values:
+                    conn.execute(insert(Prediction.__table__), values)
+            population["predictions"] += len(values)
+
+        # stored summaries, as the app would have after serving these logs
+        tracked = population["tracked"]
+        for offset in range(0, len(tracked), chunk):
+            for user_id in tracked[offset:offset + chunk]:
+                db.session.add(cycle_summary.rebuild(user_id))
+            db.session.commit()
+        # and rollups as the last compaction run left them
+        rollups.compact(db.engine)
+    return population
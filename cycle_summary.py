@@ -0,0 +1,198 @@
+import threading
+
+from sqlalchemy import func
+
+import forecasting
+from database import db, CycleSummary, PeriodLog
+from storage import dialect_insert
+from utils import feature_engineering
+
+
+VARIATION_WINDOW = 6
+
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "rebuilds": 0, "incremental_updates": 0}
+
+
+def _count(key):
+    with _lock:
+        _stats[key] += 1
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else None
+    return stats
+
+
+def avg_cycle(summary):
+    return summary.cycle_total / summary.cycle_count if summary.cycle_count else None
+
+
+def avg_duration(summary):
+    return summary.duration_total / summary.duration_count if summary.duration_count else None
+
+
+def cycle_variation(summary, session=None):
+    """Spread (max - min) of the user's last VARIATION_WINDOW cycle lengths.
+
+    Computed with one aggregate over the (user_id, start_date) index and kept
+    on the summary until the next period write resets it.
+    """
+    if summary.cycle_variation is None and summary.cycle_count:
+        session = db.session if session is None else session
+        recent = (
+            db.select(PeriodLog.cycle_length)
+            .where(PeriodLog.user_id == summary.user_id, PeriodLog.cycle_length != 0)
+            .order_by(PeriodLog.start_date.desc(), PeriodLog.id.desc())
+            .limit(VARIATION_WINDOW)
+            .subquery()
+        )
+        summary.cycle_variation = session.execute(
+            db.select(func.max(recent.c.cycle_length) - func.min(recent.c.cycle_length))
+        ).scalar()
+    return summary.cycle_variation
+
+
+def cycle_variations(user_ids, session=None):
+    """cycle_variation() for many users at once, as {user_id: spread}.
+
+    One indexed query for all of them; the window is applied by the vectorized
+    feature_engineering.cycle_variation. Users without cycles are left out.
+    """
+    session = db.session if session is None else session
+    rows = session.execute(
+        db.select(PeriodLog.user_id, PeriodLog.cycle_length)
+        .where(PeriodLog.user_id.in_(set(user_ids)), PeriodLog.cycle_length != 0)
+        .order_by(PeriodLog.user_id, PeriodLog.start_date.desc(), PeriodLog.id.desc())
+    ).all()
+    if not rows:
+        return {}
+    users, cycles = zip(*rows)
+    users, spread = feature_engineering.cycle_variation(users, cycles, VARIATION_WINDOW)
+    return {user: value for user, value in zip(users.tolist(), spread.tolist()) if value == value}
+
+
+def _duration(start_date, end_date):
+    return (end_date - start_date).days + 1 if end_date else None
+
+
+def rebuild(user_id, summary=None, session=None):
+    """Recomputes a user's summary from their period logs (one indexed query)."""
+    _count("rebuilds")
+    session = db.session if session is None else session
+    rows = session.execute(
+        db.select(PeriodLog.start_date, PeriodLog.end_date, PeriodLog.cycle_length)
+        .where(PeriodLog.user_id == user_id)
+        .order_by(PeriodLog.start_date.desc(), PeriodLog.id.desc())
+    ).all()
+    if summary is None:
+        summary = session.get(CycleSummary, user_id) or CycleSummary(user_id=user_id)
+    cycles = [r.cycle_length for r in rows if r.cycle_length]
+    durations = [_duration(r.start_date, r.end_date) for r in rows if r.end_date]
+    summary.period_count = len(rows)
+    summary.cycle_count = len(cycles)
+    summary.cycle_total = sum(cycles)
+    summary.shortest_cycle = min(cycles) if cycles else None
+    summary.longest_cycle = max(cycles) if cycles else None
+    summary.duration_count = len(durations)
+    summary.duration_total = sum(durations)
+    summary.last_start = rows[0].start_date if rows else None
+    summary.cycle_variation = None
+    summary.forecast_mean, summary.forecast_sd, summary.forecast_weight = forecasting.fit(
+        [r.start_date for r in rows[:forecasting.FIT_WINDOW + 1]]
+    )
+    return summary
+
+
+def _insert(summary, session):
+    """Stores a new summary unless a concurrent request for the same user already has.
+
+    Concurrent first reads (or first logs) of a user all miss; a plain INSERT
+    would fail every one but the first with a unique violation.
+    """
+    values = {c.key: getattr(summary, c.key) for c in CycleSummary.__table__.columns}
+    session.execute(
+        dialect_insert(session.get_bind())(CycleSummary.__table__)
+        .values({key: value for key, value in values.items() if value is not None})
+        .on_conflict_do_nothing()
+    )
+
+
+def _locked(user_id, session):
+    # re-read under a row lock, so concurrent logs of one user update the
+    # summary in turn (on SQLite the flushed period log holds the write lock)
+    return session.get(CycleSummary, user_id, with_for_update=True, populate_existing=True)
+
+
+def get_summary(user_id, session=None):
+    """Returns the stored summary, building (and persisting) it on a miss.
+
+    Users without any period logs get a transient empty summary so lookups for
+    unknown ids never write. `session` defaults to the Flask-SQLAlchemy one.
+    """
+    session = db.session if session is None else session
+    summary = session.get(CycleSummary, user_id)
+    if summary is not None:
+        _count("hits")
+        return summary
+    _count("misses")
+    summary = rebuild(user_id, CycleSummary(user_id=user_id), session)
+    if summary.period_count:
+        _insert(summary, session)
+        session.commit()
+        summary = session.get(CycleSummary, user_id)
+    return summary
+
+
+def on_period_logged(period_log, session=None):
+    """Folds a newly added log into the summary within the caller's transaction."""
+    session = db.session if session is None else session
+    summary = _locked(period_log.user_id, session)
+    if summary is None or (summary.last_start and period_log.start_date < summary.last_start):
+        # no summary yet, or a back-dated entry that reorders the history
+        if summary is None:
+            _insert(CycleSummary(user_id=period_log.user_id), session)
+            summary = _locked(period_log.user_id, session)
+        rebuild(period_log.user_id, summary, session)
+        return
+    _count("incremental_updates")
+    cycle = period_log.cycle_length
+    summary.period_count += 1
+    if cycle:
+        summary.cycle_count += 1
+        summary.cycle_total += cycle
+        summary.shortest_cycle = cycle if summary.shortest_cycle is None else min(summary.shortest_cycle, cycle)
+        summary.longest_cycle = cycle if summary.longest_cycle is None else max(summary.longest_cycle, cycle)
+    duration = _duration(period_log.start_date, period_log.end_date)
+    if duration is not None:
+        summary.duration_count += 1
+        summary.duration_total += duration
+    summary.last_start = period_log.start_date
+    summary.cycle_variation = None
+    summary.forecast_weight = None  # refitted on the next forecast read, see forecasting.stale()
+
+
+def on_period_updated(period_log, old_end_date):
+    summary = db.session.get(CycleSummary, period_log.user_id)
+    if summary is None or old_end_date == period_log.end_date:
+        return
+    _count("incremental_updates")
+    old = _duration(period_log.start_date, old_end_date)
+    new = _duration(period_log.start_date, period_log.end_date)
+    if old is not None:
+        summary.duration_count -= 1
+        summary.duration_total -= old
+    if new is not None:
+        summary.duration_count += 1
+        summary.duration_total += new
+
+
+def on_period_deleted(period_log):
+    # min/max cannot be un-applied, so deletes rebuild
+    summary = db.session.get(CycleSummary, period_log.user_id)
+    if summary is not None:
+        db.session.flush()
+        rebuild(period_log.user_id, summary)
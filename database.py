@@ -1,17 +1,73 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 from datetime import datetime
 
 db = SQLAlchemy()
 
+
+class utcnow(FunctionElement):
+    """Server-side UTC timestamp, matching the datetime.utcnow() client default."""
+    type = db.DateTime()
+    inherit_cache = True
+
+
+@compiles(utcnow)
+def _utcnow(element, compiler, **kw):
+    return "CURRENT_TIMESTAMP"
+
+
+@compiles(utcnow, 'postgresql')
+def _utcnow_postgresql(element, compiler, **kw):
+    return "TIMEZONE('utc', CURRENT_TIMESTAMP)"
+
+
+class day(FunctionElement):
+    """Calendar date of a DateTime expression (SQLite's CAST(... AS DATE) would give the year)."""
+    type = db.Date()
+    inherit_cache = True
+
+
+@compiles(day)
+def _day(element, compiler, **kw):
+    return "date(%s)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(day, 'postgresql')
+def _day_postgresql(element, compiler, **kw):
+    return "CAST(%s AS DATE)" % compiler.process(element.clauses, **kw)
+
+
+class epoch_day(FunctionElement):
+    """Days since 1970-01-01 of a Date expression, as an integer."""
+    type = db.Integer()
+    inherit_cache = True
+
+
+@compiles(epoch_day)
+def _epoch_day(element, compiler, **kw):
+    return "CAST(julianday(%s) - 2440587.5 AS INTEGER)" % compiler.process(element.clauses, **kw)
+
+
+@compiles(epoch_day, 'postgresql')
+def _epoch_day_postgresql(element, compiler, **kw):
+    return "(%s - DATE '1970-01-01')" % compiler.process(element.clauses, **kw)
+
+
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_anonymous_seen', 'is_anonymous', 'last_seen_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(100), unique=True, nullable=True)
     password = db.Column(db.String(100), nullable=True)
     is_anonymous = db.Column(db.Boolean, default=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    anonymous_key = db.Column(db.String(32), unique=True, index=True, nullable=True)  # from the guest's signed token
+    last_seen_at = db.Column(db.DateTime, nullable=True)  # guests only, see anonymous.TOUCH_INTERVAL
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=utcnow())
     
     predictions = db.relationship('Prediction', backref='user', lazy=True)
 
@@ -21,13 +77,20 @@ class User(db.Model):
 
 class Prediction(db.Model):
     __tablename__ = 'predictions'
+    __table_args__ = (
+        db.Index('ix_predictions_user_created', 'user_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     pcos_risk = db.Column(db.Integer, nullable=False)
     anemia_risk = db.Column(db.Integer, nullable=False)
     breast_cancer_risk = db.Column(db.Integer, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    pcos_probability = db.Column(db.Float, nullable=True)
+    anemia_probability = db.Column(db.Float, nullable=True)
+    breast_cancer_probability = db.Column(db.Float, nullable=True)
+    age = db.Column(db.Integer, nullable=True)  # input age, for the analytics age bands
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=utcnow())
 
     def __repr__(self):
         return f'<Prediction {self.id} for User {self.user_id}>'
@@ -35,6 +98,9 @@ class Prediction(db.Model):
 
 class PeriodLog(db.Model):
     __tablename__ = 'period_logs'
+    __table_args__ = (
+        db.Index('ix_period_logs_user_start', 'user_id', 'start_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -44,7 +110,64 @@ class PeriodLog(db.Model):
     symptoms = db.Column(db.Text, nullable=True)  # JSON string of symptoms
     notes = db.Column(db.Text, nullable=True)
     cycle_length = db.Column(db.Integer, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=utcnow())
+
+    def __repr__(self):
+        return f'<PeriodLog {self.id} for User {self.user_id}>'
+
+class CycleSummary(db.Model):
+    __tablename__ = 'cycle_summaries'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    period_count = db.Column(db.Integer, nullable=False, default=0)
+    cycle_count = db.Column(db.Integer, nullable=False, default=0)
+    cycle_total = db.Column(db.Integer, nullable=False, default=0)
+    shortest_cycle = db.Column(db.Integer, nullable=True)
+    longest_cycle = db.Column(db.Integer, nullable=True)
+    duration_count = db.Column(db.Integer, nullable=False, default=0)
+    duration_total = db.Column(db.Integer, nullable=False, default=0)
+    last_start = db.Column(db.Date, nullable=True)
+    cycle_variation = db.Column(db.Integer, nullable=True)  # memoized, reset on every period write
+    # forecasting.fit() of the cycle history, set by rebuild() and memoized after incremental writes
+    forecast_mean = db.Column(db.Float, nullable=True)
+    forecast_sd = db.Column(db.Float, nullable=True)
+    forecast_weight = db.Column(db.Float, nullable=True)  # effective number of cycles; 0 when none are usable
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=utcnow(), onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CycleSummary for User {self.user_id}>'
+
+
+class PredictionRollup(db.Model):
+    __tablename__ = 'prediction_rollups'
+
+    day = db.Column(db.Date, primary_key=True)
+    age_band = db.Column(db.String(10), primary_key=True)
+    predictions = db.Column(db.Integer, nullable=False, default=0)
+    pcos_positive = db.Column(db.Integer, nullable=False, default=0)
+    anemia_positive = db.Column(db.Integer, nullable=False, default=0)
+    breast_cancer_positive = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<PredictionRollup {self.day} {self.age_band}>'
+
+
+class CycleLengthRollup(db.Model):
+    __tablename__ = 'cycle_length_rollups'
+
+    cycle_length = db.Column(db.Integer, primary_key=True)
+    periods = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CycleLengthRollup {self.cycle_length}>'
+
+
+class RollupWatermark(db.Model):
+    __tablename__ = 'rollup_watermarks'
+
+    name = db.Column(db.String(40), primary_key=True)
+    last_id = db.Column(db.Integer, nullable=False, default=0)  # highest source row id folded into the rollup
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, server_default=utcnow(), onupdate=datetime.utcnow)
 
     def __repr__(self):
-        return f'<PeriodLog {self.id} for User {self.user_id}>'
\ No newline at end of file
+        return f'<RollupWatermark {self.name} {self.last_id}>'
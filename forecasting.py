@@ -0,0 +1,205 @@
+import itertools
+import warnings
+from datetime import date
+
+import numpy as np
+from sqlalchemy import select
+
+from database import db, PeriodLog, epoch_day
+
+
+# Cycle-length model behind the period forecasts.
+#
+# A user's cycles are the gaps between consecutive logged starts, the latest
+# FIT_WINDOW of them. Gaps more than OUTLIER_MADS robust deviations from the
+# median (a missed or mistyped log) are ignored, and the rest are averaged
+# with weights halving every HALF_LIFE cycles, so the forecast follows a
+# drifting cycle. The spread is their weighted variance shrunk towards
+# PRIOR_SD, so one or two cycles cannot claim to be precise. The k-th next
+# start is k mean cycles after the last one; its uncertainty grows with k
+# (independent cycles) and with the error of the mean itself.
+#
+# The fit works on users x cycles matrices: the same code fits one user on
+# a summary rebuild or every user at once in fit_all().
+
+FIT_WINDOW = 24
+HALF_LIFE = 6.0
+OUTLIER_MADS = 3.0
+MIN_MAD = 1.0  # days; a perfectly regular history still accepts a one-day change
+PRIOR_SD = 2.5  # days, a typical cycle-to-cycle spread
+PRIOR_WEIGHT = 2.0  # cycles the prior is worth
+DEFAULT_CYCLE = 28
+PERIOD_DAYS = 5  # when no end dates were logged
+LUTEAL_DAYS = 14  # ovulation to the next start
+FERTILE_BEFORE = 5  # sperm survive up to five days before ovulation
+FERTILE_AFTER = 1
+CONFIDENCE = 0.9
+Z = 1.6449  # two-sided normal quantile for CONFIDENCE
+DEFAULT_FORECASTS = 3
+MAX_FORECASTS = 12
+
+DECAY = 0.5 ** (np.arange(FIT_WINDOW) / HALF_LIFE)
+EPOCH = date(1970, 1, 1).toordinal()
+
+
+class ForecastError(ValueError):
+    pass
+
+
+def parse_count(value):
+    if value in (None, ""):
+        return DEFAULT_FORECASTS
+    try:
+        count = int(value)
+    except ValueError:
+        raise ForecastError("cycles must be an integer")
+    if not 1 <= count <= MAX_FORECASTS:
+        raise ForecastError("cycles must be between 1 and %d" % MAX_FORECASTS)
+    return count
+
+
+def fit_matrix(cycles):
+    """Fits every row of a users x cycles matrix (newest first, NaN where missing).
+
+    Returns (mean, sd, weight) arrays. weight is the effective number of
+    cycles; it is 0, with NaN mean and sd, for rows without a usable cycle.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN rows
+        median = np.nanmedian(cycles, axis=1, keepdims=True)
+        mad = np.maximum(1.4826 * np.nanmedian(np.abs(cycles - median), axis=1, keepdims=True), MIN_MAD)
+    inlier = np.abs(cycles - median) <= OUTLIER_MADS * mad  # False for NaN
+    weights = np.where(inlier, DECAY[:cycles.shape[1]], 0.0)
+    values = np.where(inlier, cycles, 0.0)
+    total = weights.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (weights * values).sum(axis=1) / total
+        variance = (weights * (values - mean[:, None]) ** 2).sum(axis=1) / total
+        weight = np.where(total > 0, total ** 2 / (weights ** 2).sum(axis=1), 0.0)
+    sd = np.sqrt((weight * variance + PRIOR_WEIGHT * PRIOR_SD ** 2) / (weight - 1 + PRIOR_WEIGHT))
+    return mean, sd, weight
+
+
+def fit(starts):
+    """(mean, sd, weight) of one user from their start dates, newest first; (None, None, 0.0) without cycles."""
+    cycles = np.array([(a - b).days for a, b in zip(starts, starts[1:FIT_WINDOW + 1])], dtype=float)
+    cycles[cycles <= 0] = np.nan  # duplicate starts
+    if not len(cycles):
+        return None, None, 0.0
+    mean, sd, weight = (float(v[0]) for v in fit_matrix(cycles[None, :]))
+    return (mean, sd, weight) if weight else (None, None, 0.0)
+
+
+def stale(summary):
+    # an incremental period write resets the fit; rebuild() refits it
+    return summary.forecast_weight is None and summary.period_count > 1
+
+
+def refit(summary, session=None):
+    """Fits the summary from the user's latest starts (one indexed query)."""
+    session = db.session if session is None else session
+    starts = session.scalars(
+        select(PeriodLog.start_date).where(PeriodLog.user_id == summary.user_id)
+        .order_by(PeriodLog.start_date.desc()).limit(FIT_WINDOW + 1)
+    ).all()
+    summary.forecast_mean, summary.forecast_sd, summary.forecast_weight = fit(starts)
+
+
+def model(summary):
+    """The summary's (mean, sd, weight), or the prior for users without a usable cycle."""
+    if summary.forecast_weight:
+        return summary.forecast_mean, summary.forecast_sd, summary.forecast_weight
+    return DEFAULT_CYCLE, PRIOR_SD, PRIOR_WEIGHT
+
+
+def offsets(mean, sd, weight, count):
+    """Days from the last start to the next `count` starts, as (expected, earliest, latest).
+
+    Arguments may be arrays of users; each result then has a row per user.
+    """
+    k = np.arange(1, count + 1)
+    mean, sd, weight = (np.asarray(v, dtype=float)[..., None] for v in (mean, sd, weight))
+    spread = Z * sd * np.sqrt(k + k ** 2 / weight)
+    return np.rint(k * mean), np.rint(k * mean - spread), np.rint(k * mean + spread)
+
+
+def dates(last, expected, earliest, latest):
+    """ISO dates of the /period/predictions fields from offsets() and last start days since 1970.
+
+    Works on whole arrays, so the batch formats every user's dates at once.
+    """
+    ovulation = expected - LUTEAL_DAYS
+    days = {
+        "predicted_start": expected,
+        "predicted_start_earliest": earliest,
+        "predicted_start_latest": latest,
+        "ovulation_day": ovulation,
+        "fertile_window_start": ovulation - FERTILE_BEFORE,
+        "fertile_window_end": ovulation + FERTILE_AFTER,
+        # the fertile window of the earliest and latest start
+        "fertile_window_earliest": earliest - LUTEAL_DAYS - FERTILE_BEFORE,
+        "fertile_window_latest": latest - LUTEAL_DAYS + FERTILE_AFTER,
+    }
+    last = np.asarray(last)[..., None]
+    return {name: (np.datetime64(0, "D") + (last + offset).astype("timedelta64[D]")).astype(str)
+            for name, offset in days.items()}
+
+
+def predictions(mean, dates):
+    """/period/predictions entries from one user's rows of dates()."""
+    names = list(dates)
+    return [
+        dict(zip(names, values), period_number=i + 1, avg_cycle_length=round(mean, 1))
+        for i, values in enumerate(zip(*(dates[name].tolist() for name in names)))
+    ]
+
+
+def forecast(last_start, mean, sd, weight, count=DEFAULT_FORECASTS):
+    """predictions() of one user."""
+    return predictions(mean, dates(last_start.toordinal() - EPOCH, *offsets(mean, sd, weight, count)))
+
+
+def load_starts(conn, batch=100000):
+    """(user_ids, start days since 1970) of every period log, per user newest first."""
+    stmt = select(PeriodLog.user_id, epoch_day(PeriodLog.start_date)).order_by(
+        PeriodLog.user_id.desc(), PeriodLog.start_date.desc()
+    )
+    result = conn.execute(stmt.execution_options(yield_per=batch))
+    chunks = [np.fromiter(itertools.chain.from_iterable(part), dtype=np.int64) for part in result.partitions()]
+    data = np.concatenate(chunks).reshape(-1, 2) if chunks else np.empty((0, 2), dtype=np.int64)
+    return data[:, 0], data[:, 1]
+
+
+def fit_all(user_ids, days):
+    """fit() of every user at once from load_starts() arrays.
+
+    Returns (user_ids, last start days, mean, sd, weight), one entry per user.
+    """
+    if not len(user_ids):
+        return user_ids, days, np.empty(0), np.empty(0), np.empty(0)
+    first = np.r_[True, user_ids[1:] != user_ids[:-1]]
+    heads = np.flatnonzero(first)
+    group = np.cumsum(first) - 1
+    position = np.arange(len(user_ids)) - heads[group]
+    # a row's cycle runs from the same user's next (older) start to its own
+    rows = np.flatnonzero((user_ids[:-1] == user_ids[1:]) & (position[:-1] < FIT_WINDOW))
+    gaps = (days[rows] - days[rows + 1]).astype(float)
+    gaps[gaps <= 0] = np.nan  # duplicate starts
+    cycles = np.full((len(heads), FIT_WINDOW), np.nan)
+    cycles[group[rows], position[rows]] = gaps
+    mean, sd, weight = fit_matrix(cycles)
+    return user_ids[heads], days[heads], mean, sd, weight
+
+
+def forecast_all(engine, count=DEFAULT_FORECASTS):
+    """Yields (user_id, predictions payload) for every user with a usable cycle, fitted in one pass."""
+    with engine.connect() as conn:
+        user_ids, last, mean, sd, weight = fit_all(*load_starts(conn))
+    usable = weight > 0
+    user_ids, last, mean, sd, weight = user_ids[usable], last[usable], mean[usable], sd[usable], weight[usable]
+    columns = dates(last, *offsets(mean, sd, weight, count))
+    for i, user_id in enumerate(user_ids.tolist()):
+        yield user_id, {
+            "avg_cycle_length": round(float(mean[i]), 1), "cycle_length_sd": round(float(sd[i]), 1),
+            "predictions": predictions(float(mean[i]), {name: column[i] for name, column in columns.items()})
+        }
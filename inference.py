@@ -0,0 +1,147 @@
+import json
+import pickle
+import threading
+
+import numpy as np
+from scipy.special import expit, logit
+
+from utils.feature_engineering import SCHEMA
+
+
+FEATURES = list(SCHEMA.features)
+
+TARGETS = ["pcos_risk", "anemia_risk", "breast_cancer_risk"]
+
+MODEL_PATHS = [
+    "model/pcos_model.pkl",
+    "model/anemia_model.pkl",
+    "model/breast_cancer_model.pkl"
+]
+
+
+class InferenceEngine:
+    """Scores every risk model with a single matrix multiply.
+
+    The three LogisticRegression models share the same nine features, so their
+    coefficient vectors are stacked into one (n_features, n_models) weight matrix.
+    Without a RiskPolicy, labels follow sklearn's binary LogisticRegression
+    rule exactly (classes_[decision > 0]); probabilities are expit(decision)
+    and agree with predict_proba up to floating-point rounding.
+    """
+
+    def __init__(self, models, names=TARGETS):
+        if len(models) != len(names):
+            raise ValueError("Expected one model per target")
+        for model in models:
+            if model.coef_.shape != (1, len(FEATURES)):
+                raise ValueError("Only binary linear models over %d features are supported" % len(FEATURES))
+        self.names = list(names)
+        self.weights = np.ascontiguousarray(np.vstack([m.coef_ for m in models]).T, dtype=np.float64)
+        self.intercepts = np.array([m.intercept_[0] for m in models], dtype=np.float64)
+        self.classes = np.array([m.classes_ for m in models])
+        # Platt scaling published with each model (identity when none was fitted)
+        calibrations = [getattr(m, "calibration", None) or {} for m in models]
+        self.slopes = np.array([float(c.get("slope", 1.0)) for c in calibrations])
+        self.offsets = np.array([float(c.get("intercept", 0.0)) for c in calibrations])
+        self._local = threading.local()
+
+    @classmethod
+    def from_pickles(cls, paths, names=TARGETS):
+        models = []
+        for path in paths:
+            with open(path, "rb") as f:
+                models.append(pickle.load(f))
+        return cls(models, names)
+
+    def _buffers(self):
+        # one preallocated input/output pair per thread, reused for every request
+        local = self._local
+        if not hasattr(local, "x"):
+            local.x = np.empty((1, len(FEATURES)), dtype=np.float64)
+            local.z = np.empty((1, len(self.names)), dtype=np.float64)
+        return local.x, local.z
+
+    def decision_function(self, X, out=None):
+        z = np.matmul(X, self.weights, out=out)
+        z += self.intercepts
+        return z
+
+    def labels(self, z, cutoffs=0.0):
+        idx = (z > cutoffs).astype(np.intp)
+        return np.take_along_axis(self.classes.T, idx, axis=0)
+
+    @staticmethod
+    def probabilities(z):
+        return expit(z)
+
+    def _finish(self, z, policy):
+        if policy is None:
+            return self.labels(z), self.probabilities(z)
+        z = policy.calibrate(z, self.slopes, self.offsets)
+        return self.labels(z, policy.cutoffs), self.probabilities(z)
+
+    def score(self, X, policy=None):
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != len(FEATURES):
+            raise ValueError("Expected a matrix with %d feature columns" % len(FEATURES))
+        return self._finish(self.decision_function(X), policy)
+
+    def score_one(self, values, policy=None):
+        x, z = self._buffers()
+        x[0] = values
+        self.decision_function(x, out=z)
+        labels, probas = self._finish(z, policy)
+        return (
+            {name: int(label) for name, label in zip(self.names, labels[0])},
+            {name: float(p) for name, p in zip(self.names, probas[0])}
+        )
+
+
+class RiskPolicy:
+    """Per-model probability calibration and decision thresholds.
+
+    Calibration is Platt scaling on the model's decision value,
+    p = expit(slope * z + intercept), so it reuses the forward pass; a label is
+    positive when p > threshold. train_model.py fits slope/intercept on the
+    cross-validation folds and publishes them with each model; a
+    "calibration" entry in the config overrides the published one. Models
+    published without calibration and threshold 0.5 reproduce the raw model
+    output exactly.
+    """
+
+    def __init__(self, config=None, names=TARGETS):
+        config = config or {}
+        entries = [config.get(name, {}) for name in names]
+        calibrations = [entry.get("calibration") or {} for entry in entries]
+        self.names = list(names)
+        self.thresholds = np.array([float(entry.get("threshold", 0.5)) for entry in entries])
+        if ((self.thresholds <= 0) | (self.thresholds >= 1)).any():
+            raise ValueError("Thresholds must be strictly between 0 and 1")
+        self.configured = np.array([bool(c) for c in calibrations])
+        self.slopes = np.array([float(c.get("slope", 1.0)) for c in calibrations])
+        self.offsets = np.array([float(c.get("intercept", 0.0)) for c in calibrations])
+        self.cutoffs = logit(self.thresholds)
+
+    @classmethod
+    def from_file(cls, path, names=TARGETS):
+        with open(path) as f:
+            return cls(json.load(f), names)
+
+    def calibrate(self, z, slopes, offsets):
+        """Applies the configured calibration, or the model's (`slopes`, `offsets`) where none is set."""
+        if not self.configured.any():
+            return z * slopes + offsets
+        return z * np.where(self.configured, self.slopes, slopes) + np.where(self.configured, self.offsets, offsets)
+
+    def describe(self, engine=None):
+        """The thresholds and, given the serving engine, the calibration actually applied."""
+        slopes, offsets = (self.slopes, self.offsets) if engine is None else (
+            np.where(self.configured, self.slopes, engine.slopes), np.where(self.configured, self.offsets, engine.offsets)
+        )
+        return {
+            name: {
+                "threshold": float(t),
+                "calibration": {"slope": float(a), "intercept": float(b), "source": "config" if own else "model"}
+            }
+            for name, t, a, b, own in zip(self.names, self.thresholds, slopes, offsets, self.configured)
+        }
@@ -0,0 +1,82 @@
+from datetime import date, datetime
+
+from sqlalchemy import event, inspect, text
+
+from database import db
+from pagination import encode_cursor
+
+
+# read endpoints whose per-user queries must be served from an index
+INDEXED_ENDPOINTS = [
+    "/history/0",
+    "/history/0?limit=20&cursor=" + encode_cursor(datetime(2024, 1, 1), 1),
+    "/period/history/0",
+    "/period/history/0?limit=20&fields=id,start_date&cursor=" + encode_cursor(date(2024, 1, 1), 1),
+    "/period/predictions/0",
+    "/period/stats/0",
+    "/period/current-phase/0",
+]
+
+
+def upgrade():
+    """Brings an existing database up to the current schema.
+
+    create_all() only creates missing tables, so indexes declared on tables
+    that already exist (e.g. an old instance/shecare.db) are added here.
+    """
+    db.create_all()
+    add_missing_columns()
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+
+
+def add_missing_columns():
+    """Adds nullable columns that were declared after a table was created."""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError("Cannot add NOT NULL column %s.%s automatically" % (table.name, column.name))
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                conn.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (table.name, column.name, column_type)))
+
+
+def capture_queries(client, urls):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        for url in urls:
+            client.get(url)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+    return statements
+
+
+def full_scans(statement, parameters):
+    """Returns the EXPLAIN QUERY PLAN lines that scan a whole table or index or sort in a temp b-tree."""
+    with db.engine.connect() as conn:
+        plan = conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters).fetchall()
+    details = [row[-1] for row in plan]
+    return [d for d in details if d.startswith("SCAN") or "TEMP B-TREE" in d]
+
+
+def check_query_plans(client, urls=INDEXED_ENDPOINTS):
+    """Returns (statement, plan lines) for every endpoint query that is not an index search."""
+    if db.engine.dialect.name != "sqlite":
+        raise RuntimeError("Query plan check only supports SQLite")
+    problems = []
+    for statement, parameters in capture_queries(client, urls):
+        scans = full_scans(statement, parameters)
+        if scans:
+            problems.append((" ".join(statement.split()), scans))
+    return problems
@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from inference import InferenceEngine, FEATURES, TARGETS, MODEL_PATHS
+
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "model")
+
+# pre-registry artifacts, served as version 0 until a versioned artifact exists
+LEGACY_PICKLES = dict(zip(TARGETS, [os.path.basename(p) for p in MODEL_PATHS]))
+
+_VERSIONED = re.compile(r"^(?P<name>[a-z_]+)-v(?P<version>\d+)\.json$")
+
+
+class LinearModel:
+    """A binary linear classifier with the coef_/intercept_/classes_ surface
+    InferenceEngine expects, re-ordered to the serving FEATURES order."""
+
+    def __init__(self, coef, intercept, classes, features, metadata):
+        missing = [f for f in FEATURES if f not in features]
+        if missing:
+            raise ValueError("Model is missing feature(s): " + ", ".join(missing))
+        order = [features.index(f) for f in FEATURES]
+        coef = np.asarray(coef).reshape(-1)
+        self.coef_ = coef[None, :] if order == list(range(len(FEATURES))) else coef[order][None, :]
+        self.intercept_ = np.asarray(intercept).reshape(1)
+        self.classes_ = np.asarray(classes)
+        self.calibration = metadata.get("calibration")
+        self.metadata = metadata
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return "sha256:" + digest.hexdigest()
+
+
+def _write_atomic(path, write):
+    tmp = path + ".tmp"
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def publish(name, coef, intercept, classes, features=FEATURES, training_hash=None, metrics=None, directory=MODEL_DIR,
+            calibration=None):
+    """Writes the next version of a model in the compact coefficient format.
+
+    The .npy array holds [coef..., intercept] as float64 and loads without
+    unpickling; InferenceEngine stacks the models' vectors into its own small
+    weight matrix. The metadata .json is written last (atomically),
+    which is what makes the new version visible to running registries.
+    calibration is the {"slope", "intercept"} Platt scaling RiskPolicy applies.
+    """
+    version = scan(directory).get(name, 0) + 1
+    artifact = "%s-v%d.npy" % (name, version)
+    weights = np.append(np.asarray(coef, dtype=np.float64).reshape(-1), float(np.asarray(intercept).reshape(-1)[0]))
+
+    def write_npy(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, weights)
+
+    _write_atomic(os.path.join(directory, artifact), write_npy)
+    metadata = {
+        "name": name,
+        "version": version,
+        "format": "coef",
+        "artifact": artifact,
+        "features": list(features),
+        "classes": np.asarray(classes).tolist(),
+        "training_hash": training_hash,
+        "metrics": metrics or {},
+        "calibration": calibration,
+        "created_at": datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    }
+
+    def write_json(tmp):
+        with open(tmp, "w") as f:
+            json.dump(metadata, f, indent=2)
+
+    _write_atomic(os.path.join(directory, "%s-v%d.json" % (name, version)), write_json)
+    return metadata
+
+
+def scan(directory=MODEL_DIR):
+    """Returns {name: latest version} for everything published in directory."""
+    latest = {}
+    for entry in os.listdir(directory):
+        match = _VERSIONED.match(entry)
+        if match:
+            name, version = match.group("name"), int(match.group("version"))
+            latest[name] = max(latest.get(name, 0), version)
+    for name, filename in LEGACY_PICKLES.items():
+        if name not in latest and os.path.exists(os.path.join(directory, filename)):
+            latest[name] = 0
+    return latest
+
+
+def load_model(name, version, directory=MODEL_DIR):
+    if version == 0:
+        with open(os.path.join(directory, LEGACY_PICKLES[name]), "rb") as f:
+            model = pickle.load(f)
+        features = list(getattr(model, "feature_names_in_", FEATURES))
+        metadata = {"name": name, "version": 0, "format": "pickle", "artifact": LEGACY_PICKLES[name]}
+        return LinearModel(model.coef_, model.intercept_, model.classes_, features, metadata)
+    with open(os.path.join(directory, "%s-v%d.json" % (name, version))) as f:
+        metadata = json.load(f)
+    if metadata["format"] != "coef":
+        raise ValueError("Unsupported model format: " + metadata["format"])
+    weights = np.load(os.path.join(directory, metadata["artifact"]))
+    return LinearModel(weights[:-1], weights[-1:], metadata["classes"], metadata["features"], metadata)
+
+
+class ModelRegistry:
+    """Lazily loads the latest version of every risk model and hot-swaps them.
+
+    The first call to engine() loads the models; afterwards the model directory
+    is re-scanned at most every `check_interval` seconds and, when a newer
+    version has been published, a new engine is built and swapped in with a
+    single reference assignment. Requests already holding the old engine finish
+    on it, so nothing is dropped during a rollout.
+    """
+
+    def __init__(self, directory=MODEL_DIR, names=TARGETS, check_interval=2.0):
+        self.directory = directory
+        self.names = list(names)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._current = None  # (engine, versions, models)
+        self._checked_at = 0.0
+
+    def _load(self, versions):
+        models = [load_model(name, versions[name], self.directory) for name in self.names]
+        return InferenceEngine(models, self.names), versions, models
+
+    def _latest(self):
+        found = scan(self.directory)
+        missing = [name for name in self.names if name not in found]
+        if missing:
+            raise FileNotFoundError("No artifact found for model(s): " + ", ".join(missing))
+        return {name: found[name] for name in self.names}
+
+    def engine(self):
+        current = self._current
+        now = time.monotonic()
+        if current is not None and now - self._checked_at < self.check_interval:
+            return current[0]
+        with self._lock:
+            if self._current is not None and now - self._checked_at < self.check_interval:
+                return self._current[0]
+            self._checked_at = now
+            try:
+                versions = self._latest()
+                if self._current is None or versions != self._current[1]:
+                    self._current = self._load(versions)
+            except (OSError, ValueError, KeyError):
+                # a half-published or broken version never replaces a working engine
+                if self._current is None:
+                    raise
+            return self._current[0]
+
+    def describe(self):
+        self.engine()
+        _, versions, models = self._current
+        return {name: model.metadata for name, model in zip(self.names, models)}
+
+
+def dataset_metrics(model, dataset, target):
+    """Accuracy, ROC AUC and log loss of `model` over every row of `dataset`.
+
+    The pickles carry no record of a held-out split, so unlike train_model's
+    test_* metrics these include the rows the model was fitted on.
+    """
+    import pandas as pd
+    from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+
+    frame = pd.read_csv(dataset, usecols=FEATURES + [target])
+    X, y = frame[FEATURES].to_numpy(dtype=np.float64), frame[target].to_numpy()
+    probabilities = 1 / (1 + np.exp(-(X @ model.coef_[0] + model.intercept_[0])))
+    labels = model.classes_[(probabilities > 0.5).astype(int)]
+    return {
+        "rows": int(len(y)),
+        "dataset_accuracy": round(float(accuracy_score(y, labels)), 4),
+        "dataset_auc": round(float(roc_auc_score(y, probabilities)), 4),
+        "dataset_log_loss": round(float(log_loss(y, probabilities, labels=[0, 1])), 4),
+    }
+
+
+def export_legacy(directory=MODEL_DIR, dataset=None):
+    """Publishes the legacy pickles as the first coefficient-format versions.
+
+    With the dataset they were trained on, its hash is recorded as
+    training_hash and the models are evaluated on it.
+    """
+    training_hash = file_hash(dataset) if dataset else None
+    published = []
+    for name in TARGETS:
+        model = load_model(name, 0, directory)
+        published.append(publish(
+            name, model.coef_, model.intercept_, model.classes_, training_hash=training_hash,
+            metrics=dataset_metrics(model, dataset, name) if dataset else None, directory=directory
+        ))
+    return published
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect or populate the SheCare model registry")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show the latest version of every model")
+    export = sub.add_parser("export", help="publish the legacy .pkl models in the coefficient format")
+    export.add_argument("--dataset", help="dataset the pickles were trained on, recorded as training_hash and evaluated on")
+    parser.add_argument("--dir", default=MODEL_DIR, help="model directory")
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        for metadata in export_legacy(args.dir, args.dataset):
+            print("Published %s v%d -> %s" % (metadata["name"], metadata["version"], metadata["artifact"]))
+    else:
+        for name, version in sorted(scan(args.dir).items()):
+            print("%s v%d" % (name, version))
+
+
+if __name__ == "__main__":
+    main()
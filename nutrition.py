@@ -0,0 +1,109 @@
+import json
+import os
+import threading
+from functools import lru_cache
+from types import MappingProxyType
+
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition.json")
+
+MEALS = ("breakfast", "lunch", "dinner", "snacks")
+MEALS_PER_PLAN = 3
+TIPS_PER_PLAN = 8
+
+
+class KnowledgeBase:
+    """Immutable, indexed view of data/nutrition.json.
+
+    Every distinct meal (by name) is stored once in `meals` and referenced by
+    id from the per-symptom index lists; symptoms keep the order of the data
+    file, which is also the order plans are assembled in.
+    """
+
+    def __init__(self, data, mtime=None):
+        meals = []
+        meal_ids = {}
+        index = {}
+        for symptom, entry in data["symptoms"].items():
+            lists = {}
+            for category in MEALS:
+                ids = []
+                for meal in entry.get(category, []):
+                    if meal["name"] not in meal_ids:
+                        meal_ids[meal["name"]] = len(meals)
+                        meals.append(MappingProxyType({
+                            "name": meal["name"],
+                            "ingredients": tuple(meal["ingredients"]),
+                            "benefits": meal["benefits"]
+                        }))
+                    ids.append(meal_ids[meal["name"]])
+                lists[category] = tuple(ids)
+            lists["tips"] = tuple(entry.get("tips", []))
+            index[symptom] = MappingProxyType(lists)
+        self.meals = tuple(meals)
+        self.index = MappingProxyType(index)
+        self.order = MappingProxyType({symptom: i for i, symptom in enumerate(index)})
+        self.mtime = mtime
+        self.plan_json = lru_cache(maxsize=512)(self._plan_json)
+
+    @classmethod
+    def load(cls, path=DATA_PATH):
+        mtime = os.stat(path).st_mtime_ns
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f), mtime)
+
+    def key(self, symptoms):
+        """Canonical cache key: known symptoms, deduplicated, in data-file order."""
+        known = {s for s in symptoms if isinstance(s, str) and s in self.index}
+        return tuple(sorted(known, key=self.order.__getitem__))
+
+    def plan(self, key):
+        combined = {category: [] for category in MEALS}
+        tips = {}
+        added = set()
+        for symptom in key:
+            entry = self.index[symptom]
+            for category in MEALS:
+                for meal_id in entry[category]:
+                    if meal_id not in added:
+                        combined[category].append(meal_id)
+                        added.add(meal_id)
+            tips.update(dict.fromkeys(entry["tips"]))
+        result = {
+            category: [self._meal(i) for i in ids[:MEALS_PER_PLAN]] for category, ids in combined.items()
+        }
+        result["tips"] = list(tips)[:TIPS_PER_PLAN]
+        return result
+
+    def _meal(self, meal_id):
+        meal = self.meals[meal_id]
+        return {"name": meal["name"], "ingredients": list(meal["ingredients"]), "benefits": meal["benefits"]}
+
+    def _plan_json(self, key):
+        return json.dumps(self.plan(key), sort_keys=True, separators=(",", ":"))
+
+
+class KnowledgeBaseLoader:
+    """Loads the knowledge base once and swaps in a fresh copy when the file changes."""
+
+    def __init__(self, path=DATA_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._kb = KnowledgeBase.load(path)
+
+    def get(self):
+        kb = self._kb
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return kb
+        if mtime != kb.mtime:
+            with self._lock:
+                if self._kb.mtime != mtime:
+                    try:
+                        self._kb = KnowledgeBase.load(self.path)
+                    except (OSError, ValueError, KeyError):
+                        # keep serving the last good copy while the file is mid-edit
+                        return self._kb
+                kb = self._kb
+        return kb
@@ -0,0 +1,136 @@
+import base64
+import itertools
+import json
+from datetime import date, datetime
+
+from flask import Response, current_app
+from sqlalchemy import and_, or_, select
+
+import metrics
+from database import db
+
+
+MAX_LIMIT = 1000
+STREAM_BATCH = 500
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def encode_cursor(sort_value, row_id):
+    if isinstance(sort_value, date):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort_type):
+    parsers = {datetime: datetime.fromisoformat, date: date.fromisoformat, float: float, int: int}
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        return parsers[sort_type](sort_value), int(row_id)
+    except (ValueError, TypeError, KeyError):
+        raise PaginationError("Invalid cursor")
+
+
+def parse_fields(value, fields):
+    if not value:
+        return list(fields)
+    selected = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = [name for name in selected if name not in fields]
+    if unknown:
+        raise PaginationError("Unknown field(s): " + ", ".join(unknown))
+    return selected
+
+
+def parse_limit(value):
+    if value is None:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError("limit must be an integer")
+    if not 1 <= limit <= MAX_LIMIT:
+        raise PaginationError("limit must be between 1 and %d" % MAX_LIMIT)
+    return limit
+
+
+def keyset_query(fields, where, sort_col, id_col, args):
+    """Builds the keyset select for keyset_response.
+
+    Returns (stmt, selected, limit); a limited query must fetch limit + 1 rows,
+    see next_page().
+    """
+    selected = parse_fields(args.get("fields"), fields)
+    limit = parse_limit(args.get("limit"))
+    stmt = select(*[fields[name][0] for name in selected], sort_col, id_col).where(where)
+    if args.get("cursor"):
+        sort_value, row_id = decode_cursor(args["cursor"], sort_col.type.python_type)
+        stmt = stmt.where(or_(sort_col < sort_value, and_(sort_col == sort_value, id_col < row_id)))
+    stmt = stmt.order_by(sort_col.desc(), id_col.desc())
+    if limit is not None:
+        stmt = stmt.limit(limit + 1)
+    return stmt, selected, limit
+
+
+def next_page(rows, limit):
+    """Trims the extra row of a limit + 1 fetch; returns (rows, headers)."""
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, {"X-Next-Cursor": encode_cursor(rows[-1][-2], rows[-1][-1])}
+    return rows, {}
+
+
+def renderer(fields, selected, dumps):
+    formatters = [fields[name][1] for name in selected]
+
+    def render(row):
+        return dumps({
+            name: fmt(value) if fmt and value is not None else value
+            for name, fmt, value in zip(selected, formatters, row)
+        })
+
+    return render
+
+
+def json_array(rows, render):
+    yield "["
+    batch = []
+    sep = ""
+    for row in rows:
+        batch.append(render(row))
+        if len(batch) == STREAM_BATCH:
+            yield sep + ",".join(batch)
+            batch = []
+            sep = ","
+    if batch:
+        yield sep + ",".join(batch)
+    yield "]"
+
+
+def keyset_response(fields, where, sort_col, id_col, args):
+    """Streams the rows matching `where` newest first as a JSON array.
+
+    `fields` maps output names to (column, formatter); only the requested
+    columns are selected. With ?limit=N one page is returned and the cursor
+    for the next page is sent in the X-Next-Cursor header (pass it back as
+    ?cursor=...). Without a limit every row is streamed in batches, so a full
+    export never sits in memory.
+    """
+    stmt, selected, limit = keyset_query(fields, where, sort_col, id_col, args)
+    render = renderer(fields, selected, current_app.json.dumps)
+    if limit is not None:
+        rows, headers = next_page(db.session.execute(stmt).all(), limit)
+        return Response(json_array(rows, render), mimetype="application/json", headers=headers)
+    engine = db.engine
+
+    def generate():
+        # the request's session is torn down before the body is sent, so the
+        # stream owns its connection (and, on PostgreSQL, a server-side cursor)
+        with engine.connect() as conn:
+            result = conn.execute(stmt.execution_options(yield_per=STREAM_BATCH))
+            yield from json_array(itertools.chain.from_iterable(metrics.fetched(result.partitions())), render)
+
+    return Response(generate(), mimetype="application/json")
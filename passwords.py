@@ -0,0 +1,137 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+
+PREFIX = "scrypt$"
+# stored parameters needing more memory than this are treated as corrupt rather than run
+MAX_KDF_MEMORY = 2 ** 30
+
+
+class KDFBusy(RuntimeError):
+    pass
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+
+def parse(stored):
+    """(n, r, p, salt, digest) of a scrypt$ hash, or None if it is malformed."""
+    fields = stored[len(PREFIX):].split("$")
+    if len(fields) != 5:
+        return None
+    try:
+        n, r, p = (int(field) for field in fields[:3])
+        salt, digest = (base64.b64decode(field, validate=True) for field in fields[3:])
+    except (ValueError, binascii.Error):
+        return None
+    if n < 2 or n & (n - 1) or r < 1 or p < 1 or 128 * r * n > MAX_KDF_MEMORY or not salt or not digest:
+        return None
+    return n, r, p, salt, digest
+
+
+class PasswordHasher:
+    """scrypt hashing on a bounded thread pool.
+
+    At most `workers` KDF operations run at once (each needs 128 * r * n bytes
+    of RAM) and at most `max_queue` more wait for a slot; anything beyond that
+    raises KDFBusy instead of piling up. hashlib.scrypt releases the GIL, so
+    the pool threads do not block the request threads.
+    """
+
+    def __init__(self, cost=14, r=8, p=1, workers=4, max_queue=256, timeout=10.0):
+        self.n = 2 ** cost
+        self.r = r
+        self.p = p
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kdf")
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._lock = threading.Lock()
+        self._stats = {"operations": 0, "rejected": 0, "upgraded": 0, "queue_seconds": 0.0, "kdf_seconds": 0.0}
+
+    def _derive(self, password, salt, n, r, p):
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats["rejected"] += 1
+            raise KDFBusy("Too many concurrent password operations")
+        submitted = time.perf_counter()
+        timing = {}
+
+        def job():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                timing["queue"] = started - submitted
+                timing["kdf"] = time.perf_counter() - started
+                self._slots.release()
+
+        future = self._pool.submit(job)
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            # a job still queued is dropped so it does not take a worker later;
+            # one already running cannot be interrupted and frees its slot when done
+            if future.cancel():
+                self._slots.release()
+            raise KDFBusy("Password operation timed out waiting for the KDF pool")
+        with self._lock:
+            self._stats["operations"] += 1
+            self._stats["queue_seconds"] += timing["queue"]
+            self._stats["kdf_seconds"] += timing["kdf"]
+        return result, timing
+
+    def hash(self, password):
+        """Returns (encoded_hash, timing)."""
+        salt = os.urandom(16)
+        digest, timing = self._run(self._derive, password, salt, self.n, self.r, self.p)
+        return "%s%d$%d$%d$%s$%s" % (PREFIX, self.n, self.r, self.p, _b64(salt), _b64(digest)), timing
+
+    def verify(self, stored, password):
+        """Returns (ok, timing).
+
+        Rows written before hashing was introduced hold the plaintext password;
+        those compare in constant time without touching the pool. A missing
+        (no such user) or malformed hash still runs one KDF at the current
+        cost and fails, so the response time does not tell them apart from a
+        wrong password.
+        """
+        if password is None:
+            return False, {}
+        if stored and not stored.startswith(PREFIX):
+            return hmac.compare_digest(stored.encode(), password.encode()), {}
+        fields = parse(stored) if stored else None
+        if fields is None:
+            _, timing = self._run(self._derive, password, os.urandom(16), self.n, self.r, self.p)
+            return False, timing
+        n, r, p, salt, digest = fields
+        candidate, timing = self._run(self._derive, password, salt, n, r, p)
+        return hmac.compare_digest(candidate, digest), timing
+
+    def needs_rehash(self, stored):
+        fields = parse(stored) if stored and stored.startswith(PREFIX) else None
+        return fields is None or fields[:3] != (self.n, self.r, self.p)
+
+    def record_upgrade(self):
+        with self._lock:
+            self._stats["upgraded"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+def server_timing(*timings):
+    queue = sum(t.get("queue", 0.0) for t in timings)
+    kdf = sum(t.get("kdf", 0.0) for t in timings)
+    return "kdf-queue;dur=%.1f, kdf;dur=%.1f" % (queue * 1000, kdf * 1000)
@@ -0,0 +1,219 @@
+import gzip
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, request
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single dev server process, the thread lock is enough
+    fcntl = None
+
+
+# Cache of rendered per-user read responses.
+#
+# Every cached route reads only one user's rows, so a response stays valid
+# until one of that user's writes commits. Writers bump the user's counter in
+# a VersionTable, a small file every process maps into memory, so a lookup
+# needs no database round trip and a write in one gunicorn worker invalidates
+# the copies held by all the others on the same host (but not on other hosts,
+# see RESPONSE_CACHE_SINGLE_HOST). Each process keeps its own LRU of
+# response bodies, with a strong ETag (a hash of the body) and, for larger
+# bodies, the gzip bytes compressed once. A poll whose If-None-Match matches
+# is answered 304 straight from the LRU.
+
+SLOTS = 1 << 20  # users share a counter modulo SLOTS; a collision only costs a miss
+GZIP_MIN_BYTES = 1024
+CACHE_CONTROL = "private, no-cache"  # browsers revalidate every poll with If-None-Match
+
+
+class VersionTable:
+    """Per-user write counters shared by all processes through an mmap'd file.
+
+    Slot 0 is a global counter for writes that touch many users at once
+    (purges, imports).
+    """
+
+    def __init__(self, path, slots=SLOTS):
+        self.slots = slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = (slots + 1) * 8
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)  # sparse; several processes may race here harmlessly
+        self._map = mmap.mmap(self._fd, size)
+        self._counters = memoryview(self._map).cast("Q")
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        return self._counters[0], self._counters[1 + user_id % self.slots]
+
+    def _bump(self, slots):
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                for slot in slots:
+                    self._counters[slot] += 1
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def bump(self, user_ids):
+        """Call after the users' write has committed."""
+        self._bump({1 + user_id % self.slots for user_id in user_ids})
+
+    def bump_all(self):
+        self._bump([0])
+
+
+class Entry:
+    __slots__ = ("version", "body", "gzipped", "content_type", "headers", "etag", "gzip_etag", "size")
+
+    def __init__(self, version, body, content_type, headers):
+        self.version = version
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers  # e.g. X-Next-Cursor
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzipped = gzip.compress(body, 6, mtime=0) if len(body) >= GZIP_MIN_BYTES else None
+        self.gzip_etag = '"%s-gzip"' % digest
+        self.size = len(body) + len(self.gzipped or b"") + 200
+
+
+def cache_key(path, query_string):
+    return path + "?" + query_string.decode("latin-1")
+
+
+def extra_headers(headers):
+    """The headers of a rendered response that a cached copy must repeat."""
+    return [(name, value) for name, value in headers.items() if name.lower() not in ("content-type", "content-length")]
+
+
+def _matches(if_none_match, entry):
+    if if_none_match.strip() == "*":
+        return True
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return entry.etag in tags or entry.gzip_etag in tags
+
+
+class Capture:
+    """Collects a streamed body as it is sent; finish() stores it if it fit in max_body."""
+
+    def __init__(self, cache, user_id, key, version, content_type, headers):
+        self.cache = cache
+        self.args = (user_id, key, version)
+        self.content_type = content_type
+        self.headers = headers
+        self.parts, self.size = [], 0
+
+    def add(self, chunk):
+        if self.parts is not None:
+            data = chunk.encode() if isinstance(chunk, str) else chunk
+            self.size += len(data)
+            if self.size <= self.cache.max_body:
+                self.parts.append(data)
+            else:
+                self.parts = None
+
+    def finish(self):
+        if self.parts is not None:
+            self.cache.store(*self.args, b"".join(self.parts), self.content_type, self.headers)
+
+
+class ResponseCache:
+    """Per-process LRU of response bodies, keyed by user and path with query string."""
+
+    def __init__(self, versions, max_bytes, max_body):
+        self.versions = versions
+        self.max_bytes = max_bytes
+        self.max_body = max_body
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, user_id, key):
+        """Returns (current version, entry or None); store() a miss under that version."""
+        version = self.versions.get(user_id)
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end((user_id, key))
+                return version, entry
+        metrics.RESPONSE_CACHE.inc(("miss",))
+        return version, None
+
+    def store(self, user_id, key, version, body, content_type, headers=()):
+        if len(body) > self.max_body:
+            return None
+        entry = Entry(version, body, content_type, list(headers))
+        with self._lock:
+            old = self._entries.pop((user_id, key), None)
+            if old is not None:
+                self._bytes -= old.size
+            self._entries[(user_id, key)] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+        return entry
+
+    def respond(self, entry, if_none_match, accepts_gzip, hit=True):
+        """(status, headers, body) serving `entry`; `hit` is False for one just rendered."""
+        compressed = accepts_gzip and entry.gzipped is not None
+        headers = [
+            ("ETag", entry.gzip_etag if compressed else entry.etag), ("Vary", "Accept-Encoding"),
+            ("Cache-Control", CACHE_CONTROL)
+        ]
+        not_modified = bool(if_none_match) and _matches(if_none_match, entry)
+        if hit:
+            metrics.RESPONSE_CACHE.inc(("not_modified" if not_modified else "hit",))
+        if not_modified:
+            return 304, headers, b""
+        headers += entry.headers
+        headers.append(("Content-Type", entry.content_type))
+        if compressed:
+            headers.append(("Content-Encoding", "gzip"))
+            return 200, headers, entry.gzipped
+        return 200, headers, entry.body
+
+    def capture(self, chunks, user_id, key, version, content_type, headers):
+        """Passes a streamed body through, storing it once complete."""
+        capture = Capture(self, user_id, key, version, content_type, headers)
+        for chunk in chunks:
+            capture.add(chunk)
+            yield chunk
+        capture.finish()
+
+    def view(self, view):
+        """Decorates a Flask view taking `user_id` so it is served from the cache."""
+        @wraps(view)
+        def cached(user_id):
+            key = cache_key(request.path, request.query_string)
+            version, entry = self.lookup(user_id, key)
+            accepts_gzip = request.accept_encodings["gzip"] > 0
+            if entry is None:
+                response = view(user_id)
+                if response.status_code != 200:
+                    return response
+                headers = extra_headers(response.headers)
+                if response.is_streamed:
+                    response.response = self.capture(
+                        response.response, user_id, key, version, response.content_type, headers
+                    )
+                    return response
+                entry = self.store(user_id, key, version, response.get_data(), response.content_type, headers)
+                if entry is None:
+                    return response
+                status, headers, body = self.respond(entry, request.headers.get("If-None-Match"), accepts_gzip, False)
+            else:
+                status, headers, body = self.respond(entry, request.headers.get("If-None-Match"), accepts_gzip)
+            return Response(body, status, headers)
+
+        return cached
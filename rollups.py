@@ -0,0 +1,242 @@
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, literal, select, true, union_all, update
+from sqlalchemy.exc import OperationalError
+
+from database import day, Prediction, PeriodLog, PredictionRollup, CycleLengthRollup, RollupWatermark
+from storage import dialect_insert
+
+
+# Population analytics from pre-aggregated rollups.
+#
+# compact() folds predictions and period logs into the rollup tables in
+# primary-key order and records the last folded id per rollup. Reads add up
+# the rollup rows and aggregate only the rows past that watermark, in one
+# statement (one snapshot), so answers are exact and their cost is bounded by
+# how often compact() runs rather than by the size of the tables. Writes to
+# the source tables do not touch the rollups. Guests removed by
+# purge_expired() stay counted; deleting a single period log is a correction
+# and is taken back out (on_period_deleted).
+
+# PostgreSQL: how long compact() waits for in-flight inserts before skipping a rollup
+SETTLE_TIMEOUT_MS = 2000
+
+# exclusive upper bound and label of each age band, youngest first
+AGE_BANDS = [(20, "<20"), (30, "20-29"), (40, "30-39"), (50, "40-49")]
+OLDEST_BAND = "50+"
+UNKNOWN_AGE = "unknown"  # predictions stored before their age was recorded, or with an implausible one
+BAND_ORDER = {label: i for i, label in enumerate([b for _, b in AGE_BANDS] + [OLDEST_BAND, UNKNOWN_AGE])}
+
+RISKS = ["pcos", "anemia", "breast_cancer"]
+PREDICTION_GROUPS = {"day": ("day",), "age_band": ("age_band",), "day,age_band": ("day", "age_band"), "total": ()}
+
+
+class AnalyticsError(ValueError):
+    pass
+
+
+def age_band(column):
+    return case(
+        (column.is_(None), UNKNOWN_AGE), *[(column < bound, label) for bound, label in AGE_BANDS], else_=OLDEST_BAND
+    )
+
+
+def _prediction_counts(where):
+    return select(
+        day(Prediction.created_at).label("day"), age_band(Prediction.age).label("age_band"),
+        func.count().label("predictions"),
+        *[func.sum(getattr(Prediction, name + "_risk")).label(name + "_positive") for name in RISKS]
+    ).where(where).group_by("day", "age_band")
+
+
+def _cycle_counts(where):
+    # back-dated logs are stored with a negative cycle_length; they are not cycles
+    return select(PeriodLog.cycle_length, func.count().label("periods")).where(
+        PeriodLog.cycle_length > 0, where
+    ).group_by(PeriodLog.cycle_length)
+
+
+# rollup name -> (source table, rollup table, rollup key columns, aggregate over source rows)
+ROLLUPS = {
+    "predictions": (Prediction.__table__, PredictionRollup.__table__, ("day", "age_band"), _prediction_counts),
+    "cycle_lengths": (PeriodLog.__table__, CycleLengthRollup.__table__, ("cycle_length",), _cycle_counts),
+}
+
+
+def _lock_watermark(conn, name):
+    """The rollup's watermark, locked until the caller's transaction ends.
+
+    The no-op UPDATE takes SQLite's write lock or PostgreSQL's row lock, so a
+    compaction and a delete that adjusts the same rollup cannot interleave.
+    """
+    table = RollupWatermark.__table__
+    conn.execute(dialect_insert(conn)(table).values(name=name, last_id=0).on_conflict_do_nothing())
+    return conn.execute(
+        update(table).where(table.c.name == name).values(last_id=table.c.last_id).returning(table.c.last_id)
+    ).scalar_one()
+
+
+def _fold(conn, rollup, keys, rows):
+    stmt = dialect_insert(conn)(rollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={c.name: c + stmt.excluded[c.name] for c in rollup.columns if c.name not in keys}
+    )
+    conn.execute(stmt, [dict(row._mapping) for row in rows])
+
+
+def _settled_max_id(engine, source):
+    """The highest source id at or below which no insert is still in flight.
+
+    PostgreSQL hands out ids when a row is inserted, but transactions commit
+    in any order: max(id) can be visible while a lower id is uncommitted, and
+    folding past it would leave that row out of the rollup and (being below
+    the watermark) out of every read. A SHARE lock waits for the table's
+    in-flight inserts and holds off new ones until max() returns. SQLite has
+    a single writer, so its ids commit in order. None if the table is empty
+    or the lock timed out.
+    """
+    try:
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                conn.exec_driver_sql("SET LOCAL lock_timeout = %d" % SETTLE_TIMEOUT_MS)
+                conn.exec_driver_sql("LOCK TABLE %s IN SHARE MODE" % source.name)
+            return conn.scalar(select(func.max(source.c.id)))
+    except OperationalError:
+        if engine.dialect.name != "postgresql":
+            raise
+        return None  # a long write transaction; its rows stay in the tail until the next run
+
+
+def compact(engine, batch_size=50000):
+    """Folds source rows added since the last run into the rollups.
+
+    Folds up to the id it finds settled when it starts, `batch_size` ids per
+    transaction, so the write lock is only held briefly. Safe to run from
+    several processes at once. Returns the number of rows folded per rollup.
+    """
+    watermarks = RollupWatermark.__table__
+    folded = {}
+    for name, (source, rollup, keys, aggregate) in ROLLUPS.items():
+        folded[name] = 0
+        newest = _settled_max_id(engine, source)
+        while newest is not None:
+            with engine.begin() as conn:
+                last = _lock_watermark(conn, name)
+                if newest <= last:
+                    break
+                upper = min(newest, last + batch_size)
+                rows = conn.execute(aggregate(and_(source.c.id > last, source.c.id <= upper))).all()
+                if rows:
+                    _fold(conn, rollup, keys, rows)
+                conn.execute(update(watermarks).where(watermarks.c.name == name).values(
+                    last_id=upper, updated_at=datetime.utcnow()
+                ))
+                folded[name] += sum(row[len(keys)] for row in rows)
+            if upper == newest:
+                break
+    return folded
+
+
+def on_period_deleted(period_log, session):
+    """Takes a deleted log back out of the cycle-length rollup, within the caller's transaction."""
+    if not period_log.cycle_length or period_log.cycle_length <= 0:
+        return
+    session.flush()  # the DELETE first, so the watermark lock is taken after the row is gone
+    conn = session.connection()
+    if period_log.id <= _lock_watermark(conn, "cycle_lengths"):
+        table = CycleLengthRollup.__table__
+        conn.execute(update(table).where(table.c.cycle_length == period_log.cycle_length).values(
+            periods=table.c.periods - 1
+        ))
+
+
+def _with_tail(name, rollup_filter, tail_filter):
+    """Rollup rows plus the aggregated unfolded rows, tagged 0 and 1, as one statement."""
+    source, rollup, keys, aggregate = ROLLUPS[name]
+    watermarks = RollupWatermark.__table__
+    last = func.coalesce(select(watermarks.c.last_id).where(watermarks.c.name == name).scalar_subquery(), 0)
+    return union_all(
+        select(literal(0).label("tail"), *rollup.columns).where(rollup_filter),
+        select(literal(1).label("tail"), *aggregate(and_(source.c.id > last, tail_filter)).subquery().columns)
+    )
+
+
+def parse_day(value, name):
+    if value in (None, ""):
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise AnalyticsError("%s must be a date (YYYY-MM-DD)" % name)
+
+
+def _rates(counts):
+    result = dict(counts)
+    for name in RISKS:
+        result[name + "_rate"] = round(counts[name + "_positive"] / counts["predictions"], 4) if counts["predictions"] else None
+    return result
+
+
+def prediction_rates(session, args):
+    """Positive rates per risk by day and/or age band (?group=, ?from=, ?to=)."""
+    group = args.get("group", "day,age_band")
+    if group not in PREDICTION_GROUPS:
+        raise AnalyticsError("group must be one of " + ", ".join(PREDICTION_GROUPS))
+    start, end = parse_day(args.get("from"), "from"), parse_day(args.get("to"), "to")
+    rollup_filter, tail_filter = [true()], [true()]
+    if start:
+        rollup_filter.append(PredictionRollup.day >= start)
+        tail_filter.append(Prediction.created_at >= datetime.combine(start, datetime.min.time()))
+    if end:
+        rollup_filter.append(PredictionRollup.day <= end)
+        tail_filter.append(day(Prediction.created_at) <= end)
+    keys = PREDICTION_GROUPS[group]
+    counters = ["predictions"] + [name + "_positive" for name in RISKS]
+    groups = {}
+    total = dict.fromkeys(counters, 0)
+    unfolded = 0
+    for row in session.execute(_with_tail("predictions", and_(*rollup_filter), and_(*tail_filter))):
+        key = tuple(getattr(row, k) for k in keys)
+        counts = groups.setdefault(key, dict.fromkeys(counters, 0))
+        for c in counters:
+            value = getattr(row, c) or 0
+            counts[c] += value
+            total[c] += value
+        if row.tail:
+            unfolded += row.predictions
+    rows = []
+    for key in sorted(groups, key=lambda k: tuple(BAND_ORDER[v] if isinstance(v, str) else v for v in k)):
+        labels = {k: v.isoformat() if k == "day" else v for k, v in zip(keys, key)}
+        rows.append(dict(labels, **_rates(groups[key])))
+    return {"group": group, "rows": rows, "total": _rates(total), "unfolded_rows": unfolded}
+
+
+def _percentile(histogram, total, q):
+    seen = 0
+    for length, count in histogram:
+        seen += count
+        if seen >= q * total:
+            return length
+    return None
+
+
+def cycle_length_distribution(session):
+    """Histogram of all stored cycle lengths, with mean and percentiles."""
+    counts = {}
+    unfolded = 0
+    for row in session.execute(_with_tail("cycle_lengths", true(), true())):
+        counts[row.cycle_length] = counts.get(row.cycle_length, 0) + row.periods
+        if row.tail:
+            unfolded += row.periods
+    histogram = sorted((length, count) for length, count in counts.items() if count > 0)
+    total = sum(count for _, count in histogram)
+    return {
+        "histogram": [{"cycle_length": length, "periods": count} for length, count in histogram],
+        "periods": total,
+        "mean": round(sum(length * count for length, count in histogram) / total, 2) if total else None,
+        "p10": _percentile(histogram, total, 0.1),
+        "median": _percentile(histogram, total, 0.5),
+        "p90": _percentile(histogram, total, 0.9),
+        "unfolded_rows": unfolded
+    }
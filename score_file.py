@@ -0,0 +1,234 @@
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from inference import RiskPolicy, TARGETS
+from model_registry import ModelRegistry, MODEL_DIR
+from settings import Settings
+from utils.feature_engineering import SCHEMA
+
+_engine = None
+_policy = None
+
+
+def _init_worker(model_dir, risk_config=Settings.RISK_CONFIG):
+    global _engine, _policy
+    _engine = ModelRegistry(model_dir).engine()
+    # the same calibration and thresholds as /predict
+    _policy = RiskPolicy.from_file(risk_config)
+
+
+def parse_frame(frame):
+    """Returns (X, ok, problems) for a chunk read as text.
+
+    Features go through SCHEMA.prepare like /predict/batch, so acne severity
+    may be a label and BMI may be left for height/weight; rows that still
+    have a gap are flagged in `ok` and described in `problems` instead of
+    being scored.
+    """
+    X, problems = SCHEMA.prepare({name: frame[name].to_numpy() for name in frame.columns})
+    ok = np.ones(len(frame), dtype=bool)
+    ok[list(problems)] = False
+    return X, ok, problems
+
+
+def score_frame(X):
+    labels, probas = _engine.score(X, _policy)
+    columns = {}
+    for i, name in enumerate(TARGETS):
+        columns["pred_" + name] = labels[:, i]
+        columns["prob_" + name] = probas[:, i]
+    return pd.DataFrame(columns)
+
+
+def score_block(block, fmt, first_line=2):
+    """Returns (rows scored, output columns, payload, errors) for one block.
+
+    errors lists (line number, message) for the rows left out of the payload;
+    first_line is the file line number of the block's first data line.
+    """
+    # parsing, scoring and encoding all happen in the worker; the parent only moves bytes
+    lines = block.split(b"\n")
+    header = lines[0].rstrip(b"\r").decode().split(",")
+    # columns other than the features are passed through as their input text,
+    # so a blank in one chunk cannot change a column's type between chunks
+    text = {name: str for name in header if name not in SCHEMA.features}
+    frame = pd.read_csv(io.BytesIO(block), keep_default_na=False, dtype=text)
+    X, ok, problems = parse_frame(frame)
+    numbers = [first_line + i for i, line in enumerate(lines[1:]) if line.strip()]
+    errors = [(numbers[row], message) for row, message in sorted(problems.items())]
+    scores = score_frame(X[ok])
+    if fmt == "csv":
+        # input lines are passed through untouched, only the score columns are formatted
+        kept = [line for line in lines[1:] if line.strip()]
+        if problems:
+            kept = [line for line, keep in zip(kept, ok.tolist()) if keep]
+        suffix = scores.to_csv(index=False, header=False, float_format="%.6g").encode().split(b"\n")
+        body = b"".join(line.rstrip(b"\r") + b"," + extra + b"\n" for line, extra in zip(kept, suffix))
+        return len(scores), header + list(scores.columns), body, errors
+    frame = frame[ok].reset_index(drop=True)
+    for i, name in enumerate(SCHEMA.features):
+        frame[name] = X[ok, i]  # parsed values, so every chunk has the same float64 schema
+    return len(scores), list(frame.columns) + list(scores.columns), pd.concat([frame, scores], axis=1), errors
+
+
+def read_blocks(path, chunksize):
+    """Yields (first line number, header plus up to chunksize raw lines).
+
+    Splitting on line boundaries is enough for the numeric screening schema,
+    which has no quoted fields.
+    """
+    with open(path, "rb") as f:
+        header = f.readline()
+        first_line = 2
+        while True:
+            lines = list(islice(f, chunksize))
+            if not lines:
+                break
+            yield first_line, header + b"".join(lines)
+            first_line += len(lines)
+
+
+class CsvSink:
+    def __init__(self, path):
+        self.f = open(path, "wb")
+        self.header = True
+
+    def write(self, columns, body):
+        if self.header:
+            self.f.write((",".join(columns) + "\n").encode())
+            self.header = False
+        self.f.write(body)
+
+    def close(self):
+        self.f.close()
+
+
+class ErrorSink:
+    """Writes rejected rows as line,message to a CSV created on the first reject."""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        self.count = 0
+
+    def write(self, errors):
+        if errors and self.f is None:
+            self.f = open(self.path, "w", newline="")
+            self.writer = csv.writer(self.f)
+            self.writer.writerow(["line", "message"])
+        if errors:
+            self.writer.writerows(errors)
+            self.count += len(errors)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+class ParquetSink:
+    def __init__(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output requires pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.writer = None
+
+    def write(self, columns, chunk):
+        if self.writer is None:
+            table = self.pa.Table.from_pandas(chunk, preserve_index=False)
+            self.writer = self.pq.ParquetWriter(self.path, table.schema)
+        else:
+            # every chunk is written with the first chunk's schema
+            table = self.pa.Table.from_pandas(chunk, schema=self.writer.schema, preserve_index=False)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def errors_path(output_path):
+    return os.path.splitext(output_path)[0] + ".errors.csv"
+
+
+def score_file(input_path, output_path, chunksize=100000, workers=1, fmt=None, model_dir=MODEL_DIR,
+               errors_output=None, risk_config=Settings.RISK_CONFIG):
+    """Streams input_path through the models chunk by chunk.
+
+    At most 2 * workers chunks are in flight at any time and results are
+    written in input order, so memory stays flat regardless of file size.
+    Rows with a missing or unparseable feature are not scored; they are
+    listed in errors_output (default: <output>.errors.csv). Returns
+    (rows scored, rows rejected).
+    """
+    fmt = fmt or ("parquet" if output_path.endswith((".parquet", ".pq")) else "csv")
+    sink = ParquetSink(output_path) if fmt == "parquet" else CsvSink(output_path)
+    rejects = ErrorSink(errors_output or errors_path(output_path))
+    rows = 0
+
+    def write(n, columns, payload, errors):
+        nonlocal rows
+        sink.write(columns, payload)
+        rejects.write(errors)
+        rows += n
+
+    try:
+        if workers <= 1:
+            _init_worker(model_dir, risk_config)
+            for first_line, block in read_blocks(input_path, chunksize):
+                write(*score_block(block, fmt, first_line))
+        else:
+            with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(model_dir, risk_config)) as pool:
+                pending = deque()
+                for first_line, block in read_blocks(input_path, chunksize):
+                    pending.append(pool.submit(score_block, block, fmt, first_line))
+                    if len(pending) >= 2 * workers:
+                        write(*pending.popleft().result())
+                while pending:
+                    write(*pending.popleft().result())
+    finally:
+        sink.close()
+        rejects.close()
+    return rows, rejects.count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a screening CSV with the SheCare risk models")
+    parser.add_argument("input", help="CSV file in the shecare_dataset_large.csv layout")
+    parser.add_argument("output", help="destination .csv or .parquet file")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows per chunk")
+    parser.add_argument("--workers", type=int, default=1, help="scoring processes")
+    parser.add_argument("--format", choices=["csv", "parquet"], help="output format (default: from extension)")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="model registry directory")
+    parser.add_argument("--errors", help="CSV listing rejected rows (default: <output>.errors.csv)")
+    parser.add_argument("--risk-config", default=Settings.RISK_CONFIG, help="thresholds and calibration overrides")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    errors_output = args.errors or errors_path(args.output)
+    rows, rejected = score_file(
+        args.input, args.output, args.chunksize, max(1, args.workers), args.format, args.model_dir, errors_output,
+        args.risk_config
+    )
+    elapsed = time.perf_counter() - start
+    print("Scored %d rows in %.2fs (%.0f rows/s) -> %s" % (rows, elapsed, rows / elapsed if elapsed else 0, args.output))
+    if rejected:
+        print("Rejected %d rows with missing or invalid features -> %s" % (rejected, errors_output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import os
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _env(name, default, cast=str):
+    value = os.environ.get("SHECARE_" + name)
+    return default if value is None else cast(value)
+
+
+class Settings:
+    """Flask configuration, overridable through SHECARE_<NAME> environment variables."""
+
+    SQLALCHEMY_DATABASE_URI = _env("DATABASE_URI", "sqlite:///shecare.db")
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # signs guest tokens; generated into instance/secret_key when unset
+    SECRET_KEY = _env("SECRET_KEY", None)
+    # guest tokens expire, and guests are purged, this long after their last request (`flask purge-anonymous`)
+    ANONYMOUS_TTL_DAYS = _env("ANONYMOUS_TTL_DAYS", 30, int)
+
+    DB_POOL_SIZE = _env("DB_POOL_SIZE", 5, int)
+    DB_MAX_OVERFLOW = _env("DB_MAX_OVERFLOW", 10, int)
+    DB_POOL_TIMEOUT = _env("DB_POOL_TIMEOUT", 30, int)
+    # PostgreSQL only; 0 disables it
+    DB_STATEMENT_TIMEOUT_MS = _env("DB_STATEMENT_TIMEOUT_MS", 30000, int)
+    SQLITE_BUSY_TIMEOUT_MS = _env("SQLITE_BUSY_TIMEOUT_MS", 5000, int)
+    # 0 disables group commit; otherwise predictions are inserted by a
+    # background writer that batches rows arriving within this window
+    GROUP_COMMIT_MS = _env("GROUP_COMMIT_MS", 0, float)
+    # seconds a request waits for the writer before it is answered 503
+    GROUP_COMMIT_TIMEOUT = _env("GROUP_COMMIT_TIMEOUT", 10, float)
+
+    KDF_COST = _env("KDF_COST", 14, int)
+    KDF_WORKERS = _env("KDF_WORKERS", 4, int)
+    KDF_MAX_QUEUE = _env("KDF_MAX_QUEUE", 256, int)
+
+    # analytics reads fold the rollups when more source rows than this are unfolded
+    ROLLUP_TAIL_LIMIT = _env("ROLLUP_TAIL_LIMIT", 10000, int)
+
+    # per-process cache of the polled per-user reads; 0 disables it
+    RESPONSE_CACHE_MB = _env("RESPONSE_CACHE_MB", 64, int)
+    RESPONSE_CACHE_MAX_BODY_KB = _env("RESPONSE_CACHE_MAX_BODY_KB", 1024, int)
+    # per-user write counters shared by every process on the host
+    RESPONSE_CACHE_VERSIONS = _env("RESPONSE_CACHE_VERSIONS", os.path.join(BASE_DIR, "instance", "response-versions"))
+    # writes on another host never reach this host's counters, so the cache is
+    # only on by default with SQLite; set 1 if every app process shares one host
+    RESPONSE_CACHE_SINGLE_HOST = _env("RESPONSE_CACHE_SINGLE_HOST", None, int)
+
+    RISK_CONFIG = _env("RISK_CONFIG", os.path.join(BASE_DIR, "config", "risk.json"))
+
+    # the instrumentation costs about 2% of a cheap request's time (benchmarks/bench_metrics.py), so it is opt-in
+    METRICS_ENABLED = _env("METRICS_ENABLED", 0, int)
+    # requests slower than this get their sampled stacks written to PROFILE_DIR; 0 disables the profiler
+    PROFILE_SLOW_MS = _env("PROFILE_SLOW_MS", 0, float)
+    PROFILE_INTERVAL_MS = _env("PROFILE_INTERVAL_MS", 5, float)
+    PROFILE_DIR = _env("PROFILE_DIR", os.path.join(BASE_DIR, "instance", "profiles"))
@@ -0,0 +1,173 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError
+
+from sqlalchemy import event, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+
+def engine_options(uri, config):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri` from the DB_* settings.
+
+    In-memory SQLite keeps SQLAlchemy's single-connection pool; file databases
+    and servers get a bounded QueuePool. PostgreSQL connections also get the
+    statement timeout.
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    options = {
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"]
+    }
+    if backend == "postgresql":
+        options.update(pool_pre_ping=True, pool_recycle=1800)
+        timeout = config["DB_STATEMENT_TIMEOUT_MS"]
+        if timeout:
+            options["connect_args"] = {"options": "-c statement_timeout=%d" % timeout}
+    return options
+
+
+def configure_sqlite(engine, busy_timeout_ms=5000):
+    """Sets the per-connection pragmas on every new SQLite connection.
+
+    WAL lets readers run alongside the single writer (and across gunicorn
+    workers), synchronous=NORMAL only fsyncs at checkpoints instead of on
+    every commit, and busy_timeout makes a writer wait for the lock rather
+    than fail with "database is locked".
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=%d" % busy_timeout_ms)
+        cursor.close()
+
+
+def dialect_insert(bind):
+    """insert() of `bind`'s dialect, which has on_conflict_do_nothing/do_update (SQLite and PostgreSQL)."""
+    return postgresql.insert if bind.dialect.name == "postgresql" else sqlite.insert
+
+
+class CommitTimeout(RuntimeError):
+    pass
+
+
+class GroupCommitter:
+    """Coalesces small inserts from concurrent requests into one transaction.
+
+    submit() queues a row and returns a Future for its generated id. A
+    background thread collects rows for up to `window` seconds after the
+    first one (or `max_batch` rows) and writes them in one transaction with
+    one executemany per table, so concurrent requests share a single commit.
+    A failing batch is retried row by row so one bad row only fails its own
+    caller.
+
+    The thread is started by the first submit in each process, so workers
+    forked from a preloaded app (gunicorn --preload) get their own. A row
+    the writer has not picked up within `timeout` seconds is withdrawn and
+    its caller gets CommitTimeout.
+    """
+
+    def __init__(self, engine, window=0.002, max_batch=500, timeout=10.0):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "rows": 0, "max_batch_rows": 0, "errors": 0, "timeouts": 0}
+
+    def _started(self):
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._start_lock:
+                if self._pid != pid:
+                    # a forked child inherits the parent's queue but not its thread
+                    self._queue = queue.SimpleQueue()
+                    threading.Thread(target=self._run, args=(self._queue,), name="group-commit", daemon=True).start()
+                    self._pid = pid
+        return self._queue
+
+    def submit(self, table, values):
+        future = Future()
+        self._started().put((table, values, future))
+        return future
+
+    def withdraw(self, future):
+        """Call when a caller gives up on `future`: raises CommitTimeout unless its batch is already being written."""
+        if future.cancel():
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise CommitTimeout("Group commit queue did not drain within %gs" % self.timeout)
+
+    def insert(self, table, values, timeout=None):
+        """Blocks until the row is committed and returns its id."""
+        future = self.submit(table, values)
+        try:
+            return future.result(self.timeout if timeout is None else timeout)
+        except TimeoutError:
+            self.withdraw(future)
+        # already in a transaction, which the database's own timeouts bound
+        return future.result()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_batch_rows"] = round(stats["rows"] / stats["batches"], 2) if stats["batches"] else None
+        return stats
+
+    def _run(self, rows):
+        while True:
+            items = [rows.get()]
+            deadline = time.monotonic() + self.window
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(rows.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # rows whose caller timed out and withdrew them are dropped
+            items = [item for item in items if item[2].set_running_or_notify_cancel()]
+            if items:
+                self._write(items)
+
+    def _write(self, items):
+        groups = {}
+        for table, values, future in items:
+            groups.setdefault(table, []).append((values, future))
+        try:
+            with self.engine.begin() as conn:
+                ids = []
+                for table, entries in groups.items():
+                    stmt = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+                    ids.append(conn.execute(stmt, [values for values, _ in entries]).scalars().all())
+        except Exception as e:
+            if len(items) > 1:
+                for item in items:
+                    self._write([item])
+                return
+            with self._lock:
+                self._stats["errors"] += 1
+            items[0][2].set_exception(e)
+            return
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["rows"] += len(items)
+            self._stats["max_batch_rows"] = max(self._stats["max_batch_rows"], len(items))
+        for entries, new_ids in zip(groups.values(), ids):
+            for (_, future), new_id in zip(entries, new_ids):
+                future.set_result(new_id)
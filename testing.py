@@ -0,0 +1,80 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+
+BACKENDS = ("auto", "postgres", "sqlite")
+
+
+def postgres_available():
+    if not (shutil.which("initdb") and shutil.which("pg_ctl")):
+        return False
+    try:
+        import psycopg2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def temporary_postgres(directory=None):
+    """Starts a private PostgreSQL cluster in a temp dir and yields its URL.
+
+    The server listens on a unix socket inside the temp dir only, runs with
+    fsync off and is removed on exit.
+    """
+    root = tempfile.mkdtemp(prefix="shecare-pg-", dir=directory)
+    data = os.path.join(root, "data")
+    port = _free_port()
+    try:
+        subprocess.run(
+            ["initdb", "-D", data, "-U", "postgres", "-A", "trust", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        subprocess.run(
+            ["pg_ctl", "-D", data, "-l", os.path.join(root, "server.log"), "-w", "start",
+             "-o", "-p %d -k %s -c listen_addresses='' -c fsync=off" % (port, root)],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        try:
+            yield "postgresql+psycopg2://postgres@/postgres?host=%s&port=%d" % (root, port)
+        finally:
+            subprocess.run(["pg_ctl", "-D", data, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+@contextmanager
+def temporary_sqlite(directory=None):
+    root = tempfile.mkdtemp(prefix="shecare-", dir=directory)
+    try:
+        yield "sqlite:///" + os.path.join(root, "shecare.db")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+@contextmanager
+def temporary_database(backend="auto", directory=None):
+    """Yields the URL of a throwaway, empty database.
+
+    "auto" uses a local temporary PostgreSQL when initdb/pg_ctl and psycopg2
+    are installed and falls back to a SQLite file otherwise. Point
+    SHECARE_DATABASE_URI at it before importing app, then run upgrade().
+    """
+    if backend not in BACKENDS:
+        raise ValueError("backend must be one of " + ", ".join(BACKENDS))
+    if backend == "postgres" or (backend == "auto" and postgres_available()):
+        with temporary_postgres(directory) as url:
+            yield url
+    else:
+        with temporary_sqlite(directory) as url:
+            yield url
@@ -0,0 +1,57 @@
+"""Fixtures for the test suite.
+
+app.py binds its engine to SHECARE_DATABASE_URI when it is imported, so the
+whole session shares one throwaway database from testing.temporary_database:
+a private PostgreSQL cluster when initdb/pg_ctl and psycopg2 are installed,
+a SQLite file otherwise. SHECARE_TEST_BACKEND=sqlite or =postgres picks one.
+Tests must get the app through the `app` fixture rather than importing it.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from testing import temporary_database  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def database_url():
+    with temporary_database(os.environ.get("SHECARE_TEST_BACKEND", "auto")) as url:
+        yield url
+
+
+@pytest.fixture(scope="session")
+def app(database_url, tmp_path_factory):
+    scratch = tmp_path_factory.mktemp("instance")
+    os.environ.update({
+        "SHECARE_DATABASE_URI": database_url,
+        "SHECARE_SECRET_KEY": "test",
+        "SHECARE_RESPONSE_CACHE_VERSIONS": str(scratch / "response-versions"),
+        # the cheapest scrypt cost; the tests exercise the flow, not the KDF
+        "SHECARE_KDF_COST": "4",
+        "SHECARE_METRICS_ENABLED": "1",
+    })
+    from app import app
+    from migrations import upgrade
+
+    with app.app_context():
+        upgrade()
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def user_id(client):
+    """A newly registered user."""
+    email = "%s@example.com" % uuid.uuid4().hex
+    response = client.post("/register", json={"name": "Test", "email": email, "password": "secret"})
+    assert response.status_code == 200
+    return response.json["user_id"]
@@ -0,0 +1,52 @@
+"""Password hashing: stored-hash parsing, timing of failed logins and KDF pool timeouts."""
+import time
+
+import pytest
+
+from passwords import KDFBusy, PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    return PasswordHasher(cost=4)
+
+
+def test_hash_and_verify(hasher):
+    stored, _ = hasher.hash("pw")
+    assert hasher.verify(stored, "pw")[0]
+    assert not hasher.verify(stored, "other")[0]
+    assert not hasher.needs_rehash(stored)
+    assert hasher.verify("pw", "pw")[0]  # a plaintext row from before hashing
+    assert hasher.needs_rehash("pw")
+
+
+@pytest.mark.parametrize("stored", [
+    "scrypt$", "scrypt$16$8$1$AA==", "scrypt$x$8$1$AA==$AA==", "scrypt$15$8$1$AA==$AA==",
+    "scrypt$16$8$1$!!$AA==", "scrypt$1099511627776$8$1$AA==$AA==", "scrypt$16$8$1$AA==$AA==$AA==",
+])
+def test_malformed_hash_fails(hasher, stored):
+    ok, timing = hasher.verify(stored, "pw")
+    assert not ok
+    assert "kdf" in timing  # the same work as a wrong password
+    assert hasher.needs_rehash(stored)
+
+
+def test_unknown_user_costs_a_kdf(hasher):
+    ok, timing = hasher.verify(None, "pw")
+    assert not ok
+    assert "kdf" in timing
+
+
+def test_timed_out_job_is_cancelled():
+    hasher = PasswordHasher(workers=1, max_queue=1, timeout=0.05)
+    ran = []
+    with pytest.raises(KDFBusy):
+        hasher._run(time.sleep, 0.3)
+    with pytest.raises(KDFBusy):
+        hasher._run(ran.append, "queued")
+    time.sleep(0.5)
+    assert ran == []
+    # both slots are free again: the running job released its own, the cancelled one was released for it
+    for _ in range(2):
+        hasher._run(ran.append, "later")
+    assert ran == ["later", "later"]
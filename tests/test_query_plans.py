@@ -0,0 +1,45 @@
+"""The per-user reads must be served from an index (migrations.check_query_plans).
+
+The check reads SQLite query plans, so it runs in a child process on its own
+temporary SQLite database, whichever backend the rest of the suite uses.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from testing import temporary_sqlite
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHECK = """
+import json, sys
+from app import app, db
+from migrations import check_query_plans, upgrade
+with app.app_context():
+    upgrade()
+    for index in sys.argv[1:]:
+        db.session.execute(db.text("DROP INDEX " + index))
+    db.session.commit()
+    print(json.dumps(check_query_plans(app.test_client())))
+"""
+
+
+def query_plan_problems(scratch, *dropped_indexes):
+    with temporary_sqlite(scratch) as url:
+        # no response cache, so every endpoint reaches the database
+        env = dict(os.environ, SHECARE_DATABASE_URI=url, SHECARE_SECRET_KEY="test", SHECARE_RESPONSE_CACHE_MB="0",
+                   SHECARE_RESPONSE_CACHE_VERSIONS=os.path.join(scratch, "response-versions"))
+        result = subprocess.run([sys.executable, "-c", CHECK, *dropped_indexes], cwd=ROOT, env=env,
+                                capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def test_per_user_reads_use_indexes(tmp_path):
+    problems = query_plan_problems(str(tmp_path))
+    assert problems == [], "\n".join("FULL SCAN: %s\n    %s" % (s, "\n    ".join(p)) for s, p in problems)
+
+
+def test_check_reports_a_full_scan(tmp_path):
+    problems = query_plan_problems(str(tmp_path), "ix_period_logs_user_start")
+    assert any("period_logs" in statement for statement, _ in problems)
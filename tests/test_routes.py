@@ -0,0 +1,163 @@
+"""Smoke tests for the main routes, run against the temporary database."""
+import uuid
+from datetime import timedelta
+
+import pytest
+
+FEATURES = {"age": 28, "BMI": 23.5, "cycle_variation": 3, "acne_severity": 1, "hair_growth": 0,
+            "fatigue": 1, "hemoglobin": 12.5, "breast_lump": 0, "breast_pain": 0}
+RISKS = ["pcos_risk", "anemia_risk", "breast_cancer_risk"]
+STARTS = ["2025-01-01", "2025-01-29", "2025-02-27", "2025-03-27", "2025-04-25"]
+
+
+def log_periods(client, user_id, starts=STARTS):
+    for start in starts:
+        response = client.post("/period/log", json={"user_id": user_id, "start_date": start,
+                                                    "end_date": start[:-2] + "05", "symptoms": ["cramps"]})
+        assert response.status_code == 200
+
+
+def test_register_and_login(client):
+    email = "%s@example.com" % uuid.uuid4().hex
+    user_id = client.post("/register", json={"name": "A", "email": email, "password": "pw"}).json["user_id"]
+    response = client.post("/login", json={"email": email, "password": "pw"})
+    assert response.status_code == 200
+    assert response.json["user_id"] == user_id
+    assert client.post("/login", json={"email": email, "password": "wrong"}).status_code == 401
+    assert client.post("/login", json={"email": "nobody@example.com", "password": "pw"}).status_code == 401
+
+
+def test_register_rejects_bad_bodies(client):
+    assert client.post("/register", json=["not", "an", "object"]).status_code == 400
+    assert client.post("/register", json={"name": "A", "email": "a@example.com", "password": 5}).status_code == 400
+    assert client.post("/login", json={"email": "a@example.com"}).status_code == 400
+
+
+def test_predict(client, user_id):
+    response = client.post("/predict", json=dict(FEATURES, user_id=user_id))
+    assert response.status_code == 200
+    for risk in RISKS:
+        assert response.json[risk] in (0, 1)
+        assert 0 <= response.json[risk.replace("risk", "probability")] <= 1
+    assert client.post("/predict", json=dict(FEATURES, user_id=-1)).status_code == 400
+    assert client.post("/predict", json=dict(FEATURES, user_id=user_id, age="old")).status_code == 400
+    assert client.post("/predict", json=dict(FEATURES, user_id=user_id, age=[30])).status_code == 400
+    # an implausible age is still scored, and stored as unknown
+    assert client.post("/predict", json=dict(FEATURES, user_id=user_id, age=1e20)).status_code == 200
+
+
+def test_predict_derives_cycle_variation(client, user_id):
+    features = {k: v for k, v in FEATURES.items() if k != "cycle_variation"}
+    assert client.post("/predict", json=dict(features, user_id=user_id)).status_code == 400
+    log_periods(client, user_id)
+    assert client.post("/predict", json=dict(features, user_id=user_id)).status_code == 200
+    response = client.post("/predict/batch", json=[dict(features, user_id=user_id)])
+    assert response.json["count"] == 1
+
+
+def test_predict_batch(client, user_id):
+    records = [dict(FEATURES, user_id=user_id), dict(FEATURES, user_id=user_id, age="x"),
+               dict(FEATURES, user_id=user_id, age=[1, 2]), dict(FEATURES, user_id=True), "row"]
+    response = client.post("/predict/batch", json=records)
+    assert response.status_code == 200
+    assert response.json["count"] == 1
+    assert [e["row"] for e in response.json["errors"]] == [1, 2, 3, 4]
+    csv = "age,BMI,cycle_variation,acne_severity,hair_growth,fatigue,hemoglobin,breast_lump,breast_pain\n" \
+          "30,22,4,mild,0,1,11,0,0\n"
+    response = client.post("/predict/batch?user_id=%d" % user_id, data=csv, content_type="text/csv")
+    assert response.json["count"] == 1
+
+
+def test_history_pages(client, user_id):
+    for age in range(20, 27):
+        client.post("/predict", json=dict(FEATURES, user_id=user_id, age=age))
+    first = client.get("/history/%d?limit=5" % user_id)
+    assert first.status_code == 200
+    assert len(first.json) == 5
+    cursor = first.headers["X-Next-Cursor"]
+    rest = client.get("/history/%d?limit=5&cursor=%s" % (user_id, cursor)).json
+    assert len(rest) == 2
+    assert not {row["id"] for row in first.json} & {row["id"] for row in rest}
+    fields = client.get("/history/%d?fields=id,pcos_probability" % user_id).json
+    assert set(fields[0]) == {"id", "pcos_probability"}
+    assert client.get("/history/%d?sort=bad" % user_id).status_code == 400
+
+
+def test_period_routes(client, user_id):
+    log_periods(client, user_id)
+    history = client.get("/period/history/%d" % user_id).json
+    assert len(history) == len(STARTS)
+    assert history[0]["symptoms"] == ["cramps"]
+    stats = client.get("/period/stats/%d" % user_id).json
+    assert stats["total_periods_logged"] == len(STARTS)
+    assert stats["last_period"] == STARTS[-1]
+    predictions = client.get("/period/predictions/%d" % user_id).json
+    assert predictions["predictions"]
+    assert client.get("/period/current-phase/%d" % user_id).status_code == 200
+    period_id = history[0]["id"]
+    assert client.put("/period/update/%d" % period_id, json={"notes": "n"}).status_code == 200
+    assert client.delete("/period/delete/%d" % period_id).status_code == 200
+    assert client.get("/period/stats/%d" % user_id).json["total_periods_logged"] == len(STARTS) - 1
+
+
+def test_cached_reads_revalidate(app, client, user_id):
+    log_periods(client, user_id, STARTS[:2])
+    first = client.get("/period/stats/%d" % user_id)
+    etag = first.headers.get("ETag")
+    if etag is None:
+        return  # the response cache is off for this backend
+    assert client.get("/period/stats/%d" % user_id, headers={"If-None-Match": etag}).status_code == 304
+    log_periods(client, user_id, STARTS[2:3])
+    after = client.get("/period/stats/%d" % user_id, headers={"If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.json["total_periods_logged"] == 3
+
+
+def test_guest_writes(client):
+    token = client.post("/anonymous-login").json["token"]
+    response = client.post("/period/log", json={"anonymous_token": token, "start_date": "2025-01-01"})
+    assert response.status_code == 200
+    user_id = response.json["user_id"]
+    response = client.post("/predict", json=dict(FEATURES, anonymous_token=token))
+    assert response.json["user_id"] == user_id
+    assert client.post("/predict", json=dict(FEATURES, anonymous_token="forged")).status_code in (400, 401)
+
+
+def test_guest_expiry_follows_activity(app):
+    from anonymous import InvalidSession
+    from app import db, guests
+
+    token = guests.issue()
+    with app.app_context():
+        user = guests.resolve(token, db.session)
+        start = user.last_seen_at
+        # a guest still using its token after the ttl keeps it
+        for days in (20, 40, 60):
+            assert guests.resolve(token, db.session, now=start + timedelta(days=days)).id == user.id
+        assert user.last_seen_at == start + timedelta(days=60)
+        with pytest.raises(InvalidSession):
+            guests.resolve(token, db.session, now=start + timedelta(days=60) + guests.ttl + timedelta(days=1))
+        # a token that never created a users row counts from when it was issued
+        with pytest.raises(InvalidSession):
+            guests.resolve(guests.issue(), db.session, now=start + guests.ttl + timedelta(days=1))
+
+
+def test_analytics(client, user_id):
+    client.post("/predict", json=dict(FEATURES, user_id=user_id))
+    log_periods(client, user_id)
+    payload = client.get("/analytics/predictions?group=age_band").json
+    assert payload["total"]["predictions"] >= 1
+    assert client.get("/analytics/cycle-lengths").status_code == 200
+    assert client.get("/analytics/predictions?group=bad").status_code == 400
+
+
+def test_service_routes(client):
+    # a request is recorded when the server closes its body
+    client.get("/models").close()
+    assert client.get("/risk-config").status_code == 200
+    metrics = client.get("/metrics")
+    assert metrics.status_code == 200
+    assert 'shecare_requests_total{route="/models",method="GET",status="200"}' in metrics.get_data(as_text=True)
+    plan = client.post("/nutrition/generate", json={"symptoms": ["anemia", "fatigue"]})
+    assert plan.status_code == 200
+    assert client.post("/nutrition/generate", json={"symptoms": []}).status_code == 400
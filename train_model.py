@@ -1,76 +1,278 @@
-import pandas as pd
-import pickle
+import argparse
+import json
+import multiprocessing
 import os
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import numpy as np
+import pandas as pd
+from scipy.special import expit
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.metrics import accuracy_score, log_loss, roc_auc_score
+from sklearn.model_selection import GridSearchCV, StratifiedKFold, cross_val_predict, train_test_split
+from sklearn.preprocessing import StandardScaler
+
+from inference import FEATURES, TARGETS
+from model_registry import LEGACY_PICKLES, MODEL_DIR, file_hash, publish
+
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATASET = os.path.join(BASE_DIR, "shecare_dataset_large.csv")
+
+_X = None
+_Y = None
+
+
+def load_dataset(path):
+    """Reads only the feature and target columns, with fixed dtypes."""
+    dtypes = {name: np.float64 for name in FEATURES}
+    dtypes.update({name: np.int8 for name in TARGETS})
+    df = pd.read_csv(path, usecols=FEATURES + TARGETS, dtype=dtypes)
+    return df[FEATURES].to_numpy(), df[TARGETS].to_numpy()
+
+
+def _init_worker(X, Y):
+    global _X, _Y
+    _X, _Y = X, Y
+
 
-# create model folder if not exists
-os.makedirs("model", exist_ok=True)
+def _latency_us(model, X, repeats=200):
+    row = X[:1]
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.predict(row)
+    single = (time.perf_counter() - start) / repeats
+    batch = X[:10000]
+    start = time.perf_counter()
+    model.predict(batch)
+    per_row = (time.perf_counter() - start) / len(batch)
+    return {"single_row": round(single * 1e6, 2), "batch_per_row": round(per_row * 1e6, 4)}
 
-# load dataset
-df = pd.read_csv(r"C:\Users\DELL\Desktop\new\SheCare\shecare_dataset_large.csv")
 
-# features
-features = [
-    "age",
-    "BMI",
-    "cycle_variation",
-    "acne_severity",
-    "hair_growth",
-    "fatigue",
-    "hemoglobin",
-    "breast_lump",
-    "breast_pain"
-]
+def platt_scaling(model, X, y, cv):
+    """Fits p = expit(slope * z + intercept) on out-of-fold decision values z.
 
-X = df[features]
+    Each fold's z comes from a copy of `model` trained without that fold, so
+    the calibration is not fitted on scores the model has already seen. The
+    targets are Platt's smoothed (n+ + 1) / (n+ + 2) and 1 / (n- + 2), which
+    keeps the fit finite when the folds separate the classes perfectly.
+    """
+    z = cross_val_predict(model, X, y, cv=cv, method="decision_function")
+    positives = int(y.sum())
+    target = np.where(y == 1, (positives + 1) / (positives + 2), 1 / (len(y) - positives + 2))
+    # soft targets as a weighted pair of hard-labelled copies of every row
+    scaler = LogisticRegression(C=1e6).fit(  # effectively unregularized
+        np.r_[z, z][:, None], np.r_[np.ones(len(z)), np.zeros(len(z))], sample_weight=np.r_[target, 1 - target]
+    )
+    return {"slope": float(scaler.coef_[0, 0]), "intercept": float(scaler.intercept_[0])}
 
-# ================= PCOS MODEL =================
 
-y_pcos = df["pcos_risk"]
+def fit_target(index, grid, folds, seed, test_size):
+    """Grid-searches C with stratified k-fold CV and evaluates on a held-out split.
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y_pcos, test_size=0.2, random_state=42
-)
+    The Platt calibration is fitted on the same folds for the chosen C.
+    """
+    y = _Y[:, index]
+    X_train, X_test, y_train, y_test = train_test_split(
+        _X, y, test_size=test_size, random_state=seed, stratify=y
+    )
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    search = GridSearchCV(LogisticRegression(max_iter=1000), {"C": grid}, scoring="roc_auc", cv=cv, n_jobs=1)
+    start = time.perf_counter()
+    search.fit(X_train, y_train)
+    calibration = platt_scaling(LogisticRegression(max_iter=1000, C=search.best_params_["C"]), X_train, y_train, cv)
+    fit_seconds = time.perf_counter() - start
+    model = search.best_estimator_
+    best = search.best_index_
+    z_test = model.decision_function(X_test)
+    calibrated = expit(z_test * calibration["slope"] + calibration["intercept"])
+    metrics = {
+        "best_C": search.best_params_["C"],
+        "cv_auc_mean": round(float(search.cv_results_["mean_test_score"][best]), 4),
+        "cv_auc_std": round(float(search.cv_results_["std_test_score"][best]), 4),
+        "test_accuracy": round(float(accuracy_score(y_test, model.predict(X_test))), 4),
+        "test_auc": round(float(roc_auc_score(y_test, model.predict_proba(X_test)[:, 1])), 4),
+        "test_log_loss": round(float(log_loss(y_test, expit(z_test), labels=[0, 1])), 4),
+        "test_log_loss_calibrated": round(float(log_loss(y_test, calibrated, labels=[0, 1])), 4),
+        "fit_seconds": round(fit_seconds, 3),
+        "inference_latency_us": _latency_us(model, X_test)
+    }
+    return TARGETS[index], model, metrics, calibration
 
-pcos_model = LogisticRegression(max_iter=1000)
-pcos_model.fit(X_train, y_train)
 
-pickle.dump(pcos_model, open("model/pcos_model.pkl", "wb"))
+def train(dataset, out_dir, grid, folds, seed, test_size, workers):
+    start = time.perf_counter()
+    X, Y = load_dataset(dataset)
+    load_seconds = time.perf_counter() - start
+    training_hash = file_hash(dataset)
+    os.makedirs(out_dir, exist_ok=True)
 
-print("PCOS model saved")
+    args = [(i, grid, folds, seed, test_size) for i in range(len(TARGETS))]
+    if workers <= 1:
+        _init_worker(X, Y)
+        results = [fit_target(*a) for a in args]
+    else:
+        # fork shares the loaded arrays with the workers instead of pickling them
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("fork" if "fork" in methods else None)
+        with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(X, Y)) as pool:
+            results = list(pool.map(fit_target, *zip(*args)))
 
+    report = {
+        "dataset": os.path.abspath(dataset),
+        "training_hash": training_hash,
+        "rows": int(len(X)),
+        "features": FEATURES,
+        "seed": seed,
+        "folds": folds,
+        "grid": {"C": grid},
+        "load_seconds": round(load_seconds, 3),
+        "models": {}
+    }
+    for name, model, metrics, calibration in results:
+        with open(os.path.join(out_dir, LEGACY_PICKLES[name]), "wb") as f:
+            pickle.dump(model, f)
+        metadata = publish(
+            name, model.coef_, model.intercept_, model.classes_,
+            FEATURES, training_hash, metrics, directory=out_dir, calibration=calibration
+        )
+        report["models"][name] = dict(
+            metrics, version=metadata["version"], artifact=metadata["artifact"], calibration=calibration
+        )
+        print("%s v%d: cv auc %.4f, test auc %.4f, test log loss %.4f -> %.4f calibrated, fit %.2fs" % (
+            name, metadata["version"], metrics["cv_auc_mean"], metrics["test_auc"], metrics["test_log_loss"],
+            metrics["test_log_loss_calibrated"], metrics["fit_seconds"]
+        ))
+    report["total_seconds"] = round(time.perf_counter() - start, 3)
+    return report
 
-# ================= ANEMIA MODEL =================
 
-y_anemia = df["anemia_risk"]
+def iter_chunks(path, chunksize):
+    dtypes = {name: np.float64 for name in FEATURES}
+    dtypes.update({name: np.int8 for name in TARGETS})
+    for chunk in pd.read_csv(path, usecols=FEATURES + TARGETS, dtype=dtypes, chunksize=chunksize):
+        yield chunk[FEATURES].to_numpy(), chunk[TARGETS].to_numpy()
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y_anemia, test_size=0.2, random_state=42
-)
 
-anemia_model = LogisticRegression(max_iter=1000)
-anemia_model.fit(X_train, y_train)
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
 
-pickle.dump(anemia_model, open("model/anemia_model.pkl", "wb"))
 
-print("Anemia model saved")
+def train_streaming(dataset, out_dir, chunksize, epochs, seed, alpha):
+    """Out-of-core training: memory is bounded by one chunk, not the file.
 
+    Pass 1 accumulates feature means/variances; each following epoch re-reads
+    the file and updates one log-loss SGDClassifier per target with
+    partial_fit on standardized, shuffled chunks. In the last epoch every
+    chunk is scored before it is learned from (progressive validation). The
+    scaler is folded into the coefficients, so the published artifacts are
+    plain linear models on raw features like the batch-trained ones.
+    """
+    start = time.perf_counter()
+    training_hash = file_hash(dataset)
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
 
-# ================= BREAST CANCER MODEL =================
+    scaler = StandardScaler()
+    rows = 0
+    for X, _ in iter_chunks(dataset, chunksize):
+        scaler.partial_fit(X)
+        rows += len(X)
+    scale = np.where(scaler.scale_ == 0, 1.0, scaler.scale_)
 
-y_bc = df["breast_cancer_risk"]
+    classifiers = [SGDClassifier(loss="log_loss", alpha=alpha, random_state=seed) for _ in TARGETS]
+    classes = np.array([0, 1])
+    progressive = [{"rows": 0, "correct": 0, "log_loss": 0.0} for _ in TARGETS]
+    for epoch in range(epochs):
+        last = epoch == epochs - 1
+        for X, Y in iter_chunks(dataset, chunksize):
+            order = rng.permutation(len(X))
+            Xs = (X[order] - scaler.mean_) / scale
+            Y = Y[order]
+            for i, clf in enumerate(classifiers):
+                y = Y[:, i]
+                if last and hasattr(clf, "coef_"):
+                    proba = clf.predict_proba(Xs)[:, 1]
+                    stats = progressive[i]
+                    stats["rows"] += len(y)
+                    stats["correct"] += int(((proba > 0.5) == y).sum())
+                    stats["log_loss"] += log_loss(y, proba, labels=classes) * len(y)
+                clf.partial_fit(Xs, y, classes=classes)
+    train_seconds = time.perf_counter() - start
 
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y_bc, test_size=0.2, random_state=42
-)
+    report = {
+        "mode": "streaming",
+        "dataset": os.path.abspath(dataset),
+        "training_hash": training_hash,
+        "rows": rows,
+        "chunksize": chunksize,
+        "epochs": epochs,
+        "seed": seed,
+        "alpha": alpha,
+        # one scaler pass plus one pass per epoch
+        "rows_per_second": round(rows * (epochs + 1) / train_seconds, 1),
+        "models": {}
+    }
+    for name, clf, stats in zip(TARGETS, classifiers, progressive):
+        coef = clf.coef_[0] / scale
+        intercept = clf.intercept_[0] - float(np.dot(coef, scaler.mean_))
+        clf.coef_ = coef[None, :]
+        clf.intercept_ = np.array([intercept])
+        metrics = {
+            "progressive_accuracy": round(stats["correct"] / stats["rows"], 4) if stats["rows"] else None,
+            "progressive_log_loss": round(stats["log_loss"] / stats["rows"], 4) if stats["rows"] else None
+        }
+        with open(os.path.join(out_dir, LEGACY_PICKLES[name]), "wb") as f:
+            pickle.dump(clf, f)
+        metadata = publish(name, clf.coef_, clf.intercept_, clf.classes_, FEATURES, training_hash, metrics, directory=out_dir)
+        report["models"][name] = dict(metrics, version=metadata["version"], artifact=metadata["artifact"])
+        print("%s v%d: progressive accuracy %s" % (name, metadata["version"], metrics["progressive_accuracy"]))
+    report["total_seconds"] = round(time.perf_counter() - start, 3)
+    report["peak_rss_mb"] = peak_rss_mb()
+    print("Streamed %d rows x %d passes at %.0f rows/s, peak RSS %s MB" % (
+        rows, epochs + 1, report["rows_per_second"], report["peak_rss_mb"]
+    ))
+    return report
 
-bc_model = LogisticRegression(max_iter=1000)
-bc_model.fit(X_train, y_train)
 
-pickle.dump(bc_model, open("model/breast_cancer_model.pkl", "wb"))
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train and publish the SheCare risk models")
+    parser.add_argument("--data", default=DEFAULT_DATASET, help="training CSV")
+    parser.add_argument("--out", default=MODEL_DIR, help="model registry directory")
+    parser.add_argument("--report", help="JSON report path (default: <out>/training_report.json)")
+    parser.add_argument("--folds", type=int, default=5, help="cross-validation folds")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for splits")
+    parser.add_argument("--test-size", type=float, default=0.2, help="held-out fraction")
+    parser.add_argument("--C", default="0.01,0.1,1,10", help="comma-separated regularization grid")
+    parser.add_argument("--workers", type=int, default=min(len(TARGETS), os.cpu_count() or 1),
+                        help="processes (one target per process)")
+    parser.add_argument("--streaming", action="store_true",
+                        help="train incrementally in chunks (for datasets larger than RAM)")
+    parser.add_argument("--chunksize", type=int, default=100000, help="rows per chunk in --streaming mode")
+    parser.add_argument("--epochs", type=int, default=5, help="passes over the data in --streaming mode")
+    parser.add_argument("--alpha", type=float, default=1e-4, help="SGD regularization in --streaming mode")
+    args = parser.parse_args(argv)
 
-print("Breast Cancer model saved")
+    if args.streaming:
+        report = train_streaming(args.data, args.out, args.chunksize, args.epochs, args.seed, args.alpha)
+    else:
+        grid = [float(c) for c in args.C.split(",")]
+        report = train(args.data, args.out, grid, args.folds, args.seed, args.test_size, args.workers)
+    report_path = args.report or os.path.join(args.out, "training_report.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print("All models trained successfully in %.2fs, report: %s" % (report["total_seconds"], report_path))
 
 
-print("All models trained successfully")
+if __name__ == "__main__":
+    main()
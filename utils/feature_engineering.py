@@ -1,3 +1,14 @@
+import numpy as np
+
+
+ACNE_SEVERITY = {
+    "none": 0,
+    "mild": 1,
+    "moderate": 2,
+    "severe": 3
+}
+
+
 def calculate_bmi(height_cm, weight_kg):
     height_m = height_cm / 100
     bmi = weight_kg / (height_m ** 2)
@@ -9,10 +20,133 @@ def calculate_cycle_variation(cycles):
 
 
 def convert_acne_severity(severity):
-    mapping = {
-        "none": 0,
-        "mild": 1,
-        "moderate": 2,
-        "severe": 3
-    }
-    return mapping.get(severity.lower(), 0)
+    return ACNE_SEVERITY.get(severity.lower(), 0)
+
+
+def to_float(values):
+    """Converts a column to float64 in one call; unparseable entries become NaN.
+
+    So do nested ones ([30], [1, 2]): numpy would otherwise build a 2-D column
+    from them, or take a one-item list as its item.
+    """
+    try:
+        out = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        out = None
+    if out is None or out.ndim != 1:
+        out = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                out[i] = float(value)
+            except (TypeError, ValueError):
+                out[i] = np.nan
+    return out
+
+
+def bmi(height_cm, weight_kg):
+    height_m = to_float(height_cm) / 100
+    with np.errstate(divide="ignore", invalid="ignore"):
+        values = to_float(weight_kg) / (height_m * height_m)
+    values[~np.isfinite(values)] = np.nan
+    return np.round(values, 2)
+
+
+def cycle_variation(user_ids, cycle_lengths, window):
+    """Per-user max - min of the first `window` valid cycle lengths.
+
+    Takes parallel arrays (e.g. user_id and cycle_length from period_logs,
+    newest first within each user) and returns (unique_user_ids, variation)
+    without a per-user Python loop. Zero and NaN cycle lengths are ignored;
+    users with no valid cycle get NaN.
+    """
+    user_ids = np.asarray(user_ids)
+    cycles = to_float(cycle_lengths)
+    valid = ~np.isnan(cycles) & (cycles != 0)
+    users = np.unique(user_ids)
+    result = np.full(len(users), np.nan)
+    if not valid.any():
+        return users, result
+    order = np.argsort(user_ids[valid], kind="stable")
+    sorted_users = user_ids[valid][order]
+    sorted_cycles = cycles[valid][order]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    # position of each cycle within its user's run; only the newest `window` count
+    rank = np.arange(len(sorted_users)) - np.repeat(starts, np.diff(np.r_[starts, len(sorted_users)]))
+    recent = rank < window
+    sorted_users, sorted_cycles = sorted_users[recent], sorted_cycles[recent]
+    starts = np.flatnonzero(np.r_[True, sorted_users[1:] != sorted_users[:-1]])
+    spread = np.maximum.reduceat(sorted_cycles, starts) - np.minimum.reduceat(sorted_cycles, starts)
+    result[np.searchsorted(users, sorted_users[starts])] = spread
+    return users, result
+
+
+def acne_severity(values):
+    """Maps severity labels ("mild", "Severe", ...) or numeric codes to 0-3.
+
+    Unknown labels map to 0 like convert_acne_severity; missing values stay NaN.
+    """
+    if not (isinstance(values, np.ndarray) and values.ndim == 1):
+        values = np.fromiter(values, dtype=object, count=len(values))
+    numeric = to_float(values)
+    labels = np.array([v if isinstance(v, str) else "" for v in values], dtype=str)
+    is_label = (np.char.str_len(labels) > 0) & np.isnan(numeric)
+    if is_label.any():
+        uniques, inverse = np.unique(np.char.lower(np.char.strip(labels[is_label])), return_inverse=True)
+        codes = np.array([ACNE_SEVERITY.get(u, 0) for u in uniques], dtype=np.float64)
+        numeric[is_label] = codes[inverse]
+    return numeric
+
+
+class FeatureSchema:
+    """Feature order and preprocessing shared by training and serving.
+
+    prepare() turns raw columns (a name -> sequence mapping, e.g. from a CSV
+    chunk or a batch of JSON records) into the model matrix: BMI is derived
+    from height/weight when it is missing, acne severity labels are mapped to
+    codes, and every row that still has a gap is reported instead of scored.
+    """
+
+    def __init__(self, features):
+        self.features = tuple(features)
+
+    def __len__(self):
+        return len(self.features)
+
+    def columns(self, records, extra=()):
+        names = self.features + ("height", "weight") + tuple(extra)
+        return {name: [record.get(name) for record in records] for name in names}
+
+    def prepare(self, columns):
+        """Returns (X, problems) where problems maps row index -> message."""
+        n = len(next(iter(columns.values()))) if columns else 0
+        absent = [None] * n
+        values = {}
+        for name in self.features:
+            column = columns.get(name, absent)
+            values[name] = acne_severity(column) if name == "acne_severity" else to_float(column)
+        if "BMI" in self.features and "height" in columns and "weight" in columns:
+            gap = np.isnan(values["BMI"])
+            if gap.any():
+                values["BMI"][gap] = bmi(columns["height"], columns["weight"])[gap]
+        X = np.column_stack([values[name] for name in self.features]) if n else np.empty((0, len(self)))
+        problems = {}
+        for row in np.flatnonzero(~np.isfinite(X).all(axis=1)).tolist():
+            name = self.features[int(np.flatnonzero(~np.isfinite(X[row]))[0])]
+            raw = columns.get(name, absent)[row]
+            if name == "BMI" and raw in (None, "") and "height" in columns:
+                raw = columns["height"][row]
+            problems[row] = ("Missing field '%s'" if raw in (None, "") else "Non-numeric value in '%s'") % name
+        return X, problems
+
+
+SCHEMA = FeatureSchema([
+    "age",
+    "BMI",
+    "cycle_variation",
+    "acne_severity",
+    "hair_growth",
+    "fatigue",
+    "hemoglobin",
+    "breast_lump",
+    "breast_pain"
+])